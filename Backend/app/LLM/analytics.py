@@ -0,0 +1,228 @@
+"""
+Deterministic analytics module.
+This module computes exact figures from survey and grade data (section rankings, GPAs,
+strongest and weakest subjects, grade distributions) so prompts can carry a compact
+summary instead of raw lists and the LLM does not have to do the arithmetic.
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+# Constants
+ANALYSIS_SECTIONS = [
+    "Thai_do_hoc_tap", "Su_dung_mang_xa_hoi", "Gia_dinh_Xa_hoi", "Ban_be",
+    "Moi_truong_hoc_tap", "Quan_ly_thoi_gian", "Tu_hoc", "Hop_tac_nhom",
+    "Tu_duy_phan_bien", "Tiep_thu_xu_ly_kien_thuc"
+]
+
+SECTION_LABELS = {
+    "Thai_do_hoc_tap": "Thái độ học tập",
+    "Su_dung_mang_xa_hoi": "Sử dụng mạng xã hội",
+    "Gia_dinh_Xa_hoi": "Gia đình – Xã hội",
+    "Ban_be": "Bạn bè",
+    "Moi_truong_hoc_tap": "Môi trường học tập",
+    "Quan_ly_thoi_gian": "Kỹ năng Quản lý thời gian",
+    "Tu_hoc": "Kỹ năng tự học",
+    "Hop_tac_nhom": "Kỹ năng làm việc nhóm",
+    "Tu_duy_phan_bien": "Tư duy phản biện",
+    "Tiep_thu_xu_ly_kien_thuc": "Tiếp thu & xử lý kiến thức"
+}
+
+# Survey levels by minimum 'phan_tram_diem' (stage 1 rating scale), highest first
+SECTION_LEVELS = [
+    (80.0, "Tốt/Thành thạo"),
+    (60.0, "Khá"),
+    (40.0, "Trung bình/Cần lưu ý"),
+    (0.0, "Yếu/Cần cải thiện đáng kể")
+]
+
+# Grade letter to GPA conversion
+GRADE_TO_GPA = {
+    "A+": 4.0, "A": 3.7, "B+": 3.5, "B": 3.0, "C+": 2.5,
+    "C": 2.0, "D+": 1.5, "D": 1.0, "F": 0.0
+}
+
+# Grade letter to rating (stage 2 rating scale)
+GRADE_LEVELS = {
+    "A+": "Xuất sắc", "A": "Xuất sắc", "B+": "Giỏi", "B": "Khá", "C+": "Khá",
+    "C": "Trung bình", "D+": "Yếu", "D": "Yếu", "F": "Không đạt"
+}
+
+GOOD_GRADE_MIN_GPA = GRADE_TO_GPA["B+"]   # "Giỏi" and above
+DEFAULT_TOP_N = 3
+
+
+def section_level(percentage: float) -> str:
+    """
+    Rate a survey section by its percentage score.
+
+    Args:
+        percentage (float): 'phan_tram_diem' of the section
+
+    Returns:
+        str: Level name from ``SECTION_LEVELS``
+    """
+    for threshold, level in SECTION_LEVELS:
+        if percentage >= threshold:
+            return level
+    return SECTION_LEVELS[-1][1]
+
+
+def rank_survey_sections(khaosat_info: Dict[str, Any], top_n: int = DEFAULT_TOP_N) -> Dict[str, Any]:
+    """
+    Rank the survey sections by percentage score.
+
+    Args:
+        khaosat_info (Dict[str, Any]): Survey information data
+        top_n (int): Number of strongest and weakest sections to list
+
+    Returns:
+        Dict[str, Any]: ``sections`` (highest score first, each with ``ma``, ``ten``,
+        ``phan_tram_diem`` and ``muc_do``), ``manh_nhat`` and ``can_cai_thien_nhat``
+        (section names, the latter lowest first)
+    """
+    sections = []
+    for key in ANALYSIS_SECTIONS:
+        section = khaosat_info.get(key)
+        if not isinstance(section, dict) or section.get("phan_tram_diem") is None:
+            continue
+        percentage = float(section["phan_tram_diem"])
+        sections.append({
+            "ma": key,
+            "ten": SECTION_LABELS[key],
+            "phan_tram_diem": percentage,
+            "muc_do": section_level(percentage)
+        })
+
+    # Stable sort keeps the questionnaire order between equal scores
+    sections.sort(key=lambda section: -section["phan_tram_diem"])
+    return {
+        "sections": sections,
+        "manh_nhat": [section["ten"] for section in sections[:top_n]],
+        "can_cai_thien_nhat": [section["ten"] for section in reversed(sections[-top_n:])]
+    }
+
+
+def _credits(subject: Dict[str, Any]) -> int:
+    try:
+        return int(float(str(subject.get("so_tin_chi", 0)).replace(',', '.')))
+    except ValueError:
+        return 0
+
+
+def _grade_points(subject: Dict[str, Any]) -> Optional[float]:
+    """GPA points of a subject, or None when it does not count towards the GPA."""
+    if subject.get("khong_tinh_diem_tbtl"):
+        return None
+    return GRADE_TO_GPA.get(str(subject.get("diem_tk_chu", "")).strip().upper())
+
+
+def _weighted_gpa(subjects: List[Dict[str, Any]]) -> Optional[float]:
+    total_credits = 0
+    total_points = 0.0
+    for subject in subjects:
+        points = _grade_points(subject)
+        credits = _credits(subject)
+        if points is None or credits <= 0:
+            continue
+        total_credits += credits
+        total_points += points * credits
+    return round(total_points / total_credits, 2) if total_credits else None
+
+
+def compute_gpa_by_semester(subjects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Credit-weighted GPA of each semester and cumulatively up to it.
+
+    For the cumulative GPA a retaken subject (same ``ma_mon``) counts with its
+    latest result only.
+
+    Args:
+        subjects (List[Dict[str, Any]]): Subjects with ``hoc_ky`` and ``ten_hoc_ky``
+
+    Returns:
+        List[Dict[str, Any]]: Oldest semester first, each with ``hoc_ky``, ``ten_hoc_ky``,
+        ``so_tin_chi``, ``gpa_hoc_ky`` and ``gpa_tich_luy`` (None when nothing counts)
+    """
+    semesters: Dict[str, Dict[str, Any]] = {}
+    for subject in subjects:
+        code = str(subject.get("hoc_ky", ""))
+        semester = semesters.setdefault(code, {"ten_hoc_ky": subject.get("ten_hoc_ky", code), "subjects": []})
+        semester["subjects"].append(subject)
+
+    results = []
+    latest_attempts: Dict[str, Dict[str, Any]] = {}
+    for code in sorted(semesters):
+        semester_subjects = semesters[code]["subjects"]
+        for index, subject in enumerate(semester_subjects):
+            latest_attempts[subject.get("ma_mon") or f"{code}:{index}"] = subject
+        results.append({
+            "hoc_ky": code,
+            "ten_hoc_ky": semesters[code]["ten_hoc_ky"],
+            "so_tin_chi": sum(_credits(subject) for subject in semester_subjects),
+            "gpa_hoc_ky": _weighted_gpa(semester_subjects),
+            "gpa_tich_luy": _weighted_gpa(list(latest_attempts.values()))
+        })
+    return results
+
+
+def grade_distribution(subjects: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """
+    Count subjects and credits per grade letter.
+
+    Args:
+        subjects (List[Dict[str, Any]]): Subjects with ``diem_tk_chu`` and ``so_tin_chi``
+
+    Returns:
+        Dict[str, Dict[str, int]]: Letter -> ``so_mon`` and ``so_tin_chi``, best grade first
+    """
+    distribution: Dict[str, Dict[str, int]] = {}
+    for letter in GRADE_TO_GPA:
+        matching = [subject for subject in subjects if str(subject.get("diem_tk_chu", "")).strip().upper() == letter]
+        if matching:
+            distribution[letter] = {
+                "so_mon": len(matching),
+                "so_tin_chi": sum(_credits(subject) for subject in matching)
+            }
+    return distribution
+
+
+def _subject_entry(subject: Dict[str, Any]) -> Dict[str, Any]:
+    letter = str(subject.get("diem_tk_chu", "")).strip().upper()
+    return {
+        "ten_mon": subject.get("ten_mon", ""),
+        "diem_chu": letter,
+        "diem_he_4": GRADE_TO_GPA.get(letter),
+        "so_tin_chi": _credits(subject),
+        "danh_gia": GRADE_LEVELS.get(letter, "Không xếp loại")
+    }
+
+
+def summarize_subjects(subjects: List[Dict[str, Any]], top_n: int = DEFAULT_TOP_N) -> Dict[str, Any]:
+    """
+    Summarize a group of subjects (e.g. the specialized ones).
+
+    Args:
+        subjects (List[Dict[str, Any]]): Subjects with grades and credits
+        top_n (int): Number of strongest and weakest subjects to list
+
+    Returns:
+        Dict[str, Any]: ``so_mon``, ``so_tin_chi``, ``gpa``, ``phan_bo_diem``,
+        ``mon_gioi_tro_len`` (every subject from B+ up), ``mon_can_cai_thien``
+        (every subject below B+), ``manh_nhat`` and ``yeu_nhat``
+    """
+    graded = [subject for subject in subjects if _grade_points(subject) is not None]
+    # Best grade first; among equal grades the subject with more credits weighs more
+    ranked = sorted(graded, key=lambda subject: (-_grade_points(subject), -_credits(subject)))
+    weakest = sorted(graded, key=lambda subject: (_grade_points(subject), -_credits(subject)))
+
+    return {
+        "so_mon": len(subjects),
+        "so_tin_chi": sum(_credits(subject) for subject in subjects),
+        "gpa": _weighted_gpa(subjects),
+        "phan_bo_diem": grade_distribution(subjects),
+        "mon_gioi_tro_len": [_subject_entry(s) for s in ranked if _grade_points(s) >= GOOD_GRADE_MIN_GPA],
+        "mon_can_cai_thien": [_subject_entry(s) for s in weakest if _grade_points(s) < GOOD_GRADE_MIN_GPA],
+        "manh_nhat": [_subject_entry(subject) for subject in ranked[:top_n]],
+        "yeu_nhat": [_subject_entry(subject) for subject in weakest[:top_n]]
+    }
@@ -0,0 +1,169 @@
+"""
+Chat history budgeting module.
+This module fits the stage-3 chat history into the chat context window: recent turns are
+sent verbatim and older turns are folded into a running summary kept with the session.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .tokens import estimate_message_tokens, estimate_tokens
+
+
+# Constants
+SUMMARY_REFILL_FRACTION = 0.6     # After folding, recent turns use at most this share of the budget
+SUMMARY_MAX_MESSAGE_CHARS = 4000  # Per-message cap for text sent to the summarizer
+SUMMARY_PREFIX = "Tóm tắt phần trò chuyện trước đó (phân tích và các câu hỏi đã trao đổi):\n"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Bạn tóm tắt hội thoại tư vấn học tập. Viết bằng tiếng Việt, tối đa 200 từ, giữ lại "
+    "các kết luận chính của bản phân tích, điểm mạnh/điểm yếu, lời khuyên đã đưa ra và "
+    "các câu hỏi của sinh viên. Không thêm thông tin mới."
+)
+
+
+def new_chat_summary() -> Dict[str, Any]:
+    """
+    Empty running summary.
+
+    Returns:
+        Dict[str, Any]: ``text`` (summary) and ``covered`` (number of history messages,
+        after the pinned system prompt, that the summary replaces)
+    """
+    return {"text": "", "covered": 0}
+
+
+def _summary_message(text: str) -> Dict[str, str]:
+    return {"role": "system", "content": SUMMARY_PREFIX + text}
+
+
+def _window_start(body: List[Dict[str, str]], lower: int, budget: int) -> int:
+    """
+    Find the oldest message of the most recent run that fits in ``budget`` tokens.
+
+    The newest message is always included, even when it alone exceeds the budget.
+    """
+    start = len(body)
+    used = 0
+    while start > lower:
+        cost = estimate_message_tokens(body[start - 1])
+        if start < len(body) and used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def build_summary_payload(
+    ollama_model: str,
+    previous_summary: str,
+    messages: List[Dict[str, str]],
+    num_ctx: int,
+    num_predict: int
+) -> Dict[str, Any]:
+    """
+    Build the non-streaming request that folds messages into the running summary.
+
+    Args:
+        ollama_model (str): Model name
+        previous_summary (str): Current summary (may be empty)
+        messages (List[Dict[str, str]]): Messages to fold in, oldest first
+        num_ctx (int): Context window for the request
+        num_predict (int): Maximum summary length in tokens
+
+    Returns:
+        Dict[str, Any]: Ollama /api/chat payload
+    """
+    role_names = {"user": "Sinh viên", "assistant": "Trợ lý", "system": "Hệ thống"}
+    transcript = "\n\n".join(
+        f"{role_names.get(message['role'], message['role'])}: {message['content'][:SUMMARY_MAX_MESSAGE_CHARS]}"
+        for message in messages
+    )
+    user_prompt = ""
+    if previous_summary:
+        user_prompt += f"Tóm tắt hiện có:\n{previous_summary}\n\n"
+    user_prompt += f"Nội dung mới cần gộp vào tóm tắt:\n{transcript}\n\nHãy viết lại bản tóm tắt đầy đủ."
+
+    return {
+        "model": ollama_model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "stream": False,
+        "options": {"temperature": 0.2, "num_ctx": num_ctx, "num_predict": num_predict}
+    }
+
+
+def fit_chat_history(
+    conversation_history: List[Dict[str, str]],
+    chat_summary: Dict[str, Any],
+    prompt_budget: int,
+    summarize: Optional[Callable[[str, List[Dict[str, str]]], str]] = None
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Choose the messages to send for a chat turn within a token budget.
+
+    The first message is kept when it is the system prompt. The newest turns that
+    fit are sent verbatim; anything older is represented by the running summary.
+    When turns fall out of the window they are folded into the summary with
+    ``summarize`` (the summary in ``chat_summary`` is updated in place). Folding
+    goes a little further back than needed, so it only happens every few turns.
+    If ``summarize`` is missing or fails, the turns are dropped for this request
+    and folding is retried next turn.
+
+    Args:
+        conversation_history (List[Dict[str, str]]): Full history, newest user message last
+        chat_summary (Dict[str, Any]): Running summary from ``new_chat_summary`` (modified in place)
+        prompt_budget (int): Tokens available for the prompt
+        summarize (Optional[Callable]): ``(previous_summary, messages) -> new_summary``
+
+    Returns:
+        Tuple[List[Dict[str, str]], int]: (messages to send, their estimated tokens)
+    """
+    pinned = conversation_history[:1] if conversation_history and conversation_history[0].get("role") == "system" else []
+    body = conversation_history[len(pinned):]
+    covered = min(chat_summary.get("covered", 0), len(body))
+
+    def fixed_cost() -> int:
+        cost = sum(estimate_message_tokens(message) for message in pinned)
+        if chat_summary.get("text"):
+            cost += estimate_message_tokens(_summary_message(chat_summary["text"]))
+        return cost
+
+    start = _window_start(body, covered, prompt_budget - fixed_cost())
+    if start > covered and summarize is not None:
+        # Fold past the minimum so the next few turns fit without another summary call
+        target = int((prompt_budget - fixed_cost()) * SUMMARY_REFILL_FRACTION)
+        fold_until = max(start, _window_start(body, covered, target))
+        try:
+            chat_summary["text"] = summarize(chat_summary.get("text", ""), body[covered:fold_until]).strip()
+            chat_summary["covered"] = covered = fold_until
+        except Exception as e:
+            print(f"Warning: Could not summarize chat history, dropping older turns instead: {e}")
+        start = _window_start(body, covered, prompt_budget - fixed_cost())
+
+    messages = list(pinned)
+    if chat_summary.get("text"):
+        messages.append(_summary_message(chat_summary["text"]))
+    messages.extend(body[start:])
+    return messages, sum(estimate_message_tokens(message) for message in messages)
+
+
+def summary_num_ctx(previous_summary: str, messages: List[Dict[str, str]], num_predict: int, step: int = 1024) -> int:
+    """
+    Context window large enough for a summary request (rounded up to ``step``).
+
+    Args:
+        previous_summary (str): Current summary
+        messages (List[Dict[str, str]]): Messages to fold in
+        num_predict (int): Maximum summary length in tokens
+        step (int): Rounding step
+
+    Returns:
+        int: num_ctx for the summary request
+    """
+    needed = estimate_tokens(SUMMARY_SYSTEM_PROMPT) + estimate_tokens(previous_summary) + num_predict + 64
+    needed += sum(
+        estimate_tokens(message["content"][:SUMMARY_MAX_MESSAGE_CHARS]) + 8 for message in messages
+    )
+    return -(-needed // step) * step
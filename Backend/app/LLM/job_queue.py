@@ -0,0 +1,651 @@
+"""
+Job queue module.
+This module keeps LLM jobs (e.g. whole analyses) in an embedded SQLite queue and runs them
+on a pool of worker threads, independent of any HTTP connection. Each job's server-sent
+events are stored with it, so any process sharing the database can report its status and
+stream its progress, and a reconnecting client can replay them from its Last-Event-ID and
+then continue live.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from metrics import JOB_QUEUE_WAIT_SECONDS, JOBS_FINISHED_TOTAL
+from .scheduler import QueueFullError
+
+
+# Job statuses
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Constants
+BUSY_TIMEOUT_MS = 5000
+DEFAULT_MAX_PENDING = 64
+DEFAULT_MAX_ATTEMPTS = 2
+DEFAULT_RETENTION_SECONDS = 86400
+DEFAULT_RETRY_AFTER = 30
+DEFAULT_WORKERS = 2
+POLL_SECONDS = 0.5           # Check for work / new events at least this often (other processes do not notify us)
+KEEPALIVE_SECONDS = 15.0     # SSE comment sent after this long without events
+EVENT_FLUSH_SECONDS = 0.1    # Buffered job events are written in one transaction this often ...
+EVENT_FLUSH_MAX = 256        # ... or as soon as this many are waiting
+EVENT_FLUSH_RETRIES = 3      # Attempts to store a finished job's last events before giving up
+HEARTBEAT_SECONDS = 30       # Running jobs are touched this often by their pool ...
+STALE_AFTER_SECONDS = 120    # ... and requeued by anyone once their heartbeat is this old
+
+SCHEMA_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        params TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker_id TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL,
+        result TEXT,
+        error TEXT
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_jobs_status
+        ON jobs (status, created_at)""",
+    """CREATE TABLE IF NOT EXISTS job_events (
+        job_id TEXT NOT NULL,
+        sequence INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        PRIMARY KEY (job_id, sequence)
+    ) WITHOUT ROWID"""
+]
+
+# A job handler turns the job's parameters into SSE events and may fill ``result``
+# (an ``error`` entry marks the job as failed)
+JobHandler = Callable[[Dict[str, Any], Dict[str, Any]], Iterator[str]]
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+    """
+    Split an SSE event ID of the form ``<job id>:<sequence>``.
+
+    Args:
+        event_id (Optional[str]): Value of the Last-Event-ID header
+
+    Returns:
+        Optional[Tuple[str, int]]: (job id, sequence) or None if the ID is missing or malformed
+    """
+    if not event_id:
+        return None
+    job_id, _, sequence = event_id.strip().rpartition(":")
+    if not job_id or not sequence.isdigit():
+        return None
+    return job_id, int(sequence)
+
+
+class JobQueue:
+    """
+    Persistent FIFO of jobs backed by SQLite in WAL mode.
+
+    Jobs are claimed atomically, so several worker pools (threads or
+    processes) can share one database. Jobs whose worker stopped sending
+    heartbeats are requeued until ``max_attempts`` runs were started, then
+    failed. Finished jobs and their events are deleted after
+    ``retention_seconds``.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retention_seconds: float = DEFAULT_RETENTION_SECONDS,
+        retry_after_seconds: int = DEFAULT_RETRY_AFTER
+    ):
+        """
+        Open (and create if needed) the job database.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            max_pending (int): Queued jobs at which new submissions are rejected
+            max_attempts (int): Runs of a job before a lost worker fails it
+            retention_seconds (float): How long finished jobs stay queryable
+            retry_after_seconds (int): Retry-After hint of rejected submissions
+        """
+        self.db_path = str(db_path)
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # Wakes workers and event streams of this process; other processes are picked up by polling
+        self._changed = threading.Condition()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            for statement in SCHEMA_STATEMENTS:
+                conn.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get the connection owned by the current thread.
+
+        Returns:
+            sqlite3.Connection: Thread-local database connection
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run a block in one immediate (write-locked) transaction, then wake up waiters.
+
+        Yields:
+            sqlite3.Connection: Connection inside the transaction
+        """
+        with self._write_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        with self._changed:
+            self._changed.notify_all()
+
+    def _write(self, statements: List[Tuple[str, Tuple[Any, ...]]]) -> List[sqlite3.Cursor]:
+        """
+        Run statements in one transaction.
+
+        Args:
+            statements (List[Tuple[str, Tuple[Any, ...]]]): (SQL, parameters) pairs
+
+        Returns:
+            List[sqlite3.Cursor]: Cursor of each statement
+        """
+        with self._transaction() as conn:
+            return [conn.execute(sql, params) for sql, params in statements]
+
+    def submit(self, job_type: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Queue a job.
+
+        Args:
+            job_type (str): Handler name
+            params (Optional[Dict[str, Any]]): JSON-serializable job parameters
+
+        Returns:
+            str: Job ID
+
+        Raises:
+            QueueFullError: If ``max_pending`` jobs are already queued
+        """
+        if self.max_pending and self.pending_count() >= self.max_pending:
+            raise QueueFullError(self.retry_after_seconds)
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        cutoff = now - self.retention_seconds
+        self._write([
+            ("DELETE FROM job_events WHERE job_id IN "
+             "(SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)", (cutoff,)),
+            ("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)),
+            ("INSERT INTO jobs (job_id, job_type, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+             (job_id, job_type, json.dumps(params or {}, ensure_ascii=False), JOB_QUEUED, now))
+        ])
+        return job_id
+
+    def pending_count(self) -> int:
+        """
+        Count queued jobs.
+
+        Returns:
+            int: Jobs waiting for a worker
+        """
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)
+        ).fetchone()[0]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's status.
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            Optional[Dict[str, Any]]: Job fields (with ``position`` while queued, 1 = next)
+                or None if the job is unknown or already deleted
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT job_id, job_type, params, status, attempts, created_at, started_at, finished_at, result, error "
+            "FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+
+        job = {
+            "job_id": row[0],
+            "type": row[1],
+            "params": json.loads(row[2]),
+            "status": row[3],
+            "attempts": row[4],
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7],
+            "result": json.loads(row[8]) if row[8] else None,
+            "error": row[9]
+        }
+        if job["status"] == JOB_QUEUED:
+            job["position"] = self.position(job_id, job["created_at"])
+        job["events"] = conn.execute(
+            "SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        return job
+
+    def status(self, job_id: str) -> Optional[Tuple[str, Optional[float], Optional[str]]]:
+        """
+        Get a job's status cheaply (for polling).
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            Optional[Tuple[str, Optional[float], Optional[str]]]: (status, created_at, job_id),
+                or None if the job is unknown
+        """
+        return self._connect().execute(
+            "SELECT status, created_at, job_id FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+
+    def position(self, job_id: str, created_at: float) -> int:
+        """
+        Get a queued job's place in the queue.
+
+        Args:
+            job_id (str): Job ID
+            created_at (float): The job's creation time
+
+        Returns:
+            int: 1-based position among queued jobs
+        """
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND (created_at, job_id) <= (?, ?)",
+            (JOB_QUEUED, created_at, job_id)
+        ).fetchone()[0]
+
+    def claim(self, worker_id: str, job_types: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest queued job, requeueing jobs of lost workers first.
+
+        Args:
+            worker_id (str): Claiming worker (stored for diagnostics)
+            job_types (Optional[List[str]]): Only claim these types (all if None)
+
+        Returns:
+            Optional[Dict[str, Any]]: ``job_id``, ``type``, ``params``, ``attempts`` and
+                ``waited`` (seconds queued) of the claimed job, or None if there is none
+        """
+        self.requeue_stale()
+
+        type_filter, type_params = "", ()
+        if job_types is not None:
+            if not job_types:
+                return None
+            type_filter = f" AND job_type IN ({', '.join('?' * len(job_types))})"
+            type_params = tuple(job_types)
+
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"SELECT job_id, job_type, params, attempts, created_at FROM jobs "
+                f"WHERE status = ?{type_filter} ORDER BY created_at, job_id LIMIT 1",
+                (JOB_QUEUED,) + type_params
+            ).fetchone()
+            if row:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                    "started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                    (JOB_RUNNING, worker_id, now, now, row[0])
+                )
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "type": row[1],
+            "params": json.loads(row[2]),
+            "attempts": row[3] + 1,
+            "waited": time.time() - row[4]
+        }
+
+    def requeue_stale(self, stale_after_seconds: float = STALE_AFTER_SECONDS) -> None:
+        """
+        Requeue running jobs whose heartbeat stopped, failing those out of attempts.
+
+        Args:
+            stale_after_seconds (float): Heartbeat age at which a worker is considered lost
+        """
+        cutoff = time.time() - stale_after_seconds
+        stale = self._connect().execute(
+            "SELECT job_id, attempts FROM jobs WHERE status = ? AND heartbeat_at < ?",
+            (JOB_RUNNING, cutoff)
+        ).fetchall()
+        for job_id, attempts in stale:
+            # Conditional updates: another process may have handled the job meanwhile
+            if attempts < self.max_attempts:
+                requeued = self._write([(
+                    "UPDATE jobs SET status = ?, worker_id = NULL WHERE job_id = ? AND status = ? AND heartbeat_at < ?",
+                    (JOB_QUEUED, job_id, JOB_RUNNING, cutoff)
+                )])[0].rowcount
+                if requeued:
+                    print(f"⚠️ Job {job_id} lost its worker, requeueing (attempt {attempts}/{self.max_attempts})")
+                    self.append_events(job_id, [f"data: {json.dumps({'job_id': job_id, 'status': 'restarted'})}\n\n"])
+            else:
+                failed = self._write([(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+                    "WHERE job_id = ? AND status = ? AND heartbeat_at < ?",
+                    (JOB_FAILED, time.time(), "Worker lost", job_id, JOB_RUNNING, cutoff)
+                )])[0].rowcount
+                if failed:
+                    print(f"⚠️ Job {job_id} lost its worker after {attempts} attempt(s), failing it")
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """
+        Mark running jobs as alive.
+
+        Args:
+            job_ids (List[str]): Jobs run by the calling pool
+        """
+        if not job_ids:
+            return
+        now = time.time()
+        self._write([("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ?", (now, job_id)) for job_id in job_ids])
+
+    def append_events(self, job_id: str, events: List[str]) -> None:
+        """
+        Store the next SSE events of a job in one transaction.
+
+        Args:
+            job_id (str): Job ID
+            events (List[str]): Formatted events (``data: ...\\n\\n``) without ``id:`` fields
+        """
+        if not events:
+            return
+        with self._transaction() as conn:
+            start = conn.execute(
+                "SELECT COALESCE(MAX(sequence) + 1, 0) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO job_events (job_id, sequence, event) VALUES (?, ?, ?)",
+                [(job_id, start + offset, event) for offset, event in enumerate(events)]
+            )
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ) -> None:
+        """
+        Record a job's outcome.
+
+        Args:
+            job_id (str): Job ID
+            status (str): ``JOB_DONE`` or ``JOB_FAILED``
+            result (Optional[Dict[str, Any]]): JSON-serializable result
+            error (Optional[str]): Failure reason
+        """
+        self._write([(
+            "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ?",
+            (status, time.time(), json.dumps(result, ensure_ascii=False) if result else None, error, job_id)
+        )])
+
+    def events(self, job_id: str, start: int = 0) -> List[Tuple[int, str]]:
+        """
+        Get a job's stored events from a sequence number on.
+
+        Args:
+            job_id (str): Job ID
+            start (int): First sequence number
+
+        Returns:
+            List[Tuple[int, str]]: (sequence, event) pairs in order
+        """
+        return self._connect().execute(
+            "SELECT sequence, event FROM job_events WHERE job_id = ? AND sequence >= ? ORDER BY sequence",
+            (job_id, start)
+        ).fetchall()
+
+    def wait_for_change(self, timeout: float = POLL_SECONDS) -> None:
+        """
+        Sleep until this process writes to the queue or the timeout passes.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+        """
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def stream(self, job_id: str, start: int = 0, keepalive_seconds: float = KEEPALIVE_SECONDS) -> Iterator[str]:
+        """
+        Yield a job's events from ``start`` on with ``id: <job id>:<sequence>`` fields until it finishes.
+
+        While the job waits for a worker, ``job_queued`` events (without an ID,
+        they are not stored) report its queue position whenever it changes.
+
+        Args:
+            job_id (str): Job ID
+            start (int): First sequence number to send
+            keepalive_seconds (float): Send an SSE comment after this long without events
+
+        Yields:
+            str: Server-sent event formatted strings
+        """
+        sequence = max(start, 0)
+        last_sent = time.monotonic()
+        last_position = None
+        while True:
+            # Status before events: events stored before the job finished are always seen
+            job_status = self.status(job_id)
+            batch = self.events(job_id, sequence)
+            for event_sequence, event in batch:
+                yield f"id: {job_id}:{event_sequence}\n{event}"
+                sequence = event_sequence + 1
+            if batch:
+                last_sent = time.monotonic()
+            elif job_status is None or job_status[0] in (JOB_DONE, JOB_FAILED):
+                return
+            else:
+                position = self.position(job_id, job_status[1]) if job_status[0] == JOB_QUEUED else None
+                if position is not None and position != last_position:
+                    last_position = position
+                    yield f"data: {json.dumps({'job_id': job_id, 'status': 'job_queued', 'position': position})}\n\n"
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= keepalive_seconds:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+
+            if not batch:
+                self.wait_for_change()
+
+
+class JobWorkerPool:
+    """
+    Worker threads draining a ``JobQueue``.
+
+    Each worker claims one job at a time and records the outcome. The events
+    its handler yields are buffered and a background thread stores them in
+    batches (one transaction per job every ``EVENT_FLUSH_SECONDS``), besides
+    keeping the heartbeat of the pool's running jobs fresh.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        handlers: Optional[Dict[str, JobHandler]] = None,
+        workers: int = DEFAULT_WORKERS
+    ):
+        """
+        Create the pool (no threads run until ``start``).
+
+        Args:
+            job_queue (JobQueue): Queue to drain
+            handlers (Optional[Dict[str, JobHandler]]): Handler per job type
+            workers (int): Number of worker threads
+        """
+        self.job_queue = job_queue
+        self.handlers = dict(handlers or {})
+        self.workers = workers
+        self._active: Dict[str, str] = {}   # worker ID -> job ID
+        self._pending: Dict[str, List[str]] = {}   # job ID -> events not stored yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()   # Keeps each job's batches in order
+        self._started = False
+
+    def start(self) -> None:
+        """Start the worker and heartbeat threads (once)."""
+        with self._lock:
+            if self._started or self.workers <= 0:
+                return
+            self._started = True
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for index in range(self.workers):
+            worker_id = f"{prefix}:{index}"
+            threading.Thread(target=self._work, args=(worker_id,), name=f"job-worker-{index}", daemon=True).start()
+        threading.Thread(target=self._background, name="job-background", daemon=True).start()
+        print(f"👷 Started {self.workers} job worker(s)")
+
+    def _work(self, worker_id: str) -> None:
+        while True:
+            try:
+                job = self.job_queue.claim(worker_id, list(self.handlers))
+            except sqlite3.Error as e:
+                print(f"Warning: Could not claim a job: {e}")
+                job = None
+            if job is None:
+                self.job_queue.wait_for_change()
+                continue
+
+            with self._lock:
+                self._active[worker_id] = job["job_id"]
+            try:
+                self._run(job)
+            except Exception as e:
+                # The job stays running; it is requeued once its heartbeat goes stale
+                print(f"Warning: Job {job['job_id']} could not be completed: {e}")
+            finally:
+                with self._lock:
+                    self._active.pop(worker_id, None)
+                    self._pending.pop(job["job_id"], None)
+
+    def _emit(self, job_id: str, event: str) -> None:
+        """Buffer an event of a running job; store the buffer right away once it is full."""
+        with self._lock:
+            pending = self._pending.setdefault(job_id, [])
+            pending.append(event)
+            full = len(pending) >= EVENT_FLUSH_MAX
+        if full:
+            self._flush(job_id)
+
+    def _flush(self, job_id: Optional[str] = None) -> bool:
+        """
+        Store buffered events, one transaction per job.
+
+        Events that could not be written are put back in front of the buffer
+        and retried on the next flush.
+
+        Args:
+            job_id (Optional[str]): Only flush this job (None flushes every job)
+
+        Returns:
+            bool: True if every flushed event was stored
+        """
+        with self._flush_lock:
+            with self._lock:
+                job_ids = [job_id] if job_id is not None else list(self._pending)
+                batches = [(jid, self._pending.pop(jid)) for jid in job_ids if self._pending.get(jid)]
+
+            stored = True
+            for jid, events in batches:
+                try:
+                    self.job_queue.append_events(jid, events)
+                except sqlite3.Error as e:
+                    print(f"Warning: Could not store {len(events)} event(s) of job {jid}: {e}")
+                    stored = False
+                    with self._lock:
+                        self._pending[jid] = events + self._pending.get(jid, [])
+            return stored
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job_id, job_type = job["job_id"], job["type"]
+        JOB_QUEUE_WAIT_SECONDS.observe(job["waited"], job_type=job_type)
+        print(f"▶️ Job {job_id} ({job_type}) started after {job['waited']:.1f}s in queue")
+
+        result: Dict[str, Any] = {}
+        status, error = JOB_DONE, None
+        try:
+            for event in self.handlers[job_type](job["params"], result):
+                self._emit(job_id, event)
+            error = result.pop("error", None)
+        except Exception as e:
+            print(f"Error in job {job_id}: {e}")
+            error = f"Unexpected error: {e}"
+            self._emit(job_id, f"data: {json.dumps({'error': error})}\n\n")
+
+        if error:
+            status = JOB_FAILED
+        # Every event must be stored before the job is marked finished, or streams would stop short
+        for _ in range(EVENT_FLUSH_RETRIES):
+            if self._flush(job_id):
+                break
+            time.sleep(POLL_SECONDS)
+        else:
+            print(f"Warning: Job {job_id} left running, its events could not be stored")
+            return
+        try:
+            self.job_queue.finish(job_id, status, result, error)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not record the outcome of job {job_id}: {e}")
+            return
+        JOBS_FINISHED_TOTAL.inc(job_type=job_type, status=status)
+        print(f"{'✅' if status == JOB_DONE else '❌'} Job {job_id} ({job_type}) {status}")
+
+    def _background(self) -> None:
+        next_heartbeat = time.monotonic() + HEARTBEAT_SECONDS
+        while True:
+            time.sleep(EVENT_FLUSH_SECONDS)
+            self._flush()
+            if time.monotonic() < next_heartbeat:
+                continue
+            next_heartbeat = time.monotonic() + HEARTBEAT_SECONDS
+            with self._lock:
+                job_ids = list(self._active.values())
+            try:
+                self.job_queue.heartbeat(job_ids)
+            except sqlite3.Error as e:
+                print(f"Warning: Job heartbeat failed: {e}")
@@ -0,0 +1,159 @@
+"""
+Map-reduce module for long analysis inputs.
+This module runs the map calls of a map-reduce stage (short summaries of input chunks) in
+parallel across the Ollama backends and reports their progress as server-sent events.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+from metrics import LLM_GENERATION_SECONDS, LLM_MODEL_GENERATIONS_TOTAL, OLLAMA_ERRORS_TOTAL, OLLAMA_TIMEOUTS_TOTAL
+from .ollama_client import OllamaClient, get_default_client
+from .response_cache import ResponseCache, make_cache_key
+from .scheduler import GenerationScheduler, QueueFullError, PRIORITY_ANALYSIS
+
+
+# Constants
+MAP_TIMEOUT = 300
+MAP_TASK_SUFFIX = "_map"   # Metrics task of a stage's map calls, e.g. "stage2_diem_map"
+
+
+def _summarize_chunk(
+    ollama_api_url: str,
+    payload: Dict[str, Any],
+    task: str,
+    client: OllamaClient,
+    scheduler: Optional[GenerationScheduler],
+    priority: int,
+    response_cache: Optional[ResponseCache],
+    bypass_cache: bool,
+    cancelled: threading.Event
+) -> Tuple[str, bool]:
+    """
+    Run one map call, answering from the cache when possible.
+
+    A call whose map phase was abandoned (``cancelled`` set) while it waited
+    for a scheduler slot gives the slot back without generating.
+
+    Returns:
+        Tuple[str, bool]: (summary text, whether it came from the cache)
+    """
+    cache_key = make_cache_key(payload) if response_cache else None
+    if cache_key and not bypass_cache:
+        cached_summary = response_cache.get(cache_key)
+        if cached_summary is not None:
+            return cached_summary, True
+
+    ticket = scheduler.submit(priority) if scheduler else None
+    try:
+        if ticket:
+            for _ in ticket.wait_positions():
+                pass
+        if cancelled.is_set():
+            return "", False
+        LLM_MODEL_GENERATIONS_TOTAL.inc(task=task, model=payload["model"])
+        with LLM_GENERATION_SECONDS.time(task=task):
+            summary = client.post_json(ollama_api_url, payload, MAP_TIMEOUT)["message"]["content"]
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+
+    if cache_key:
+        response_cache.put(cache_key, summary)
+    return summary, False
+
+
+def stream_map_phase(
+    stage_key: str,
+    map_payloads: Sequence[Tuple[str, Dict[str, Any]]],
+    ollama_api_urls: Sequence[str],
+    summaries_ref: List[Tuple[str, str]],
+    client: Optional[OllamaClient] = None,
+    scheduler: Optional[GenerationScheduler] = None,
+    priority: int = PRIORITY_ANALYSIS,
+    response_cache: Optional[ResponseCache] = None,
+    bypass_cache: bool = False
+) -> Iterator[str]:
+    """
+    Summarize every chunk of a stage, spreading the calls over the backends.
+
+    A ``map_reduce`` event announces the number of chunks and a ``map_done``
+    event follows each finished chunk. Calls wait for scheduler slots like any
+    other generation. When every chunk succeeds, ``summaries_ref`` receives the
+    (label, summary) pairs in chunk order; on the first failure (or when the
+    consumer stops reading) it is left empty and the phase returns at once, so
+    the caller can fall back to a single pass. The other chunks are abandoned:
+    calls still waiting for a slot give it up, calls already generating finish
+    in the background.
+
+    Args:
+        stage_key (str): Analysis stage the chunks belong to
+        map_payloads (Sequence[Tuple[str, Dict[str, Any]]]): (chunk label, non-streaming payload)
+        ollama_api_urls (Sequence[str]): Ollama /api/chat URLs, used round-robin
+        summaries_ref (List[Tuple[str, str]]): Receives the summaries (replaced in place)
+        client (Optional[OllamaClient]): Pooled client to use (shared default if omitted)
+        scheduler (Optional[GenerationScheduler]): Concurrency limiter for Ollama generations
+        priority (int): Scheduler priority class
+        response_cache (Optional[ResponseCache]): Cache of finished chunk summaries
+        bypass_cache (bool): Skip the cache lookup (fresh summaries are still stored)
+
+    Yields:
+        str: Server-sent event formatted strings
+    """
+    summaries_ref[:] = []
+    if not map_payloads:
+        return
+
+    task = stage_key + MAP_TASK_SUFFIX
+    client = client or get_default_client()
+    chunk_count = len(map_payloads)
+    results: List[Optional[str]] = [None] * chunk_count
+    yield f"data: {json.dumps({'stage': stage_key, 'status': 'map_reduce', 'chunks': chunk_count})}\n\n"
+
+    # Managed by hand: leaving a ``with`` block would wait for every chunk after a failure
+    pool = ThreadPoolExecutor(max_workers=chunk_count)
+    cancelled = threading.Event()
+    finished = False
+    try:
+        futures = {
+            pool.submit(
+                _summarize_chunk, ollama_api_urls[index % len(ollama_api_urls)], payload, task,
+                client, scheduler, priority, response_cache, bypass_cache, cancelled
+            ): index
+            for index, (_, payload) in enumerate(map_payloads)
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            results[index], cached = future.result()
+            progress_event = json.dumps({
+                'stage': stage_key,
+                'status': 'map_done',
+                'chunk': map_payloads[index][0],
+                'completed': completed,
+                'chunks': chunk_count,
+                'cached': cached
+            })
+            yield f"data: {progress_event}\n\n"
+        finished = True
+    except QueueFullError:
+        OLLAMA_ERRORS_TOTAL.inc(task=task, error_type="queue_full")
+        print(f"Warning: {stage_key} map call could not be queued, falling back to a single pass")
+        return
+    except requests.exceptions.Timeout:
+        OLLAMA_TIMEOUTS_TOTAL.inc(task=task)
+        print(f"Warning: {stage_key} map call timed out, falling back to a single pass")
+        return
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        OLLAMA_ERRORS_TOTAL.inc(task=task, error_type="request")
+        print(f"Warning: {stage_key} map call failed, falling back to a single pass: {e}")
+        return
+    finally:
+        if not finished:
+            cancelled.set()
+        pool.shutdown(wait=finished, cancel_futures=not finished)
+
+    summaries_ref[:] = [(label, summary) for (label, _), summary in zip(map_payloads, results)]
@@ -0,0 +1,237 @@
+"""
+Model routing module.
+This module maps each LLM task (analysis stages, chat, chat summaries) to a model and its
+options, and falls back to a smaller model when the generation queue is long or recent
+time to first token exceeds the task's latency SLO.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Mapping, Optional, Tuple
+
+from metrics import LLM_MODEL_FALLBACKS_TOTAL
+from .scheduler import GenerationScheduler
+
+
+# Routed tasks
+TASK_STAGE1 = "stage1"
+TASK_STAGE2 = "stage2"
+TASK_STAGE3 = "stage3"
+TASK_CHAT = "chat"
+TASK_SUMMARY = "summary"
+ROUTE_TASKS = (TASK_STAGE1, TASK_STAGE2, TASK_STAGE3, TASK_CHAT, TASK_SUMMARY)
+
+# Fallback reasons (reported in SSE events and metrics)
+FALLBACK_QUEUE_DEPTH = "queue_depth"
+FALLBACK_LATENCY_SLO = "latency_slo"
+
+# Constants
+DEFAULT_FALLBACK_QUEUE_DEPTH = 4
+DEFAULT_TTFT_SLO_SECONDS = 15.0
+DEFAULT_LATENCY_WINDOW_SECONDS = 300
+DEFAULT_LATENCY_SAMPLES = 5
+
+
+class ModelRoute:
+    """Model, smaller fallback model and extra Ollama options serving one task."""
+
+    def __init__(
+        self,
+        model: str,
+        fallback_model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        ttft_slo_seconds: Optional[float] = None
+    ):
+        """
+        Create the route.
+
+        Args:
+            model (str): Model used normally
+            fallback_model (Optional[str]): Smaller model used under load (None never falls back)
+            options (Optional[Dict[str, Any]]): Ollama options overriding the task defaults
+            ttft_slo_seconds (Optional[float]): Recent time to first token above which the
+                fallback model is used (None or 0 disables the latency check)
+        """
+        self.model = model
+        self.fallback_model = fallback_model if fallback_model != model else None
+        self.options = dict(options or {})
+        self.ttft_slo_seconds = ttft_slo_seconds or None
+
+
+def default_routes(
+    large_model: str,
+    small_model: str,
+    ttft_slo_seconds: Optional[float] = DEFAULT_TTFT_SLO_SECONDS,
+    overrides: Optional[Mapping[str, Mapping[str, Any]]] = None
+) -> Dict[str, ModelRoute]:
+    """
+    Build the routing table.
+
+    Stage 1 (ranking already computed), chat follow-ups and summaries run on the
+    small model; stages 2 and 3 use the large one and fall back to the small one.
+
+    Args:
+        large_model (str): Large tier model
+        small_model (str): Small tier model
+        ttft_slo_seconds (Optional[float]): Latency SLO of the routes that can fall back
+        overrides (Optional[Mapping[str, Mapping[str, Any]]]): Per-task fields replacing the
+            defaults (``model``, ``fallback_model``, ``options``, ``ttft_slo_seconds``)
+
+    Returns:
+        Dict[str, ModelRoute]: Route of every task in ``ROUTE_TASKS``
+
+    Raises:
+        ValueError: If an override names an unknown task or field
+    """
+    table = {
+        TASK_STAGE1: {"model": small_model},
+        TASK_STAGE2: {"model": large_model, "fallback_model": small_model, "ttft_slo_seconds": ttft_slo_seconds},
+        TASK_STAGE3: {"model": large_model, "fallback_model": small_model, "ttft_slo_seconds": ttft_slo_seconds},
+        TASK_CHAT: {"model": small_model},
+        TASK_SUMMARY: {"model": small_model}
+    }
+    for task, fields in (overrides or {}).items():
+        if task not in table:
+            raise ValueError(f"Unknown model route task '{task}' (expected one of {', '.join(ROUTE_TASKS)})")
+        unknown = set(fields) - {"model", "fallback_model", "options", "ttft_slo_seconds"}
+        if unknown:
+            raise ValueError(f"Unknown field(s) {', '.join(sorted(unknown))} in model route '{task}'")
+        table[task].update(fields)
+    return {task: ModelRoute(**fields) for task, fields in table.items()}
+
+
+class ModelRouter:
+    """
+    Picks the model of each generation.
+
+    A task with a fallback model switches to it while the scheduler has at least
+    ``fallback_queue_depth`` foreground generations waiting (background work
+    such as precomputation does not count), or while the mean time to first
+    token of its last generations on the main model exceeds the route's SLO.
+    Latency samples expire after ``latency_window_seconds``, so the main model
+    is tried again once the window has passed.
+    """
+
+    def __init__(
+        self,
+        routes: Mapping[str, ModelRoute],
+        fallback_queue_depth: int = DEFAULT_FALLBACK_QUEUE_DEPTH,
+        latency_window_seconds: float = DEFAULT_LATENCY_WINDOW_SECONDS,
+        latency_samples: int = DEFAULT_LATENCY_SAMPLES
+    ):
+        """
+        Create the router.
+
+        Args:
+            routes (Mapping[str, ModelRoute]): Route of each task
+            fallback_queue_depth (int): Waiting generations that trigger the fallback (0 disables)
+            latency_window_seconds (float): Age after which latency samples are ignored
+            latency_samples (int): Number of recent samples averaged per task
+        """
+        self.routes = dict(routes)
+        self.fallback_queue_depth = fallback_queue_depth
+        self.latency_window_seconds = latency_window_seconds
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = {
+            task: deque(maxlen=max(latency_samples, 1)) for task in self.routes
+        }
+        self._lock = threading.Lock()
+
+    def model_for(self, task: str) -> str:
+        """
+        Main model of a task.
+
+        Args:
+            task (str): Task name (``TASK_STAGE1``, ``TASK_CHAT``, ...)
+
+        Returns:
+            str: Model name
+        """
+        return self.routes[task].model
+
+    def models(self) -> List[str]:
+        """
+        Every model the routes may use (main and fallback), without duplicates.
+
+        Returns:
+            List[str]: Model names
+        """
+        models = []
+        for route in self.routes.values():
+            models.extend(model for model in (route.model, route.fallback_model) if model)
+        return list(dict.fromkeys(models))
+
+    def apply_options(self, task: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Merge the route's options into a payload's options.
+
+        Args:
+            task (str): Task name
+            payload (Dict[str, Any]): Ollama payload (modified in place)
+
+        Returns:
+            Dict[str, Any]: The same payload
+        """
+        options = self.routes[task].options
+        if options:
+            payload["options"] = {**payload.get("options", {}), **options}
+        return payload
+
+    def select(self, task: str, scheduler: Optional[GenerationScheduler] = None) -> Tuple[str, Optional[str]]:
+        """
+        Choose the model for a generation that is about to be queued.
+
+        Args:
+            task (str): Task name
+            scheduler (Optional[GenerationScheduler]): Scheduler whose queue depth is checked
+
+        Returns:
+            Tuple[str, Optional[str]]: (model, fallback reason or None when the main model is used)
+        """
+        route = self.routes[task]
+        if not route.fallback_model:
+            return route.model, None
+
+        reason = None
+        if scheduler is not None and 0 < self.fallback_queue_depth <= scheduler.foreground_queue_depth:
+            reason = FALLBACK_QUEUE_DEPTH
+        elif route.ttft_slo_seconds:
+            recent = self.recent_ttft(task)
+            if recent is not None and recent > route.ttft_slo_seconds:
+                reason = FALLBACK_LATENCY_SLO
+
+        if reason is None:
+            return route.model, None
+        LLM_MODEL_FALLBACKS_TOTAL.inc(task=task, reason=reason)
+        return route.fallback_model, reason
+
+    def observe_ttft(self, task: str, model: str, seconds: float) -> None:
+        """
+        Record the time to first token of a generation.
+
+        Only generations on the task's main model count towards its SLO.
+
+        Args:
+            task (str): Task name
+            model (str): Model that served the generation
+            seconds (float): Time to first token (or until the request failed)
+        """
+        if task not in self.routes or model != self.routes[task].model:
+            return
+        with self._lock:
+            self._latencies[task].append((time.monotonic(), seconds))
+
+    def recent_ttft(self, task: str) -> Optional[float]:
+        """
+        Mean time to first token of the task's recent main-model generations.
+
+        Args:
+            task (str): Task name
+
+        Returns:
+            Optional[float]: Mean in seconds, or None without samples in the window
+        """
+        cutoff = time.monotonic() - self.latency_window_seconds
+        with self._lock:
+            samples = [seconds for observed_at, seconds in self._latencies[task] if observed_at >= cutoff]
+        return sum(samples) / len(samples) if samples else None
@@ -0,0 +1,172 @@
+"""
+Pooled HTTP client for the Ollama API.
+This module provides a reusable client that keeps connections to Ollama hosts alive
+across analysis stages and chat turns.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Constants
+DEFAULT_POOL_CONNECTIONS = 4   # Number of distinct Ollama hosts kept in the pool
+DEFAULT_POOL_MAXSIZE = 16      # Keep-alive connections per host
+DEFAULT_POOL_BLOCK = False     # Open (and later discard) extra connections past the pool size instead of waiting
+
+
+class OllamaClient:
+    """
+    Thread-safe wrapper around a ``requests.Session`` with a sized connection pool.
+
+    Streaming requests are context managers, so the connection goes back to the pool
+    for the next stage or chat message once a response has been read. The client
+    also remembers the num_ctx last sent to each (URL, model), i.e. the context
+    the model is most likely loaded with there.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_block: bool = DEFAULT_POOL_BLOCK
+    ):
+        """
+        Create the client and its connection pool.
+
+        Args:
+            pool_connections (int): Number of per-host pools to cache
+            pool_maxsize (int): Maximum connections kept alive per host
+            pool_block (bool): Block when a host's pool is exhausted instead of opening extra connections
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # (API URL, model) -> (num_ctx or None for Ollama's default, monotonic time of the request)
+        self._last_contexts: Dict[Tuple[str, str], Tuple[Optional[int], float]] = {}
+        self._contexts_lock = threading.Lock()
+
+    def _record_context(self, api_url: str, payload: Dict[str, Any]) -> None:
+        model = payload.get("model")
+        if model:
+            num_ctx = (payload.get("options") or {}).get("num_ctx")
+            with self._contexts_lock:
+                self._last_contexts[(api_url, model)] = (num_ctx, time.monotonic())
+
+    def last_context(self, api_url: str, model: str) -> Optional[Tuple[Optional[int], float]]:
+        """
+        Get the context window of the last request for a model on a server.
+
+        Args:
+            api_url (str): Ollama API URL
+            model (str): Model name
+
+        Returns:
+            Optional[Tuple[Optional[int], float]]: (num_ctx or None if the request left it
+                to Ollama, ``time.monotonic()`` of the request), or None if never requested
+        """
+        with self._contexts_lock:
+            return self._last_contexts.get((api_url, model))
+
+    @contextmanager
+    def stream_chat(self, api_url: str, payload: Dict[str, Any], timeout: float) -> Iterator[requests.Response]:
+        """
+        Send a streaming chat request.
+
+        Callers should read the body to the end (Ollama closes it right after the
+        ``done`` chunk); leaving the terminating chunk unread makes the pool discard
+        the connection instead of reusing it.
+
+        Args:
+            api_url (str): Ollama ``/api/chat`` URL
+            payload (Dict[str, Any]): Request payload
+            timeout (float): Request timeout in seconds
+
+        Yields:
+            requests.Response: Open streaming response
+
+        Raises:
+            requests.exceptions.RequestException: On connection or HTTP errors
+        """
+        self._record_context(api_url, payload)
+        response = self.session.post(api_url, json=payload, stream=True, timeout=timeout)
+        try:
+            response.raise_for_status()
+            yield response
+        finally:
+            response.close()
+
+    def post_json(self, api_url: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """
+        Send a non-streaming request and decode the JSON body.
+
+        Args:
+            api_url (str): Ollama API URL
+            payload (Dict[str, Any]): Request payload
+            timeout (float): Request timeout in seconds
+
+        Returns:
+            Dict[str, Any]: Decoded response
+
+        Raises:
+            requests.exceptions.RequestException: On connection or HTTP errors
+        """
+        self._record_context(api_url, payload)
+        with self.session.post(api_url, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+
+_default_client: Optional[OllamaClient] = None
+_default_client_lock = threading.Lock()
+
+
+def configure_default_client(**kwargs: Any) -> OllamaClient:
+    """
+    Replace the shared client with one built from the given pool settings.
+
+    Args:
+        **kwargs: Keyword arguments for ``OllamaClient``
+
+    Returns:
+        OllamaClient: The new shared client
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = OllamaClient(**kwargs)
+        return _default_client
+
+
+def get_default_client() -> OllamaClient:
+    """
+    Get the client shared by all stages and chat turns, creating it on first use.
+
+    Returns:
+        OllamaClient: Shared client
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = OllamaClient()
+    return _default_client
@@ -5,13 +5,129 @@ This module handles streaming communication with the Ollama API for LLM analysis
 
 import requests
 import json
-from typing import Dict, List, Any, Iterator, Optional
+import time
+from typing import Callable, Dict, List, Any, Iterator, Optional, Tuple, Union
+
+from metrics import (
+    LLM_TIME_TO_FIRST_TOKEN, LLM_GENERATION_SECONDS, LLM_TOKENS_PER_SECOND, LLM_TOKENS_TOTAL,
+    LLM_PROMPT_TOKENS, LLM_CONTEXT_FILL_RATIO, LLM_MODEL_GENERATIONS_TOTAL, OLLAMA_ERRORS_TOTAL,
+    OLLAMA_TIMEOUTS_TOTAL
+)
+from .ollama_client import OllamaClient, get_default_client
+from .response_cache import ResponseCache, make_cache_key
+from .scheduler import GenerationScheduler, QueueFullError, PRIORITY_ANALYSIS, PRIORITY_INTERACTIVE
+from .chat_history import build_summary_payload, fit_chat_history, new_chat_summary, summary_num_ctx
+from .model_router import ModelRouter, TASK_CHAT, TASK_SUMMARY
+from .tokens import describe_payload_tokens, prompt_token_budget
 
 
 # Constants
 DEFAULT_TIMEOUT = 400
 CHAT_TIMEOUT = 180
-MAX_CHAT_HISTORY_MESSAGES = 10
+DEFAULT_CHAT_NUM_CTX = 4096          # Same window as stage 3, so Ollama keeps the model loaded as is
+CHAT_RESPONSE_RESERVE_TOKENS = 768   # Context kept free for the chat reply
+SUMMARY_MAX_TOKENS = 320             # Length cap of the running chat summary
+CACHE_REPLAY_CHUNK_CHARS = 512
+CHAT_METRICS_TASK = "chat"
+STRUCTURED_RESULT_SUFFIX = "_structured"   # analysis_results key suffix for a stage's compact JSON
+
+
+class _GenerationMetrics:
+    """Timing of one Ollama generation, recorded into the metrics registry."""
+
+    def __init__(self, task: str):
+        self.task = task
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.token_chunks = 0
+
+    @property
+    def time_to_first_token(self) -> float:
+        """Seconds until the first token, or so far when none has arrived yet."""
+        return (self.first_token_at or time.perf_counter()) - self.started_at
+
+    def on_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.started_at, task=self.task)
+        self.token_chunks += 1
+
+    def on_done(self, done_chunk: Dict[str, Any]) -> None:
+        finished_at = time.perf_counter()
+        LLM_GENERATION_SECONDS.observe(finished_at - self.started_at, task=self.task)
+
+        # Prefer Ollama's own counters (eval_duration is in nanoseconds)
+        token_count = done_chunk.get("eval_count") or self.token_chunks
+        eval_duration = done_chunk.get("eval_duration")
+        if eval_duration:
+            eval_seconds = eval_duration / 1e9
+        elif self.first_token_at is not None:
+            eval_seconds = finished_at - self.first_token_at
+        else:
+            eval_seconds = 0.0
+
+        LLM_TOKENS_TOTAL.inc(token_count, task=self.task)
+        if done_chunk.get("prompt_eval_count"):
+            LLM_PROMPT_TOKENS.observe(done_chunk["prompt_eval_count"], task=self.task, source="ollama")
+        if token_count and eval_seconds > 0:
+            LLM_TOKENS_PER_SECOND.observe(token_count / eval_seconds, task=self.task)
+
+
+class _TokenCoalescer:
+    """
+    Batches streamed tokens into larger SSE ``token`` frames.
+
+    Tokens are released when ``flush_ms`` milliseconds have passed since the last
+    frame or ``flush_bytes`` bytes (UTF-8) are buffered, whichever comes first.
+    The first token is always sent at once, so time to first token is unchanged.
+    The window is checked as tokens arrive; no timer thread is used. With both
+    limits at 0 every token gets its own frame.
+    """
+
+    def __init__(self, flush_ms: float = 0, flush_bytes: int = 0):
+        self.flush_seconds = flush_ms / 1000.0
+        self.flush_bytes = flush_bytes
+        self._parts: List[str] = []
+        self._buffered_bytes = 0
+        self._last_flush_at: Optional[float] = None
+
+    def add(self, token: str) -> Optional[str]:
+        """
+        Buffer a token.
+
+        Args:
+            token (str): Token text
+
+        Returns:
+            Optional[str]: Text to send now, or None while still buffering
+        """
+        self._parts.append(token)
+        if self.flush_seconds <= 0 and self.flush_bytes <= 0:
+            return self.flush()
+
+        self._buffered_bytes += len(token.encode('utf-8'))
+        if self._last_flush_at is None:
+            return self.flush()
+        if self.flush_bytes > 0 and self._buffered_bytes >= self.flush_bytes:
+            return self.flush()
+        if self.flush_seconds > 0 and time.perf_counter() - self._last_flush_at >= self.flush_seconds:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """
+        Release everything buffered.
+
+        Returns:
+            Optional[str]: Buffered text, or None if nothing is pending
+        """
+        self._last_flush_at = time.perf_counter()
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts = []
+        self._buffered_bytes = 0
+        return text
 
 
 def call_ollama_stream_logic(
@@ -19,157 +135,341 @@ def call_ollama_stream_logic(
     payload: Dict[str, Any],
     stage_key: str,
     analysis_results_ref: Dict[str, str],
-    conversation_history_ref: List[Dict[str, str]]
+    conversation_history_ref: List[Dict[str, str]],
+    client: Optional[OllamaClient] = None,
+    response_cache: Optional[ResponseCache] = None,
+    bypass_cache: bool = False,
+    scheduler: Optional[GenerationScheduler] = None,
+    priority: int = PRIORITY_ANALYSIS,
+    coalesce_ms: float = 0,
+    coalesce_bytes: int = 0,
+    render_structured: Optional[Callable[[str], Tuple[str, str]]] = None,
+    model_router: Optional[ModelRouter] = None,
+    route_task: Optional[str] = None
 ) -> Iterator[str]:
     """
     Call Ollama API and stream the response for analysis stages.
     
+    When a response cache is given, an identical payload (model, messages and
+    options) is answered by replaying the stored text instead of calling Ollama.
+    When a scheduler is given, the generation waits for a slot first and emits
+    ``queued`` events with its queue position meanwhile. Before generating, a
+    ``prompt_budget`` event reports the estimated prompt tokens and the num_ctx
+    they must fit in. Tokens are batched into larger ``token`` events according
+    to ``coalesce_ms``/``coalesce_bytes``.
+    
+    With ``render_structured`` the stage answers in JSON (payload ``format``), so
+    its tokens are not streamed. The finished answer is passed to
+    ``render_structured``, which validates it and returns (markdown, compact JSON);
+    the markdown is sent and stored as the stage result and the compact JSON is
+    stored under ``<stage_key>_structured``. A ``ValueError`` fails the stage.
+    
+    With ``model_router`` the payload's model (the route's main model) may be
+    swapped for the route's fallback before queueing; a cached answer of the
+    main model is still preferred. A ``model`` event names the serving model
+    (and ``fallback_reason`` if any), which the ``done`` event repeats.
+    
     Args:
         ollama_api_url (str): URL of the Ollama API
         payload (Dict[str, Any]): Request payload for the API
         stage_key (str): Key identifying the analysis stage
         analysis_results_ref (Dict[str, str]): Reference to store analysis results
         conversation_history_ref (List[Dict[str, str]]): Reference to conversation history
+        client (Optional[OllamaClient]): Pooled client to use (shared default if omitted)
+        response_cache (Optional[ResponseCache]): Cache of finished stage outputs
+        bypass_cache (bool): Skip the cache lookup (the fresh result is still stored)
+        scheduler (Optional[GenerationScheduler]): Concurrency limiter for Ollama generations
+        priority (int): Scheduler priority class
+        coalesce_ms (float): Send buffered tokens at least this often (0 disables the time window)
+        coalesce_bytes (int): Send buffered tokens once this many bytes are pending (0 disables)
+        render_structured (Optional[Callable[[str], Tuple[str, str]]]): Validator/renderer of JSON answers
+        model_router (Optional[ModelRouter]): Router choosing between the main and fallback model
+        route_task (Optional[str]): Routed task of this stage (``TASK_STAGE1``, ...)
         
     Yields:
         str: Server-sent event formatted strings
     """
+    candidates = [payload]
+    fallback_reason = None
+    if model_router is not None and route_task:
+        model, fallback_reason = model_router.select(route_task, scheduler)
+        if model != payload["model"]:
+            payload = {**payload, "model": model}
+            candidates.append(payload)
+
+    if response_cache and not bypass_cache:
+        for candidate in candidates:
+            cached_response = response_cache.get(make_cache_key(candidate))
+            if cached_response is None:
+                continue
+            try:
+                yield from _replay_cached_stage(
+                    stage_key, cached_response, candidate, analysis_results_ref, conversation_history_ref,
+                    render_structured
+                )
+                return
+            except ValueError as e:
+                print(f"Warning: Cached {stage_key} output is no longer valid, regenerating: {e}")
+
+    cache_key = make_cache_key(payload) if response_cache else None
     full_response_content = ""
+    client = client or get_default_client()
+    coalescer = _TokenCoalescer(coalesce_ms, coalesce_bytes)
+    ticket = None
+    generation_metrics = None
+    
+    prompt_size = describe_payload_tokens(payload)
+    LLM_PROMPT_TOKENS.observe(prompt_size['prompt_tokens'], task=stage_key, source="estimated")
+    if prompt_size['num_ctx']:
+        LLM_CONTEXT_FILL_RATIO.observe(prompt_size['prompt_tokens'] / prompt_size['num_ctx'], task=stage_key)
+    yield _format_sse_data({'stage': stage_key, 'status': 'prompt_budget', **prompt_size})
+    yield _format_sse_data(_model_event(payload["model"], fallback_reason, stage=stage_key))
     
     try:
-        response = requests.post(
-            ollama_api_url, 
-            json=payload, 
-            stream=True, 
-            timeout=DEFAULT_TIMEOUT
-        )
-        response.raise_for_status()
+        if scheduler:
+            ticket = scheduler.submit(priority)
+            for position in ticket.wait_positions():
+                yield _format_sse_data({'stage': stage_key, 'status': 'queued', 'queue_position': position})
 
-        for line in response.iter_lines():
-            if not line:
-                continue
+        generation_metrics = _GenerationMetrics(stage_key)
+        LLM_MODEL_GENERATIONS_TOTAL.inc(task=stage_key, model=payload["model"])
+        with client.stream_chat(ollama_api_url, payload, DEFAULT_TIMEOUT) as response:
+            # Read to the end of the body (no break on "done") so the connection is reused
+            for line in response.iter_lines():
+                if not line:
+                    continue
                 
-            decoded_line = line.decode('utf-8')
+                decoded_line = line.decode('utf-8')
             
-            try:
-                json_chunk = json.loads(decoded_line)
-                token = json_chunk.get("message", {}).get("content", "")
+                try:
+                    json_chunk = json.loads(decoded_line)
+                    token = json_chunk.get("message", {}).get("content", "")
                 
-                if token:
-                    full_response_content += token
-                    yield _format_sse_data({
-                        'stage': stage_key, 
-                        'token': token
-                    })
-
-                if json_chunk.get("done"):
-                    _finalize_analysis_stage(
-                        stage_key, 
-                        full_response_content, 
-                        payload, 
-                        analysis_results_ref, 
-                        conversation_history_ref
-                    )
-                    yield _format_sse_data({
-                        'stage': stage_key, 
-                        'status': 'done', 
-                        'full_response': full_response_content
-                    })
-                    break
+                    if token:
+                        generation_metrics.on_token()
+                        full_response_content += token
+                        # JSON answers are rendered once complete instead of streamed
+                        text = coalescer.add(token) if render_structured is None else None
+                        if text:
+                            yield _format_sse_data({
+                                'stage': stage_key, 
+                                'token': text
+                            })
+
+                    if json_chunk.get("done"):
+                        generation_metrics.on_done(json_chunk)
+                        _observe_latency(model_router, route_task, payload["model"], generation_metrics)
+                        yield from _flush_coalesced(coalescer, {'stage': stage_key})
+                        result_text = _complete_stage(
+                            stage_key, 
+                            full_response_content, 
+                            payload, 
+                            analysis_results_ref, 
+                            conversation_history_ref,
+                            render_structured
+                        )
+                        if cache_key:
+                            response_cache.put(cache_key, full_response_content)
+                        if render_structured is not None:
+                            yield from _text_chunk_events(stage_key, result_text)
+                        yield _format_sse_data({
+                            'stage': stage_key, 
+                            'status': 'done', 
+                            'full_response': result_text,
+                            'model': payload["model"]
+                        })
                     
-            except json.JSONDecodeError:
-                print(f"DEBUG: Non-JSON line from Ollama stream for stage {stage_key}: {decoded_line}")
+                except json.JSONDecodeError:
+                    print(f"DEBUG: Non-JSON line from Ollama stream for stage {stage_key}: {decoded_line}")
+
+    except QueueFullError as e:
+        OLLAMA_ERRORS_TOTAL.inc(task=stage_key, error_type="queue_full")
+        error_message = f"Ollama is busy, {stage_key} could not be queued. Please retry in {e.retry_after}s."
+        _handle_api_error(stage_key, error_message, analysis_results_ref)
+        yield _format_sse_data({'stage': stage_key, 'error': error_message, 'retry_after': e.retry_after})
 
     except requests.exceptions.Timeout:
+        OLLAMA_TIMEOUTS_TOTAL.inc(task=stage_key)
+        _observe_latency(model_router, route_task, payload["model"], generation_metrics)
         error_message = f"Timeout when calling Ollama API for {stage_key}."
         _handle_api_error(stage_key, error_message, analysis_results_ref)
+        yield from _flush_coalesced(coalescer, {'stage': stage_key})
         yield _format_sse_data({'stage': stage_key, 'error': error_message})
         
     except requests.exceptions.RequestException as e:
+        OLLAMA_ERRORS_TOTAL.inc(task=stage_key, error_type="request")
         error_message = f"Request error when calling Ollama API for {stage_key}: {str(e)}"
         if hasattr(e, 'response') and e.response is not None:
             error_details = e.response.text
             print(f"Ollama API Error Response: {error_details}")
             error_message += f" - Details: {error_details}"
             
+        _handle_api_error(stage_key, error_message, analysis_results_ref)
+        yield from _flush_coalesced(coalescer, {'stage': stage_key})
+        yield _format_sse_data({'stage': stage_key, 'error': error_message})
+        
+    except ValueError as e:
+        OLLAMA_ERRORS_TOTAL.inc(task=stage_key, error_type="invalid_output")
+        error_message = f"Invalid structured output from Ollama for {stage_key}: {str(e)}"
         _handle_api_error(stage_key, error_message, analysis_results_ref)
         yield _format_sse_data({'stage': stage_key, 'error': error_message})
         
     except Exception as e:
+        OLLAMA_ERRORS_TOTAL.inc(task=stage_key, error_type="unexpected")
         error_message = f"Unexpected error during {stage_key} processing: {str(e)}"
         _handle_api_error(stage_key, error_message, analysis_results_ref)
+        yield from _flush_coalesced(coalescer, {'stage': stage_key})
         yield _format_sse_data({'stage': stage_key, 'error': error_message})
 
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+
 
 def ollama_chat_streaming(
     ollama_api_url: str,
     ollama_model: str,
     conversation_history: List[Dict[str, str]],
-    user_message_content: str
+    user_message_content: str,
+    client: Optional[OllamaClient] = None,
+    scheduler: Optional[GenerationScheduler] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    coalesce_ms: float = 0,
+    coalesce_bytes: int = 0,
+    chat_summary: Optional[Dict[str, Any]] = None,
+    num_ctx: int = DEFAULT_CHAT_NUM_CTX,
+    keep_alive: Optional[Union[str, int]] = None,
+    model_router: Optional[ModelRouter] = None
 ) -> Iterator[str]:
     """
     Handle streaming chat with Ollama.
     
+    The history is fitted to ``num_ctx`` by estimated tokens: the newest turns
+    are sent verbatim and older ones are folded into ``chat_summary``, which
+    is only regenerated when more turns fall out of the window.
+    
+    With ``model_router`` the reply uses the chat route (possibly its fallback
+    model) and summaries use the summary route; ``ollama_model`` is ignored.
+    A ``model`` event names the serving model and the ``done`` event repeats it.
+    
     Args:
         ollama_api_url (str): URL of the Ollama API
         ollama_model (str): Model name to use
         conversation_history (List[Dict[str, str]]): Conversation history (modified in-place)
         user_message_content (str): User's message content
+        client (Optional[OllamaClient]): Pooled client to use (shared default if omitted)
+        scheduler (Optional[GenerationScheduler]): Concurrency limiter for Ollama generations
+        priority (int): Scheduler priority class (chat is interactive by default)
+        coalesce_ms (float): Send buffered tokens at least this often (0 disables the time window)
+        coalesce_bytes (int): Send buffered tokens once this many bytes are pending (0 disables)
+        chat_summary (Optional[Dict[str, Any]]): Running summary of older turns (modified in-place)
+        num_ctx (int): Context window for chat requests
+        keep_alive (Optional[Union[str, int]]): How long Ollama keeps the model loaded afterwards
+        model_router (Optional[ModelRouter]): Router choosing the chat and summary models
         
     Yields:
         str: Server-sent event formatted strings
     """
+    fallback_reason = None
+    summary_model = ollama_model
+    if model_router is not None:
+        ollama_model, fallback_reason = model_router.select(TASK_CHAT, scheduler)
+        summary_model = model_router.model_for(TASK_SUMMARY)
+
     # Add user message to history
     conversation_history.append({"role": "user", "content": user_message_content})
 
-    # Trim conversation history if too long
-    relevant_history = _trim_conversation_history(conversation_history)
+    if chat_summary is None:
+        chat_summary = new_chat_summary()
+    full_chat_response = ""
+    client = client or get_default_client()
 
-    payload = {
-        "model": ollama_model,
-        "messages": relevant_history,
-        "stream": True,
-        "options": {"temperature": 0.7, "num_ctx": 2048}
-    }
+    def _summarize(previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        summary_ctx = max(num_ctx, summary_num_ctx(previous_summary, messages, SUMMARY_MAX_TOKENS))
+        summary_payload = build_summary_payload(
+            summary_model, previous_summary, messages, summary_ctx, SUMMARY_MAX_TOKENS
+        )
+        if model_router is not None:
+            model_router.apply_options(TASK_SUMMARY, summary_payload)
+        if keep_alive is not None:
+            summary_payload["keep_alive"] = keep_alive
+        return client.post_json(ollama_api_url, summary_payload, CHAT_TIMEOUT)["message"]["content"]
 
-    full_chat_response = ""
+    coalescer = _TokenCoalescer(coalesce_ms, coalesce_bytes)
+    ticket = None
+    generation_metrics = None
+    yield _format_sse_data(_model_event(ollama_model, fallback_reason))
     
     try:
-        response = requests.post(
-            ollama_api_url, 
-            json=payload, 
-            stream=True, 
-            timeout=CHAT_TIMEOUT
+        if scheduler:
+            ticket = scheduler.submit(priority)
+            for position in ticket.wait_positions():
+                yield _format_sse_data({'status': 'queued', 'queue_position': position})
+
+        # Fit the history to the context window (may fold old turns into the summary)
+        relevant_history, _ = fit_chat_history(
+            conversation_history, chat_summary,
+            prompt_token_budget(num_ctx, CHAT_RESPONSE_RESERVE_TOKENS), _summarize
         )
-        response.raise_for_status()
-        
-        for line in response.iter_lines():
-            if not line:
-                continue
+        payload = {
+            "model": ollama_model,
+            "messages": relevant_history,
+            "stream": True,
+            "options": {"temperature": 0.7, "num_ctx": num_ctx}
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if model_router is not None:
+            model_router.apply_options(TASK_CHAT, payload)
+
+        generation_metrics = _GenerationMetrics(CHAT_METRICS_TASK)
+        LLM_MODEL_GENERATIONS_TOTAL.inc(task=CHAT_METRICS_TASK, model=ollama_model)
+        with client.stream_chat(ollama_api_url, payload, CHAT_TIMEOUT) as response:
+            # Read to the end of the body (no break on "done") so the connection is reused
+            for line in response.iter_lines():
+                if not line:
+                    continue
                 
-            decoded_line = line.decode('utf-8')
+                decoded_line = line.decode('utf-8')
             
-            try:
-                json_chunk = json.loads(decoded_line)
-                token = json_chunk.get("message", {}).get("content", "")
+                try:
+                    json_chunk = json.loads(decoded_line)
+                    token = json_chunk.get("message", {}).get("content", "")
                 
-                if token:
-                    full_chat_response += token
-                    yield _format_sse_data({'token': token})
+                    if token:
+                        generation_metrics.on_token()
+                        full_chat_response += token
+                        text = coalescer.add(token)
+                        if text:
+                            yield _format_sse_data({'token': text})
                     
-                if json_chunk.get("done"):
-                    conversation_history.append({
-                        "role": "assistant", 
-                        "content": full_chat_response
-                    })
-                    yield _format_sse_data({'status': 'done'})
-                    break
+                    if json_chunk.get("done"):
+                        generation_metrics.on_done(json_chunk)
+                        _observe_latency(model_router, TASK_CHAT, ollama_model, generation_metrics)
+                        yield from _flush_coalesced(coalescer, {})
+                        conversation_history.append({
+                            "role": "assistant", 
+                            "content": full_chat_response
+                        })
+                        yield _format_sse_data({'status': 'done', 'model': ollama_model})
                     
-            except json.JSONDecodeError:
-                print(f"Chat stream JSON decode error: {decoded_line}")
+                except json.JSONDecodeError:
+                    print(f"Chat stream JSON decode error: {decoded_line}")
                 
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Error when chatting with Ollama: {str(e)}"
+    except (requests.exceptions.RequestException, QueueFullError) as e:
+        if isinstance(e, requests.exceptions.Timeout):
+            OLLAMA_TIMEOUTS_TOTAL.inc(task=CHAT_METRICS_TASK)
+            _observe_latency(model_router, TASK_CHAT, ollama_model, generation_metrics)
+        else:
+            OLLAMA_ERRORS_TOTAL.inc(
+                task=CHAT_METRICS_TASK,
+                error_type="queue_full" if isinstance(e, QueueFullError) else "request"
+            )
+
+        if isinstance(e, QueueFullError):
+            error_msg = f"Ollama is busy. Please retry in {e.retry_after}s."
+        else:
+            error_msg = f"Error when chatting with Ollama: {str(e)}"
         print(error_msg)
         
         # Remove the user message if it was added but failed to process
@@ -178,7 +478,164 @@ def ollama_chat_streaming(
             conversation_history[-1]["content"] == user_message_content):
             conversation_history.pop()
             
-        yield _format_sse_data({'error': error_msg})
+        yield from _flush_coalesced(coalescer, {})
+        error_event = {'error': error_msg}
+        if isinstance(e, QueueFullError):
+            error_event['retry_after'] = e.retry_after
+        yield _format_sse_data(error_event)
+
+    finally:
+        if ticket:
+            scheduler.release(ticket)
+
+
+def _replay_cached_stage(
+    stage_key: str,
+    response_content: str,
+    payload: Dict[str, Any],
+    analysis_results_ref: Dict[str, str],
+    conversation_history_ref: List[Dict[str, str]],
+    render_structured: Optional[Callable[[str], Tuple[str, str]]] = None
+) -> Iterator[str]:
+    """
+    Replay a cached stage output with the same events a live generation produces.
+    
+    Args:
+        stage_key (str): Analysis stage key
+        response_content (str): Cached full response
+        payload (Dict[str, Any]): Original request payload
+        analysis_results_ref (Dict[str, str]): Reference to analysis results
+        conversation_history_ref (List[Dict[str, str]]): Reference to conversation history
+        render_structured (Optional[Callable[[str], Tuple[str, str]]]): Validator/renderer of JSON answers
+        
+    Yields:
+        str: Server-sent event formatted strings
+        
+    Raises:
+        ValueError: If a structured answer no longer validates (nothing is sent then)
+    """
+    result_text = _complete_stage(
+        stage_key, response_content, payload, analysis_results_ref, conversation_history_ref,
+        render_structured
+    )
+    yield from _text_chunk_events(stage_key, result_text)
+    yield _format_sse_data({
+        'stage': stage_key,
+        'status': 'done',
+        'full_response': result_text,
+        'model': payload.get("model"),
+        'cached': True
+    })
+
+
+def _text_chunk_events(stage_key: str, text: str) -> Iterator[str]:
+    """
+    Send a finished text as ``token`` events of ``CACHE_REPLAY_CHUNK_CHARS`` characters.
+    
+    Args:
+        stage_key (str): Analysis stage key
+        text (str): Text to send
+        
+    Yields:
+        str: Server-sent event formatted strings
+    """
+    for start in range(0, len(text), CACHE_REPLAY_CHUNK_CHARS):
+        yield _format_sse_data({
+            'stage': stage_key,
+            'token': text[start:start + CACHE_REPLAY_CHUNK_CHARS]
+        })
+
+
+def _complete_stage(
+    stage_key: str,
+    response_content: str,
+    payload: Dict[str, Any],
+    analysis_results_ref: Dict[str, str],
+    conversation_history_ref: List[Dict[str, str]],
+    render_structured: Optional[Callable[[str], Tuple[str, str]]] = None
+) -> str:
+    """
+    Render a structured answer if needed and store the stage result.
+    
+    Args:
+        stage_key (str): Analysis stage key
+        response_content (str): Full response content
+        payload (Dict[str, Any]): Original request payload
+        analysis_results_ref (Dict[str, str]): Reference to analysis results
+        conversation_history_ref (List[Dict[str, str]]): Reference to conversation history
+        render_structured (Optional[Callable[[str], Tuple[str, str]]]): Validator/renderer of JSON answers
+        
+    Returns:
+        str: Text shown to the student (the response itself for free-form stages)
+        
+    Raises:
+        ValueError: If the structured answer does not validate
+    """
+    if render_structured is None:
+        _finalize_analysis_stage(
+            stage_key, response_content, payload, analysis_results_ref, conversation_history_ref
+        )
+        return response_content
+    
+    display_text, structured_text = render_structured(response_content)
+    _finalize_analysis_stage(
+        stage_key, display_text, payload, analysis_results_ref, conversation_history_ref
+    )
+    analysis_results_ref[stage_key + STRUCTURED_RESULT_SUFFIX] = structured_text
+    return display_text
+
+
+def _model_event(model: str, fallback_reason: Optional[str], **fields: Any) -> Dict[str, Any]:
+    """
+    Build the event naming the model that serves a generation.
+    
+    Args:
+        model (str): Serving model
+        fallback_reason (Optional[str]): Why the fallback model was chosen, if it was
+        **fields: Extra fields (e.g. the stage)
+        
+    Returns:
+        Dict[str, Any]: Event data
+    """
+    event = {**fields, 'status': 'model', 'model': model}
+    if fallback_reason:
+        event['fallback_reason'] = fallback_reason
+    return event
+
+
+def _observe_latency(
+    model_router: Optional[ModelRouter],
+    route_task: Optional[str],
+    model: str,
+    generation_metrics: Optional[_GenerationMetrics]
+) -> None:
+    """
+    Feed a generation's time to first token to the router's latency SLO check.
+    
+    Args:
+        model_router (Optional[ModelRouter]): Router (nothing is recorded without one)
+        route_task (Optional[str]): Routed task of the generation
+        model (str): Serving model
+        generation_metrics (Optional[_GenerationMetrics]): Timing of the generation, if it started
+    """
+    if model_router is not None and route_task and generation_metrics is not None:
+        model_router.observe_ttft(route_task, model, generation_metrics.time_to_first_token)
+
+
+def _flush_coalesced(coalescer: _TokenCoalescer, event_base: Dict[str, Any]) -> Iterator[str]:
+    """
+    Send tokens still held by a coalescer (at the end of a stream or before an error).
+    
+    Args:
+        coalescer (_TokenCoalescer): Token buffer of the stream
+        event_base (Dict[str, Any]): Fields added to the event (e.g. the stage)
+        
+    Yields:
+        str: A token event if anything was pending
+    """
+    text = coalescer.flush()
+    if text:
+        yield _format_sse_data({**event_base, 'token': text})
 
 
 def _format_sse_data(data: Dict[str, Any]) -> str:
@@ -244,21 +701,3 @@ def _finalize_analysis_stage(
                 "content": response_content
             }]
 
-
-def _trim_conversation_history(
-    conversation_history: List[Dict[str, str]]
-) -> List[Dict[str, str]]:
-    """
-    Trim conversation history to maintain reasonable length.
-    
-    Args:
-        conversation_history (List[Dict[str, str]]): Full conversation history
-        
-    Returns:
-        List[Dict[str, str]]: Trimmed conversation history
-    """
-    if len(conversation_history) > MAX_CHAT_HISTORY_MESSAGES:
-        # Keep the first message and the most recent messages
-        return ([conversation_history[0]] + 
-                conversation_history[-(MAX_CHAT_HISTORY_MESSAGES-1):])
-    return conversation_history
\ No newline at end of file
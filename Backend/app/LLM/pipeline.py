@@ -0,0 +1,80 @@
+"""
+Analysis pipeline helpers.
+This module runs independent analysis stages concurrently and multiplexes their
+server-sent events into a single stream.
+"""
+
+import queue
+import threading
+from typing import Iterator, List
+
+
+# Constants
+MAX_BUFFERED_EVENTS = 1024
+PUT_POLL_SECONDS = 0.5
+
+_STREAM_DONE = object()
+
+
+def merge_streams(streams: List[Iterator[str]]) -> Iterator[str]:
+    """
+    Consume several SSE generators at the same time and yield their events as they arrive.
+
+    Each generator runs in its own thread; events keep their ``stage`` tag, so the
+    client can tell the interleaved tokens apart. When the consumer stops early
+    (e.g. the browser disconnects) the producers are asked to stop and their
+    generators are closed in their own threads.
+
+    Args:
+        streams (List[Iterator[str]]): SSE generators to run concurrently
+
+    Yields:
+        str: Server-sent event formatted strings, in arrival order
+
+    Raises:
+        Exception: Re-raises the first exception raised by any producer
+    """
+    events: "queue.Queue" = queue.Queue(maxsize=MAX_BUFFERED_EVENTS)
+    stop_event = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop_event.is_set():
+            try:
+                events.put(item, timeout=PUT_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(stream: Iterator[str]) -> None:
+        try:
+            for event in stream:
+                if not _put(event):
+                    break
+        except Exception as e:
+            _put(e)
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            _put(_STREAM_DONE)
+
+    threads = [
+        threading.Thread(target=_produce, args=(stream,), daemon=True)
+        for stream in streams
+    ]
+    for thread in threads:
+        thread.start()
+
+    remaining = len(threads)
+    try:
+        while remaining:
+            item = events.get()
+            if item is _STREAM_DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop_event.set()
@@ -0,0 +1,118 @@
+"""
+Stage precomputation module.
+This module runs analysis stages speculatively in background threads (e.g. right after a
+survey is submitted or a grade sheet uploaded) so their outputs are already in the response
+cache when the student opens the analysis.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .response_cache import ResponseCache, make_cache_key
+from .scheduler import GenerationScheduler
+
+
+# Constants
+DEFAULT_MAX_QUEUE_DEPTH = 2
+DEFAULT_WAIT_TIMEOUT = 400
+
+
+class StagePrecomputer:
+    """
+    Background runner of stage generations that only fill the response cache.
+
+    A job is identified by the payload whose cached output it produces. Jobs
+    are skipped when that output is already cached, when the same job is
+    running, or when the scheduler already has ``max_queue_depth`` generations
+    waiting, so speculative work never delays requested work much.
+    """
+
+    def __init__(
+        self,
+        response_cache: ResponseCache,
+        scheduler: Optional[GenerationScheduler] = None,
+        max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH
+    ):
+        """
+        Create the precomputer.
+
+        Args:
+            response_cache (ResponseCache): Cache the jobs fill (and that is checked first)
+            scheduler (Optional[GenerationScheduler]): Scheduler whose queue depth gates new jobs
+            max_queue_depth (int): Waiting generations at which jobs are skipped
+        """
+        self.response_cache = response_cache
+        self.scheduler = scheduler
+        self.max_queue_depth = max_queue_depth
+        self._running: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, label: str, payload: Dict[str, Any], job: Callable[[], Iterator[str]]) -> bool:
+        """
+        Start a job in a daemon thread unless it is cached, running or the system is busy.
+
+        Args:
+            label (str): Name used in log lines (e.g. the stage key)
+            payload (Dict[str, Any]): Payload identifying the job's cached output
+            job (Callable[[], Iterator[str]]): Returns the stage's event stream, which is drained
+                (a failed stage simply leaves nothing in the cache)
+
+        Returns:
+            bool: Whether the job was started
+        """
+        key = make_cache_key(payload)
+        if self.response_cache.get(key) is not None:
+            return False
+        if self.scheduler is not None and self.scheduler.queue_depth >= self.max_queue_depth:
+            print(f"⏭️ Skipped precomputing {label}: {self.scheduler.queue_depth} generation(s) waiting")
+            return False
+
+        with self._lock:
+            if key in self._running:
+                return False
+            finished = self._running[key] = threading.Event()
+
+        threading.Thread(target=self._run, args=(label, key, job, finished), daemon=True).start()
+        return True
+
+    def is_running(self, payload: Dict[str, Any]) -> bool:
+        """
+        Check whether a job for a payload is in progress.
+
+        Args:
+            payload (Dict[str, Any]): Payload identifying the job
+
+        Returns:
+            bool: True while the job runs
+        """
+        with self._lock:
+            return make_cache_key(payload) in self._running
+
+    def wait_for(self, payload: Dict[str, Any], timeout: float = DEFAULT_WAIT_TIMEOUT) -> bool:
+        """
+        Block until the job for a payload finishes.
+
+        Args:
+            payload (Dict[str, Any]): Payload identifying the job
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if no job was running or it finished within the timeout
+        """
+        with self._lock:
+            finished = self._running.get(make_cache_key(payload))
+        return finished is None or finished.wait(timeout)
+
+    def _run(self, label: str, key: str, job: Callable[[], Iterator[str]], finished: threading.Event) -> None:
+        started_at = time.perf_counter()
+        try:
+            for _ in job():
+                pass
+            print(f"✨ Precomputed {label} in {time.perf_counter() - started_at:.1f}s")
+        except Exception as e:
+            print(f"Warning: Precomputing {label} failed: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+            finished.set()
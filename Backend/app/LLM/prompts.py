@@ -3,31 +3,46 @@ Prompt generation module for LLM analysis.
 This module contains functions to generate structured prompts for different analysis stages.
 """
 
-import json
-from typing import Dict, Any, List
-
-
-# Analysis sections configuration
-ANALYSIS_SECTIONS = [
-    "Thai_do_hoc_tap", "Su_dung_mang_xa_hoi", "Gia_dinh_Xa_hoi", "Ban_be",
-    "Moi_truong_hoc_tap", "Quan_ly_thoi_gian", "Tu_hoc", "Hop_tac_nhom",
-    "Tu_duy_phan_bien", "Tiep_thu_xu_ly_kien_thuc"
-]
-
-# Keywords for general education courses to exclude
-GENERAL_EDUCATION_KEYWORDS = [
-    "thể chất", "quốc phòng", "an ninh", "chính trị", "mác - lênin", 
-    "tư tưởng hồ chí minh", "chủ nghĩa xã hội", "pháp luật đại cương", 
-    "tiếng anh", "hóa học đại cương", "vật lý đại cương", "đường lối", 
-    "quân sự", "kinh tế chính trị", "lịch sử đảng", "nhập môn ngành", 
-    "Kỹ thuật bắn súng"
-]
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+
+from .analytics import (
+    GRADE_TO_GPA, compute_gpa_by_semester, rank_survey_sections, summarize_subjects
+)
+from .structured_output import STAGE1_SCHEMA, STAGE2_SCHEMA
+from .subject_classifier import get_default_classifier
+from .tokens import (
+    DEFAULT_NUM_CTX_LADDER, choose_num_ctx, estimate_messages_tokens, estimate_tokens, prompt_token_budget
+)
+
+# Tokens kept free for each stage's answer when sizing num_ctx
+STAGE1_RESERVED_OUTPUT_TOKENS = 1536
+STAGE2_RESERVED_OUTPUT_TOKENS = 1536
+STAGE3_RESERVED_OUTPUT_TOKENS = 2048
+
+# Stage 2 map-reduce (transcripts too long for one prompt)
+STAGE2_MAP_CHUNK_TOKENS = 1024           # Subject lines per map chunk
+STAGE2_MAP_MAX_TOKENS = 384              # num_predict cap of one chunk summary
+STAGE2_MAP_RESERVED_OUTPUT_TOKENS = 512
+
+_num_ctx_ladder: Sequence[int] = DEFAULT_NUM_CTX_LADDER
+_keep_alive: Optional[Union[str, int]] = None
+
+
+def configure_stage_payloads(
+    num_ctx_ladder: Optional[Sequence[int]] = None,
+    keep_alive: Optional[Union[str, int]] = None
+) -> None:
+    """
+    Set the options every stage payload is built with.
 
-# Grade letter to GPA conversion
-GRADE_TO_GPA = {
-    "A+": 4.0, "A": 3.7, "B+": 3.5, "B": 3.0, "C+": 2.5, 
-    "C": 2.0, "D+": 1.5, "D": 1.0, "F": 0.0
-}
+    Args:
+        num_ctx_ladder (Optional[Sequence[int]]): Allowed num_ctx values (empty keeps the default ladder)
+        keep_alive (Optional[Union[str, int]]): How long Ollama keeps the model loaded after
+            a stage, e.g. "30m" or -1 for always (None leaves Ollama's default)
+    """
+    global _num_ctx_ladder, _keep_alive
+    _num_ctx_ladder = tuple(sorted(num_ctx_ladder or ())) or DEFAULT_NUM_CTX_LADDER
+    _keep_alive = keep_alive
 
 
 def convert_grade_letter_to_gpa(grade_letter: str) -> float:
@@ -43,44 +58,42 @@ def convert_grade_letter_to_gpa(grade_letter: str) -> float:
     return GRADE_TO_GPA.get(grade_letter.upper(), 0.0)
 
 
-def generate_prompt1_payload(khaosat_info: Dict[str, Any], ollama_model: str) -> Dict[str, Any]:
+def generate_prompt1_payload(
+    khaosat_info: Dict[str, Any], 
+    ollama_model: str, 
+    structured: bool = False
+) -> Dict[str, Any]:
     """
     Generate prompt payload for stage 1: Survey skill analysis.
     
     Args:
         khaosat_info (Dict[str, Any]): Survey information data
         ollama_model (str): Name of the Ollama model to use
+        structured (bool): Ask for JSON matching ``STAGE1_SCHEMA`` instead of markdown
         
     Returns:
         Dict[str, Any]: Prompt payload for Ollama API
     """
     personal_info = khaosat_info.get("thong_tin_ca_nhan", {})
     
-    # Extract learning skill data
-    skill_data = {
-        key: khaosat_info.get(key) 
-        for key in ANALYSIS_SECTIONS 
-        if khaosat_info.get(key) is not None
-    }
+    # Levels and ranking are computed here, the model only interprets them
+    ranking_text = _format_section_ranking(rank_survey_sections(khaosat_info), with_codes=structured)
 
     system_prompt = _build_stage1_system_prompt()
-    user_prompt = _build_stage1_user_prompt(personal_info, skill_data)
+    user_prompt = _build_stage1_user_prompt(personal_info, ranking_text, structured)
 
-    return {
-        "model": ollama_model,
-        "messages": [
-            {"role": "system", "content": system_prompt}, 
-            {"role": "user", "content": user_prompt}
-        ],
-        "stream": True,
-        "options": {"temperature": 0.3, "num_ctx": 3072}
-    }
+    return build_sized_payload(
+        "Stage 1", ollama_model, system_prompt, user_prompt,
+        temperature=0.3, reserved_output_tokens=STAGE1_RESERVED_OUTPUT_TOKENS,
+        response_format=STAGE1_SCHEMA if structured else None
+    )
 
 
 def generate_prompt2_payload(
     all_subjects: List[Dict[str, Any]], 
     khaosat_info: Dict[str, Any], 
-    ollama_model: str
+    ollama_model: str, 
+    structured: bool = False
 ) -> Dict[str, Any]:
     """
     Generate prompt payload for stage 2: Academic performance analysis.
@@ -89,6 +102,7 @@ def generate_prompt2_payload(
         all_subjects (List[Dict[str, Any]]): List of all subject data from diemllm.json
         khaosat_info (Dict[str, Any]): Survey information data
         ollama_model (str): Name of the Ollama model to use
+        structured (bool): Ask for JSON matching ``STAGE2_SCHEMA`` instead of markdown
         
     Returns:
         Dict[str, Any]: Prompt payload for Ollama API
@@ -97,25 +111,117 @@ def generate_prompt2_payload(
     specialized_subjects = _filter_specialized_subjects(all_subjects)
     print(f"📊 Filtered subjects: {len(all_subjects)} → {len(specialized_subjects)} specialized subjects")
     
-    # Format subjects for prompt
-    subjects_text = _format_subjects_for_prompt(specialized_subjects)
-    print(f"📝 Formatted {len(specialized_subjects)} subjects for LLM prompt")
+    # GPAs, distribution and subject lists are computed here, the model only interprets them
+    subjects_text = _format_grade_summary(
+        compute_gpa_by_semester(all_subjects), summarize_subjects(specialized_subjects)
+    )
+    print(f"📝 Summarized {len(specialized_subjects)} subjects for LLM prompt")
     
     personal_info = khaosat_info.get("thong_tin_ca_nhan", {})
     department = personal_info.get('khoa', 'Chưa rõ thông tin khoa')
     
-    system_prompt = _build_stage2_system_prompt(department)
-    user_prompt = _build_stage2_user_prompt(department, subjects_text)
+    system_prompt = _build_stage2_system_prompt()
+    user_prompt = _build_stage2_user_prompt(department, subjects_text, structured)
 
-    return {
-        "model": ollama_model,
-        "messages": [
-            {"role": "system", "content": system_prompt}, 
-            {"role": "user", "content": user_prompt}
-        ],
-        "stream": True,
-        "options": {"temperature": 0.1, "num_ctx": 3072}
-    }
+    return build_sized_payload(
+        "Stage 2", ollama_model, system_prompt, user_prompt,
+        temperature=0.1, reserved_output_tokens=STAGE2_RESERVED_OUTPUT_TOKENS,
+        response_format=STAGE2_SCHEMA if structured else None
+    )
+
+
+def stage2_needs_map_reduce(payload: Dict[str, Any]) -> bool:
+    """
+    Check whether a stage 2 prompt is too long for the largest allowed context.
+
+    Args:
+        payload (Dict[str, Any]): Payload from ``generate_prompt2_payload``
+
+    Returns:
+        bool: True when the prompt plus the reply reserve exceeds the largest num_ctx
+    """
+    budget = prompt_token_budget(max(_num_ctx_ladder), STAGE2_RESERVED_OUTPUT_TOKENS)
+    return estimate_messages_tokens(payload["messages"]) > budget
+
+
+def generate_stage2_map_payloads(
+    all_subjects: List[Dict[str, Any]], 
+    khaosat_info: Dict[str, Any], 
+    ollama_model: str
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Generate the map payloads of stage 2: one short summary per group of semesters.
+    
+    Specialized subjects (every attempt, retakes marked) are grouped into
+    consecutive semesters of at most ``STAGE2_MAP_CHUNK_TOKENS``; a semester
+    larger than that is split.
+    
+    Args:
+        all_subjects (List[Dict[str, Any]]): List of all subject data from diemllm.json
+        khaosat_info (Dict[str, Any]): Survey information data
+        ollama_model (str): Name of the Ollama model to use
+        
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: (chunk label, non-streaming payload), oldest semesters first
+    """
+    department = khaosat_info.get("thong_tin_ca_nhan", {}).get('khoa', 'Chưa rõ thông tin khoa')
+    chunks = _chunk_subjects_by_semester(_filter_specialized_subjects(all_subjects), STAGE2_MAP_CHUNK_TOKENS)
+    print(f"🧩 Stage 2 map-reduce: {len(chunks)} chunk(s)")
+    
+    system_prompt = _build_stage2_map_system_prompt()
+    map_payloads = []
+    for label, chunk_text in chunks:
+        payload = build_sized_payload(
+            f"Stage 2 map ({label})", ollama_model, system_prompt,
+            _build_stage2_map_user_prompt(department, label, chunk_text),
+            temperature=0.1, reserved_output_tokens=STAGE2_MAP_RESERVED_OUTPUT_TOKENS
+        )
+        payload["stream"] = False
+        payload["options"]["num_predict"] = STAGE2_MAP_MAX_TOKENS
+        map_payloads.append((label, payload))
+    return map_payloads
+
+
+def generate_stage2_reduce_payload(
+    all_subjects: List[Dict[str, Any]], 
+    khaosat_info: Dict[str, Any], 
+    partial_summaries: List[Tuple[str, str]], 
+    ollama_model: str, 
+    structured: bool = False
+) -> Dict[str, Any]:
+    """
+    Generate the reduce payload of stage 2: the stage 2 prompt with chunk summaries instead of subject lists.
+    
+    The exact GPAs and grade distribution are still computed over the whole transcript.
+    
+    Args:
+        all_subjects (List[Dict[str, Any]]): List of all subject data from diemllm.json
+        khaosat_info (Dict[str, Any]): Survey information data
+        partial_summaries (List[Tuple[str, str]]): (chunk label, summary) from the map calls
+        ollama_model (str): Name of the Ollama model to use
+        structured (bool): Ask for JSON matching ``STAGE2_SCHEMA`` instead of markdown
+        
+    Returns:
+        Dict[str, Any]: Prompt payload for Ollama API
+    """
+    specialized_subjects = _filter_specialized_subjects(all_subjects)
+    overview_text = _format_grade_overview(
+        compute_gpa_by_semester(all_subjects), summarize_subjects(specialized_subjects)
+    )
+    summaries_text = "\n\n".join(f"**{label}**\n{summary.strip()}" for label, summary in partial_summaries)
+    subjects_text = (
+        f"{overview_text}\n\n"
+        "Bảng điểm dài nên các môn chuyên ngành được tóm tắt theo từng giai đoạn (danh sách môn và điểm "
+        f"chữ nằm trong các bản tóm tắt):\n\n{summaries_text}"
+    )
+    
+    department = khaosat_info.get("thong_tin_ca_nhan", {}).get('khoa', 'Chưa rõ thông tin khoa')
+    return build_sized_payload(
+        "Stage 2 reduce", ollama_model, _build_stage2_system_prompt(),
+        _build_stage2_user_prompt(department, subjects_text, structured),
+        temperature=0.1, reserved_output_tokens=STAGE2_RESERVED_OUTPUT_TOKENS,
+        response_format=STAGE2_SCHEMA if structured else None
+    )
 
 
 def generate_prompt3_payload(
@@ -140,20 +246,88 @@ def generate_prompt3_payload(
     student_name = personal_info.get('ho_ten', 'Sinh viên')
     department = personal_info.get('khoa', 'Chưa rõ thông tin khoa')
     
-    system_prompt = _build_stage3_system_prompt(department)
+    system_prompt = _build_stage3_system_prompt()
     user_prompt = _build_stage3_user_prompt(
         student_name, department, stage1_analysis, stage2_analysis
     )
 
-    return {
+    return build_sized_payload(
+        "Stage 3", ollama_model, system_prompt, user_prompt,
+        temperature=0.5, reserved_output_tokens=STAGE3_RESERVED_OUTPUT_TOKENS
+    )
+
+
+def build_sized_payload(
+    label: str,
+    ollama_model: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    reserved_output_tokens: int,
+    response_format: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Build a streaming chat payload whose num_ctx is the smallest ladder size that fits.
+
+    The estimated prompt size, the reply reserve and the chosen context are logged;
+    a prompt that does not fit even the largest size is reported, since Ollama
+    would silently drop the start of it. The configured keep_alive is added.
+    
+    Args:
+        label (str): Name used in the log line
+        ollama_model (str): Name of the Ollama model to use
+        system_prompt (str): System message
+        user_prompt (str): User message
+        temperature (float): Sampling temperature
+        reserved_output_tokens (int): Tokens kept free for the answer
+        response_format (Optional[Dict[str, Any]]): JSON schema the answer must follow (Ollama ``format``)
+        
+    Returns:
+        Dict[str, Any]: Prompt payload for Ollama API
+    """
+    messages = [
+        {"role": "system", "content": system_prompt}, 
+        {"role": "user", "content": user_prompt}
+    ]
+    prompt_tokens = estimate_messages_tokens(messages)
+    num_ctx = choose_num_ctx(prompt_tokens, reserved_output_tokens, _num_ctx_ladder)
+    
+    print(f"📏 {label}: ~{prompt_tokens} prompt tokens + {reserved_output_tokens} reserved "
+          f"→ num_ctx {num_ctx}")
+    if prompt_tokens + reserved_output_tokens > num_ctx:
+        print(f"⚠️ {label}: prompt does not fit the largest context ({num_ctx}); "
+              f"Ollama will truncate it")
+
+    payload = {
         "model": ollama_model,
-        "messages": [
-            {"role": "system", "content": system_prompt}, 
-            {"role": "user", "content": user_prompt}
-        ],
+        "messages": messages,
         "stream": True,
-        "options": {"temperature": 0.5, "num_ctx": 4096}
+        "options": {"temperature": temperature, "num_ctx": num_ctx}
     }
+    if response_format is not None:
+        payload["format"] = response_format
+    if _keep_alive is not None:
+        payload["keep_alive"] = _keep_alive
+    return payload
+
+
+def share_num_ctx(payloads: List[Dict[str, Any]]) -> None:
+    """
+    Give payloads that run side by side on one Ollama server the same num_ctx.
+
+    Ollama reloads a model when num_ctx changes, so concurrent requests with
+    different windows would evict each other. Payloads of the same model get the
+    largest of their windows; different models are loaded separately anyway.
+    
+    Args:
+        payloads (List[Dict[str, Any]]): Payloads to align (modified in place)
+    """
+    num_ctx_by_model: Dict[str, int] = {}
+    for payload in payloads:
+        model = payload["model"]
+        num_ctx_by_model[model] = max(num_ctx_by_model.get(model, 0), payload["options"]["num_ctx"])
+    for payload in payloads:
+        payload["options"]["num_ctx"] = num_ctx_by_model[payload["model"]]
 
 
 def _filter_specialized_subjects(all_subjects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -166,54 +340,183 @@ def _filter_specialized_subjects(all_subjects: List[Dict[str, Any]]) -> List[Dic
     Returns:
         List[Dict[str, Any]]: Filtered list of specialized subjects
     """
-    specialized_subjects = []
+    specialized_subjects = get_default_classifier().specialized_subjects(all_subjects)
     
-    for subject in all_subjects:
-        subject_name_lower = subject['ten_mon'].lower()
-        is_general_education = any(
-            keyword in subject_name_lower 
-            for keyword in GENERAL_EDUCATION_KEYWORDS
-        )
+    print(f"✅ {len(specialized_subjects)} specialized subject(s), "
+          f"{len(all_subjects) - len(specialized_subjects)} general education subject(s) filtered")
+    return specialized_subjects
+
+
+def _format_section_ranking(ranking: Dict[str, Any], with_codes: bool = False) -> str:
+    """
+    Format survey section rankings for inclusion in prompts.
+    
+    Args:
+        ranking (Dict[str, Any]): Result of ``rank_survey_sections``
+        with_codes (bool): Add each section's code (used as ``ma`` in structured answers)
         
-        if not is_general_education:
-            specialized_subjects.append(subject)
-            print(f"✅ Specialized: {subject['ten_mon']} - {subject['diem_tk_chu']}")
-        else:
-            print(f"🚫 General education (filtered): {subject['ten_mon']}")
+    Returns:
+        str: One line per section (highest score first), then the strongest and weakest sections
+    """
+    if not ranking["sections"]:
+        return "Không có dữ liệu khảo sát cho các yếu tố/kỹ năng."
     
-    return specialized_subjects
+    lines = []
+    for position, section in enumerate(ranking["sections"], start=1):
+        name = f"{section['ten']} [{section['ma']}]" if with_codes else section['ten']
+        lines.append(f"{position}. {name}: {section['phan_tram_diem']:g}% - {section['muc_do']}")
+    lines.append("")
+    lines.append(f"Cao nhất: {', '.join(ranking['manh_nhat'])}")
+    lines.append(f"Thấp nhất (cần cải thiện nhất trước): {', '.join(ranking['can_cai_thien_nhat'])}")
+    return "\n".join(lines)
+
+
+def _format_subject_entries(entries: List[Dict[str, Any]]) -> str:
+    """Format subjects as ``- Tên môn (điểm chữ, hệ 4, tín chỉ)`` lines."""
+    if not entries:
+        return "- (không có)"
+    return "\n".join(
+        f"- {entry['ten_mon']} ({entry['diem_chu']}, {entry['diem_he_4']:.1f}, {entry['so_tin_chi']} TC)"
+        for entry in entries
+    )
 
 
-def _format_subjects_for_prompt(subjects: List[Dict[str, Any]]) -> str:
+def _format_grade_summary(semesters: List[Dict[str, Any]], summary: Dict[str, Any]) -> str:
     """
-    Format subject data for inclusion in prompts.
+    Format the grade summary for inclusion in prompts.
     
     Args:
-        subjects (List[Dict[str, Any]]): List of subjects from diemllm.json
+        semesters (List[Dict[str, Any]]): Result of ``compute_gpa_by_semester`` (all subjects)
+        summary (Dict[str, Any]): Result of ``summarize_subjects`` (specialized subjects)
         
     Returns:
-        str: Formatted subject text
+        str: GPA per semester, specialized GPA, grade distribution and subject lists
     """
-    if not subjects:
+    if not summary["so_mon"]:
         return "Không có môn học chuyên ngành nào được tìm thấy sau khi lọc bỏ các môn đại cương chung."
     
-    formatted_lines = []
-    for subject in subjects:
-        # Convert grade letter to GPA
-        grade_letter = subject.get('diem_tk_chu', 'F')
-        gpa_score = convert_grade_letter_to_gpa(grade_letter)
+    lines = [_format_grade_overview(semesters, summary)]
+    lines.append("")
+    lines.append("Môn chuyên ngành đạt Giỏi trở lên (B+ đến A+), điểm cao nhất trước:")
+    lines.append(_format_subject_entries(summary["mon_gioi_tro_len"]))
+    lines.append("")
+    lines.append("Môn chuyên ngành dưới B+, điểm thấp nhất trước:")
+    lines.append(_format_subject_entries(summary["mon_can_cai_thien"]))
+    return "\n".join(lines)
+
+
+def _format_grade_overview(semesters: List[Dict[str, Any]], summary: Dict[str, Any]) -> str:
+    """
+    Format GPAs and the grade distribution (the grade summary without subject lists).
+    
+    Args:
+        semesters (List[Dict[str, Any]]): Result of ``compute_gpa_by_semester`` (all subjects)
+        summary (Dict[str, Any]): Result of ``summarize_subjects`` (specialized subjects)
         
-        line = (f"- Tên môn: {subject['ten_mon']}, Điểm hệ 4: {gpa_score:.1f} "
-                f"(Điểm chữ: {grade_letter}), Số tín chỉ: {subject['so_tin_chi']}")
-        formatted_lines.append(line)
-        print(f"📋 Formatted: {subject['ten_mon']} - {grade_letter} → {gpa_score:.1f}")
+    Returns:
+        str: GPA per semester, specialized GPA and grade distribution
+    """
+    def _gpa(value: Optional[float]) -> str:
+        return f"{value:.2f}" if value is not None else "-"
     
-    return "\n".join(formatted_lines)
+    lines = ["GPA hệ 4 theo tín chỉ (tất cả các môn), từ học kỳ cũ nhất:"]
+    lines.extend(
+        f"- {semester['ten_hoc_ky']}: học kỳ {_gpa(semester['gpa_hoc_ky'])}, "
+        f"tích lũy {_gpa(semester['gpa_tich_luy'])}"
+        for semester in semesters
+    )
+    lines.append("")
+    lines.append(
+        f"Môn chuyên ngành: {summary['so_mon']} môn, {summary['so_tin_chi']} tín chỉ, "
+        f"GPA chuyên ngành {_gpa(summary['gpa'])}"
+    )
+    lines.append("Phân bố điểm: " + ", ".join(
+        f"{letter}: {counts['so_mon']} môn/{counts['so_tin_chi']} TC"
+        for letter, counts in summary["phan_bo_diem"].items()
+    ))
+    return "\n".join(lines)
 
 
+def _chunk_subjects_by_semester(subjects: List[Dict[str, Any]], max_chunk_tokens: int) -> List[Tuple[str, str]]:
+    """
+    Group subjects into chunks of consecutive semesters for the stage 2 map calls.
+    
+    Args:
+        subjects (List[Dict[str, Any]]): Subjects with ``hoc_ky`` and ``ten_hoc_ky``
+        max_chunk_tokens (int): Estimated tokens of subject lines per chunk
+        
+    Returns:
+        List[Tuple[str, str]]: (label such as "HK1 2021-2022 – HK2 2022-2023", subject lines
+        under semester headings), oldest first
+    """
+    attempts: Dict[str, int] = {}
+    rows = []   # (semester name, subject line), oldest semester first
+    for subject in sorted(subjects, key=lambda subject: str(subject.get("hoc_ky", ""))):
+        code = subject.get("ma_mon") or subject.get("ten_mon", "")
+        attempts[code] = attempts.get(code, 0) + 1
+        retake = ", học lại" if attempts[code] > 1 else ""
+        rows.append((
+            str(subject.get("ten_hoc_ky") or subject.get("hoc_ky") or "Không rõ học kỳ"),
+            f"- {subject.get('ten_mon', '')} ({subject.get('diem_tk_chu', '-')}, "
+            f"{subject.get('so_tin_chi', '?')} TC{retake})"
+        ))
+    
+    # Whole semesters are packed together; only a semester larger than a chunk is split
+    semesters: Dict[str, List[Tuple[str, str]]] = {}
+    for semester_name, line in rows:
+        semesters.setdefault(semester_name, []).append((semester_name, line))
+    
+    chunks = []
+    chunk_rows: List[Tuple[str, str]] = []
+    chunk_tokens = 0
+    for semester_rows in semesters.values():
+        semester_tokens = sum(estimate_tokens(line) + 1 for _, line in semester_rows)
+        if chunk_rows and chunk_tokens + semester_tokens > max_chunk_tokens:
+            chunks.append(_format_subject_chunk(chunk_rows))
+            chunk_rows, chunk_tokens = [], 0
+        for row in semester_rows:
+            line_tokens = estimate_tokens(row[1]) + 1
+            if chunk_rows and chunk_tokens + line_tokens > max_chunk_tokens:
+                chunks.append(_format_subject_chunk(chunk_rows))
+                chunk_rows, chunk_tokens = [], 0
+            chunk_rows.append(row)
+            chunk_tokens += line_tokens
+    if chunk_rows:
+        chunks.append(_format_subject_chunk(chunk_rows))
+    
+    # Number the parts of a split semester so the reduce prompt can tell them apart
+    label_counts: Dict[str, int] = {}
+    for label, _ in chunks:
+        label_counts[label] = label_counts.get(label, 0) + 1
+    parts_seen: Dict[str, int] = {}
+    numbered_chunks = []
+    for label, chunk_text in chunks:
+        if label_counts[label] > 1:
+            parts_seen[label] = parts_seen.get(label, 0) + 1
+            label = f"{label} (phần {parts_seen[label]})"
+        numbered_chunks.append((label, chunk_text))
+    return numbered_chunks
+
+
+def _format_subject_chunk(rows: List[Tuple[str, str]]) -> Tuple[str, str]:
+    """Label a chunk by its first and last semester and put its lines under semester headings."""
+    first, last = rows[0][0], rows[-1][0]
+    label = first if first == last else f"{first} – {last}"
+    lines = []
+    current_semester = None
+    for semester_name, line in rows:
+        if semester_name != current_semester:
+            lines.append(f"{semester_name}:")
+            current_semester = semester_name
+        lines.append(line)
+    return label, "\n".join(lines)
+
+
+# System prompts contain no student data, so every request starts with the same
+# bytes and Ollama can reuse the already evaluated prefix across students.
 def _build_stage1_system_prompt() -> str:
     """Build system prompt for stage 1 analysis."""
-    return f"""Bạn là một chuyên gia phân tích giáo dục và tâm lý học tập, nhiệm vụ của bạn là đánh giá chi tiết và khách quan các yếu tố và kỹ năng học tập của sinh viên dựa trên dữ liệu khảo sát được cung cấp.
+    return """Bạn là một chuyên gia phân tích giáo dục và tâm lý học tập, nhiệm vụ của bạn là đánh giá chi tiết và khách quan các yếu tố và kỹ năng học tập của sinh viên dựa trên dữ liệu khảo sát được cung cấp.
 
 **Các kỹ năng cần được đánh giá:**
 1. Thái độ học tập
@@ -246,43 +549,46 @@ def _build_stage1_system_prompt() -> str:
    * Trình bày kết quả theo từng mục đã được liệt kê trong dữ liệu khảo sát."""
 
 
-def _build_stage1_user_prompt(personal_info: Dict[str, Any], skill_data: Dict[str, Any]) -> str:
+def _build_stage1_user_prompt(personal_info: Dict[str, Any], ranking_text: str, structured: bool = False) -> str:
     """Build user prompt for stage 1 analysis."""
-    return f"""Dưới đây là dữ liệu khảo sát về các yếu tố và kỹ năng học tập của sinh viên {personal_info.get('ho_ten', 'N/A')}, mã sinh viên (MSV: {personal_info.get('ma_so_sinh_vien', 'N/A')}), khoa {personal_info.get('khoa', 'Chưa rõ')}, năm học {personal_info.get('nam_hoc', 'N/A')}. 
-Dữ liệu bao gồm tên yếu tố/kỹ năng và 'phan_tram_diem' tương ứng:
+    data_text = f"""Dưới đây là dữ liệu khảo sát về các yếu tố và kỹ năng học tập của sinh viên {personal_info.get('ho_ten', 'N/A')}, mã sinh viên (MSV: {personal_info.get('ma_so_sinh_vien', 'N/A')}), khoa {personal_info.get('khoa', 'Chưa rõ')}, năm học {personal_info.get('nam_hoc', 'N/A')}. 
+Các yếu tố/kỹ năng đã được hệ thống xếp hạng theo 'phan_tram_diem' (cao nhất trước), kèm mức độ tính sẵn theo thang đánh giá:
+
+{ranking_text}
+
+"""
+    if structured:
+        return data_text + """**YÊU CẦU:** Chỉ trả lời bằng một đối tượng JSON với các trường:
+- "nhan_xet_yeu_to": danh sách, MỖI yếu tố ở trên một phần tử gồm "ma" (mã trong ngoặc vuông) và "y_nghia" (1-2 câu giải thích ý nghĩa của mức điểm đó đối với việc học của sinh viên).
+- "tong_ket": 2-3 câu tổng kết các yếu tố tốt nhất và các yếu tố cần chú trọng cải thiện nhất (theo danh sách đã nêu).
 
-{json.dumps(skill_data, indent=2, ensure_ascii=False)}
+Mức độ và thứ tự đã được tính sẵn, không lặp lại. KHÔNG đưa ra đề xuất, giải pháp hay kế hoạch cải thiện."""
 
-**YÊU CẦU PHÂN TÍCH:**
+    return data_text + """**YÊU CẦU PHÂN TÍCH:**
 Hãy phân tích và đánh giá **TUẦN TỰ TỪNG YẾU TỐ/KỸ NĂNG** có trong dữ liệu trên theo đúng QUY TẮC PHÂN TÍCH VÀ ĐÁNH GIÁ đã được nêu trong vai trò hệ thống của bạn. 
 Với mỗi yếu tố, hãy:
 a. Nêu tên yếu tố.
 b. Trích dẫn 'phan_tram_diem'.
-c. Đưa ra nhận định về mức độ (ví dụ: "Rất Tốt", "Tốt/Khá", "Trung bình/Cần lưu ý", "Yếu/Cần cải thiện đáng kể").
+c. Ghi đúng mức độ đã được tính sẵn ở trên (không tự tính lại).
 d. Giải thích ngắn gọn ý nghĩa của mức điểm đó đối với sinh viên liên quan đến yếu tố đó.
 e. Format câu trả lời là dùng Table
 
 Sau khi phân tích tất cả các yếu tố, hãy đưa ra một **TỔNG KẾT NGẮN GỌN** về:
-1. Liệt kê yếu tố/kỹ năng mà sinh viên được đánh giá là **Tốt/Thành thạo**.
-2. Liệt kê yếu tố/kỹ năng mà sinh viên **cần chú trọng cải thiện nhất** (dựa trên % điểm thấp nhất và nhận định mức độ).
+1. Liệt kê yếu tố/kỹ năng mà sinh viên được đánh giá là **Tốt/Thành thạo** (nếu có) và các yếu tố cao nhất đã nêu.
+2. Liệt kê yếu tố/kỹ năng mà sinh viên **cần chú trọng cải thiện nhất**, đúng theo danh sách thấp nhất đã nêu.
 
 LƯU Ý QUAN TRỌNG: Ở giai đoạn này, chỉ tập trung PHÂN TÍCH VÀ ĐÁNH GIÁ. KHÔNG đưa ra bất kỳ đề xuất, giải pháp, hay kế hoạch cải thiện chi tiết nào."""
 
 
-def _build_stage2_system_prompt(department: str) -> str:
+def _build_stage2_system_prompt() -> str:
     """Build system prompt for stage 2 analysis."""
-    return f"""Bạn là một chuyên gia phân tích học thuật có kinh nghiệm với nhiều ngành học khác nhau ở bậc đại học. 
-Nhiệm vụ của bạn là phân tích bảng điểm các môn học **CHUYÊN NGÀNH (đã được lọc sơ bộ)** của một sinh viên thuộc khoa "{department}" để xác định các môn học/nhóm môn học thể hiện năng lực nổi bật và các lĩnh vực kiến thức tiềm năng của sinh viên đó trong chuyên ngành của họ.
-
-Đây là CẤU TRÚC DỮ LIỆU ĐẦU VÀO (JSON) để giúp bạn hiểu được và dễ dàng phân tích hiệu quả: Dữ liệu bảng điểm là một danh sách các đối tượng, mỗi đối tượng biểu diễn thông tin của một học kỳ.
-- Mỗi đối tượng học kỳ có các trường quan trọng sau:
-* `"ten_hoc_ky"`: Tên đầy đủ của học kỳ (Ví dụ: "Học kỳ 2 - Năm học 2024 - 2025").
-* `"dtb_tich_luy_he_4"`: Điểm Trung bình Tích lũy (GPA) của sinh viên tính đến hết học kỳ này, theo hệ 4 (Ví dụ: "3.20-Điểm"). Điểm GPA hiện tại mới nhất là giá trị `"dtb_tich_luy_he_4"` trong đối tượng học kỳ **đầu tiên** trong danh sách JSON (do dữ liệu được sắp xếp từ học kỳ gần nhất đến cũ nhất).
-* `"ds_diem_mon_hoc"`: Một danh sách chứa các đối tượng biểu diễn điểm của từng môn học trong học kỳ này.
-* ten_hoc_ky": Học kỳ (ví dụ: "Học kỳ 2 - Năm học 2024 - 2025")
-* "ten_mon": Tên môn học (ví dụ: "Phát triển ứng dụng IoT")
-* "diem_tk": Điểm tổng kết môn hệ số (ví dụ: "7.6")
-* "diem_tk_chu": Điểm tổng kết môn hệ chữ cái (ví dụ: "B")
+    return """Bạn là một chuyên gia phân tích học thuật có kinh nghiệm với nhiều ngành học khác nhau ở bậc đại học. 
+Nhiệm vụ của bạn là phân tích bảng điểm các môn học **CHUYÊN NGÀNH (đã được lọc sơ bộ)** của một sinh viên (khoa của sinh viên được nêu cùng dữ liệu) để xác định các môn học/nhóm môn học thể hiện năng lực nổi bật và các lĩnh vực kiến thức tiềm năng của sinh viên đó trong chuyên ngành của họ.
+
+DỮ LIỆU ĐẦU VÀO đã được hệ thống tính sẵn và chính xác, KHÔNG tự tính lại:
+* GPA hệ 4 theo tín chỉ của từng học kỳ và GPA tích lũy đến hết học kỳ đó (tất cả các môn, từ học kỳ cũ nhất đến mới nhất; GPA hiện tại là GPA tích lũy của học kỳ cuối cùng).
+* Số môn, số tín chỉ, GPA và phân bố điểm chữ của các môn chuyên ngành.
+* Danh sách môn chuyên ngành đạt Giỏi trở lên (B+ đến A+) và danh sách môn dưới B+, mỗi môn ghi (điểm chữ, điểm hệ 4, số tín chỉ).
 
 **QUY TẮC PHÂN TÍCH VÀ ĐÁNH GIÁ (TUÂN THỦ NGHIÊM NGẶT):**
 1. **Đối tượng phân tích:** Tập trung vào danh sách các môn học được cung cấp.
@@ -293,36 +599,67 @@ Nhiệm vụ của bạn là phân tích bảng điểm các môn học **CHUYÊ
    * C (Thường từ 2.0 - 2.5): Trung bình.
    * D - D+ (Thường từ 1.0 - 1.5): Yếu.
    * F (Dưới 1.0): Không đạt phải học lại môn.
-3. **Xác định các lĩnh vực/nhóm môn học chuyên ngành nổi bật:** Dựa vào các môn học có kết quả tốt (ví dụ: từ B+ trở lên), hãy xác định và nhóm các môn có liên quan đến nhau để làm nổi bật các lĩnh vực kiến thức hoặc cụm chuyên môn mà sinh viên thể hiện tốt trong ngành học của mình (khoa "{department}").
+3. **Xác định các lĩnh vực/nhóm môn học chuyên ngành nổi bật:** Dựa vào các môn học có kết quả tốt (ví dụ: từ B+ trở lên), hãy xác định và nhóm các môn có liên quan đến nhau để làm nổi bật các lĩnh vực kiến thức hoặc cụm chuyên môn mà sinh viên thể hiện tốt trong ngành học của mình.
 4. **Yêu cầu chung:** Tập trung vào việc **xác định các lĩnh vực học thuật mạnh**. KHÔNG đưa ra kế hoạch phát triển hay dự đoán nghề nghiệp chi tiết ở bước này."""
 
 
-def _build_stage2_user_prompt(department: str, subjects_text: str) -> str:
+def _build_stage2_user_prompt(department: str, subjects_text: str, structured: bool = False) -> str:
     """Build user prompt for stage 2 analysis."""
-    return f"""Sinh viên này thuộc khoa: **{department}**.
-Dưới đây là bảng điểm các môn học được cho là thuộc chuyên ngành của sinh viên này:
+    data_text = f"""Sinh viên này thuộc khoa: **{department}**.
+Dưới đây là tổng hợp bảng điểm (GPA tính trên tất cả các môn, các danh sách chỉ gồm môn được cho là thuộc chuyên ngành):
 
 {subjects_text}
 
-**YÊU CẦU PHÂN TÍCH:**
-1. **Liệt kê các môn học chuyên ngành có kết quả đánh giá môn học đạt từ Giỏi (điểm chữ B+) đến Xuất sắc (điểm chữ A - A+):** Format trả lời là Table.
+"""
+    if structured:
+        return data_text + f"""**YÊU CẦU:** Chỉ trả lời bằng một đối tượng JSON với các trường:
+- "linh_vuc_the_manh": 1-3 lĩnh vực/cụm chuyên môn tiềm năng nhất trong ngành {department}, mỗi phần tử gồm "ten", "mon_hoc" (tên các môn đạt Giỏi trở lên thuộc lĩnh vực đó, ghi đúng như danh sách) và "ly_do".
+- "mon_can_cai_thien": các môn nền tảng trong danh sách dưới B+ cần cải thiện, mỗi phần tử gồm "ten_mon" (ghi đúng như danh sách) và "nhan_xet" (1 câu).
+- "nhan_xet_chung": 2-3 câu nhận xét về kết quả và xu hướng GPA.
+
+Danh sách môn Giỏi trở lên và GPA đã được hiển thị cho sinh viên, không lặp lại. KHÔNG đưa ra kế hoạch phát triển hay dự đoán nghề nghiệp."""
+
+    return data_text + f"""**YÊU CẦU PHÂN TÍCH:**
+1. **Trình bày các môn học chuyên ngành đạt từ Giỏi (điểm chữ B+) đến Xuất sắc (điểm chữ A - A+):** Dùng đúng danh sách đã cho, không thêm hay bớt môn. Format trả lời là Table.
 2. **Xác định và nhóm các mảng trong ngành {department}:** Dựa trên các môn học có kết quả tốt, nhóm các môn có kiến thức liên quan.
 3. **Xác định các lĩnh vực chuyên ngành tiềm năng nhất:** Dựa trên sự phân nhóm, chỉ ra 1-3 lĩnh vực/cụm chuyên môn mà sinh viên này có kết quả các môn học và năng lực học tập tốt nhất trong khoa "{department}". Nêu rõ lý do.
-4. **Nhận xét về những môn học chuyên ngành, nhưng môn nền tảng cần thiết nắm vững trong ngành {department} cần cải thiện nếu kết quả đánh giá "Điểm chữ" nằm trong các điểm sau [F, D, D+, C, C+, B]**.
+4. **Nhận xét về những môn học chuyên ngành, nhưng môn nền tảng cần thiết nắm vững trong ngành {department} cần cải thiện, theo danh sách môn dưới B+ đã cho**.
 
 LƯU Ý QUAN TRỌNG: Chỉ tập trung PHÂN TÍCH ĐIỂM SỐ CÁC MÔN CHUYÊN NGÀNH và XÁC ĐỊNH LĨNH VỰC HỌC THUẬT THẾ MẠNH."""
 
 
-def _build_stage3_system_prompt(department: str) -> str:
+def _build_stage2_map_system_prompt() -> str:
+    """Build system prompt for the stage 2 map calls (one group of semesters)."""
+    return """Bạn là trợ lý tóm tắt bảng điểm đại học. Bạn nhận danh sách các môn chuyên ngành của một sinh viên trong một giai đoạn (một hoặc vài học kỳ liên tiếp) và viết bản tóm tắt ngắn để một chuyên gia phân tích tiếp.
+
+**QUY TẮC:**
+1. Chỉ dựa trên dữ liệu được cung cấp, ghi đúng tên môn và điểm chữ, không tự tính GPA.
+2. Giỏi trở lên là điểm chữ B+ đến A+; dưới B+ là các điểm còn lại.
+3. Viết ngắn gọn bằng tiếng Việt, dạng gạch đầu dòng, không chào hỏi hay giải thích thêm."""
+
+
+def _build_stage2_map_user_prompt(department: str, label: str, chunk_text: str) -> str:
+    """Build user prompt for one stage 2 map call."""
+    return f"""Khoa: **{department}**. Các môn chuyên ngành của sinh viên trong giai đoạn {label} (điểm chữ, số tín chỉ; "học lại" là lần học lại một môn đã học trước đó):
+
+{chunk_text}
+
+**YÊU CẦU:** Tóm tắt trong tối đa 150 từ:
+- Các môn đạt Giỏi trở lên: tên môn (điểm chữ), nhóm theo mảng kiến thức.
+- Các môn dưới B+ và các môn học lại: tên môn (điểm chữ).
+- 1 câu nhận xét về mảng kiến thức nổi bật của giai đoạn này."""
+
+
+def _build_stage3_system_prompt() -> str:
     """Build system prompt for stage 3 analysis."""
-    return f"""Bạn là một chuyên gia tư vấn giáo dục và hướng nghiệp dày dặn kinh nghiệm, với vai trò xây dựng một "Hệ thống phân tích và đánh giá kỹ năng học tập của sinh viên". 
-Sinh viên này thuộc khoa "{department}".
-Nhiệm vụ của bạn là tổng hợp thông tin từ hai báo cáo phân tích trước đó (Báo cáo 1: Kỹ năng học tập từ khảo sát; Báo cáo 2: Thế mạnh học thuật từ bảng điểm chuyên ngành của khoa "{department}") để đưa ra một bản đánh giá tổng hợp, toàn diện và những đề xuất phát triển cụ thể, bao gồm cả việc định hướng các mảng chuyên môn hẹp mà sinh viên nên theo đuổi trong ngành học của mình.
+    return """Bạn là một chuyên gia tư vấn giáo dục và hướng nghiệp dày dặn kinh nghiệm, với vai trò xây dựng một "Hệ thống phân tích và đánh giá kỹ năng học tập của sinh viên". 
+Khoa của sinh viên được nêu trong thông tin đầu vào.
+Nhiệm vụ của bạn là tổng hợp thông tin từ hai báo cáo phân tích trước đó (Báo cáo 1: Kỹ năng học tập từ khảo sát; Báo cáo 2: Thế mạnh học thuật từ bảng điểm chuyên ngành của sinh viên) để đưa ra một bản đánh giá tổng hợp, toàn diện và những đề xuất phát triển cụ thể, bao gồm cả việc định hướng các mảng chuyên môn hẹp mà sinh viên nên theo đuổi trong ngành học của mình.
 
 **QUY TẮC TƯ VẤN (TUÂN THỦ NGHIÊM NGẶT):**
 1. **Tính tổng hợp và kết nối:** Phải liên kết chặt chẽ thông tin từ Báo cáo 1 và Báo cáo 2.
 2. **Bằng chứng cụ thể:** Mọi nhận định và đề xuất phải dựa trên dữ liệu đã được phân tích từ hai báo cáo trước.
-3. **Phù hợp với chuyên ngành:** Các đề xuất về học thuật, nghề nghiệp, khóa học, chứng chỉ và **đặc biệt là các mảng chuyên môn hẹp** phải phù hợp với chuyên ngành của sinh viên là khoa "{department}" và các lĩnh vực thế mạnh đã được xác định từ Báo cáo 2, kết hợp với kỹ năng từ Báo cáo 1.
+3. **Phù hợp với chuyên ngành:** Các đề xuất về học thuật, nghề nghiệp, khóa học, chứng chỉ và **đặc biệt là các mảng chuyên môn hẹp** phải phù hợp với chuyên ngành (khoa) của sinh viên và các lĩnh vực thế mạnh đã được xác định từ Báo cáo 2, kết hợp với kỹ năng từ Báo cáo 1.
 4. **Tính thực tế và khả thi:** Các đề xuất phải phù hợp với năng lực và điều kiện của sinh viên.
 5. **Tính hệ thống:** Câu trả lời phải thể hiện một cái nhìn tổng thể về năng lực học tập của sinh viên.
 6. **Không trùng lặp:** Không nhắc lại chi tiết phân tích đã có ở Báo cáo 1 và 2. Sử dụng kết luận từ các báo cáo đó.
@@ -0,0 +1,112 @@
+"""
+LLM response cache module.
+This module stores finished stage outputs keyed by a hash of the full Ollama payload,
+in an in-memory LRU tier backed by an on-disk tier that survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from storage import atomic_write_json
+
+
+# Constants
+DEFAULT_MEMORY_ENTRIES = 128
+
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """
+    Build the content address of a payload (model, messages and options).
+
+    ``keep_alive`` only affects how long Ollama keeps the model loaded, so it is
+    left out.
+
+    Args:
+        payload (Dict[str, Any]): Ollama request payload
+
+    Returns:
+        str: Hex SHA-256 digest of the canonical JSON encoding
+    """
+    content = {key: value for key, value in payload.items() if key != 'keep_alive'}
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) cache of generated responses."""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_entries: int = DEFAULT_MEMORY_ENTRIES):
+        """
+        Create the cache.
+
+        Args:
+            cache_dir (Optional[str]): Directory for the disk tier; memory only when omitted
+            max_memory_entries (int): Capacity of the in-memory LRU tier
+        """
+        self.cache_dir = str(cache_dir) if cache_dir else None
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): Cache key from ``make_cache_key``
+
+        Returns:
+            Optional[str]: Cached response text or None on a miss
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if not self.cache_dir:
+            return None
+
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                response_text = json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        self._remember(key, response_text)
+        return response_text
+
+    def put(self, key: str, response_text: str) -> None:
+        """
+        Store a finished response in both tiers.
+
+        Args:
+            key (str): Cache key from ``make_cache_key``
+            response_text (str): Full generated text
+        """
+        self._remember(key, response_text)
+
+        if not self.cache_dir:
+            return
+
+        try:
+            # Entries are content-addressed, so concurrent writers need no lock
+            atomic_write_json(self._disk_path(key), {"response": response_text}, lock=False)
+        except OSError as e:
+            print(f"Warning: Could not write LLM cache entry {key}: {e}")
+
+    def _remember(self, key: str, response_text: str) -> None:
+        with self._lock:
+            self._memory[key] = response_text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
@@ -0,0 +1,182 @@
+"""
+Generation scheduler module.
+This module limits how many Ollama generations run at once, orders waiting requests
+by priority and rejects new work when the waiting queue is full.
+"""
+
+import heapq
+import itertools
+import threading
+from typing import Iterator, List
+
+
+# Priority classes (lower runs first)
+PRIORITY_INTERACTIVE = 0   # /api/llm-chat turns
+PRIORITY_ANALYSIS = 10     # Stages of /api/start-llm-analysis
+PRIORITY_BACKGROUND = 20   # Speculative work nobody waits for yet (stage precomputation)
+
+# Constants
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_RETRY_AFTER_SECONDS = 30
+POSITION_POLL_SECONDS = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when a generation cannot be queued because the waiting queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GenerationTicket:
+    """A request for one generation slot."""
+
+    def __init__(self, scheduler: "GenerationScheduler", priority: int, sequence: int):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.sequence = sequence
+        self.granted = False
+        self.released = False
+
+    def __lt__(self, other: "GenerationTicket") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def wait_positions(self, poll_seconds: float = POSITION_POLL_SECONDS) -> Iterator[int]:
+        """
+        Block until the slot is granted, yielding the queue position whenever it changes.
+
+        Args:
+            poll_seconds (float): How often to re-check the position while waiting
+
+        Yields:
+            int: 1-based position among waiting requests
+        """
+        last_position = None
+        condition = self.scheduler._condition
+        while True:
+            with condition:
+                while not self.granted:
+                    position = self.scheduler._position_locked(self)
+                    if position != last_position:
+                        break
+                    condition.wait(poll_seconds)
+                else:
+                    return
+            last_position = position
+            yield position
+
+
+class GenerationScheduler:
+    """
+    Priority scheduler with a concurrency limit and a bounded waiting queue.
+
+    Tickets are granted in (priority, arrival) order as running generations finish.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        retry_after_seconds: int = DEFAULT_RETRY_AFTER_SECONDS
+    ):
+        """
+        Create the scheduler.
+
+        Args:
+            max_concurrent (int): Maximum generations running at once
+            max_queue (int): Maximum generations waiting for a slot
+            retry_after_seconds (int): Retry-After hint given when rejecting
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.retry_after_seconds = retry_after_seconds
+        self._waiting: List[GenerationTicket] = []
+        self._running = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def running(self) -> int:
+        """Number of generations currently holding a slot."""
+        return self._running
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of generations waiting for a slot."""
+        return len(self._waiting)
+
+    @property
+    def foreground_queue_depth(self) -> int:
+        """Number of waiting generations that someone is waiting for (background work excluded)."""
+        with self._condition:
+            return sum(1 for ticket in self._waiting if ticket.priority < PRIORITY_BACKGROUND)
+
+    def ensure_capacity(self) -> None:
+        """
+        Check that new work can be queued (used to reject a request before streaming starts).
+
+        Raises:
+            QueueFullError: If the waiting queue is full
+        """
+        with self._condition:
+            if self._running >= self.max_concurrent and len(self._waiting) >= self.max_queue:
+                raise QueueFullError(self.retry_after_seconds)
+
+    def submit(self, priority: int) -> GenerationTicket:
+        """
+        Request a generation slot.
+
+        Args:
+            priority (int): Priority class (``PRIORITY_INTERACTIVE``, ``PRIORITY_ANALYSIS``, ...)
+
+        Returns:
+            GenerationTicket: Ticket, already granted if a slot was free
+
+        Raises:
+            QueueFullError: If no slot is free and the waiting queue is full
+        """
+        with self._condition:
+            ticket = GenerationTicket(self, priority, next(self._sequence))
+            if self._running < self.max_concurrent and not self._waiting:
+                ticket.granted = True
+                self._running += 1
+                return ticket
+
+            if len(self._waiting) >= self.max_queue:
+                raise QueueFullError(self.retry_after_seconds)
+
+            heapq.heappush(self._waiting, ticket)
+            return ticket
+
+    def release(self, ticket: GenerationTicket) -> None:
+        """
+        Give back a slot, or withdraw a ticket that is still waiting.
+
+        Args:
+            ticket (GenerationTicket): Ticket from ``submit``
+        """
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+
+            if ticket.granted:
+                self._running -= 1
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+
+            self._grant_locked()
+
+    def _grant_locked(self) -> None:
+        while self._waiting and self._running < self.max_concurrent:
+            next_ticket = heapq.heappop(self._waiting)
+            next_ticket.granted = True
+            self._running += 1
+        self._condition.notify_all()
+
+    def _position_locked(self, ticket: GenerationTicket) -> int:
+        return 1 + sum(1 for other in self._waiting if other < ticket)
+
@@ -0,0 +1,266 @@
+"""
+Analysis session state module.
+This module keeps per-analysis results and stage-3 chat history keyed by session ID,
+so several students can run analyses and chats at the same time.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from .chat_history import new_chat_summary
+
+
+# Constants
+DEFAULT_MAX_SESSIONS = 200
+DEFAULT_IDLE_TTL_SECONDS = 3600
+STAGE_KEYS = ("stage1_khaosat", "stage2_diem", "stage3_tonghop")
+
+
+class AnalysisSession:
+    """State of one student's analysis: stage results, chat history (with its running summary) and its lock."""
+
+    def __init__(
+        self,
+        session_id: str,
+        ma_so_sinh_vien: Optional[str] = None,
+        analysis_results: Optional[Dict[str, str]] = None,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        chat_summary: Optional[Dict[str, Any]] = None
+    ):
+        self.session_id = session_id
+        self.ma_so_sinh_vien = ma_so_sinh_vien
+        self.analysis_results = analysis_results or {key: "" for key in STAGE_KEYS}
+        self.conversation_history = conversation_history or []
+        self.chat_summary = chat_summary or new_chat_summary()
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+
+    def touch(self) -> None:
+        """Mark the session as recently used."""
+        self.last_access = time.monotonic()
+
+    def reset(self) -> None:
+        """Clear results and chat history before a new analysis run."""
+        self.analysis_results = {key: "" for key in STAGE_KEYS}
+        self.conversation_history = []
+        self.chat_summary = new_chat_summary()
+
+
+class SessionPersistence:
+    """SQLite table holding session snapshots so every worker process can resume them."""
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS analysis_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    ma_so_sinh_vien TEXT,
+                    analysis_results TEXT NOT NULL,
+                    conversation_history TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    chat_summary TEXT NOT NULL DEFAULT '{}'
+                )"""
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(analysis_sessions)")}
+            if "chat_summary" not in columns:
+                conn.execute("ALTER TABLE analysis_sessions ADD COLUMN chat_summary TEXT NOT NULL DEFAULT '{}'")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_analysis_sessions_updated ON analysis_sessions (updated_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, session: AnalysisSession) -> None:
+        """
+        Write a session snapshot.
+
+        Args:
+            session (AnalysisSession): Session to persist
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_sessions "
+                "(session_id, ma_so_sinh_vien, analysis_results, conversation_history, updated_at, chat_summary) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session.session_id,
+                    session.ma_so_sinh_vien,
+                    json.dumps(session.analysis_results, ensure_ascii=False),
+                    json.dumps(session.conversation_history, ensure_ascii=False),
+                    time.time(),
+                    json.dumps(session.chat_summary, ensure_ascii=False)
+                )
+            )
+
+    def load(self, session_id: str) -> Optional[AnalysisSession]:
+        """
+        Load a session snapshot.
+
+        Args:
+            session_id (str): Session to load
+
+        Returns:
+            Optional[AnalysisSession]: Restored session or None if not found
+        """
+        row = self._connect().execute(
+            "SELECT session_id, ma_so_sinh_vien, analysis_results, conversation_history, chat_summary "
+            "FROM analysis_sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+
+        if not row:
+            return None
+        return AnalysisSession(row[0], row[1], json.loads(row[2]), json.loads(row[3]), json.loads(row[4]) or None)
+
+    def delete_older_than(self, cutoff: float) -> None:
+        """
+        Remove snapshots not updated since the given UNIX timestamp.
+
+        Args:
+            cutoff (float): UNIX timestamp
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM analysis_sessions WHERE updated_at < ?", (cutoff,))
+
+
+class SessionManager:
+    """
+    Bounded, LRU-evicting registry of analysis sessions.
+
+    Sessions live in memory for fast access; when persistence is configured they are
+    also snapshotted to SQLite, so a request landing on another worker can pick them up.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        idle_ttl_seconds: int = DEFAULT_IDLE_TTL_SECONDS,
+        persistence: Optional[SessionPersistence] = None
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.persistence = persistence
+        self._sessions: "OrderedDict[str, AnalysisSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, ma_so_sinh_vien: Optional[str] = None) -> AnalysisSession:
+        """
+        Create and register a new session.
+
+        Args:
+            ma_so_sinh_vien (Optional[str]): Student the analysis belongs to
+
+        Returns:
+            AnalysisSession: New session
+        """
+        session = AnalysisSession(uuid.uuid4().hex, ma_so_sinh_vien)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict_locked()
+        self.save(session)
+        if self.persistence:
+            self.persistence.delete_older_than(time.time() - self.idle_ttl_seconds)
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[AnalysisSession]:
+        """
+        Look up a session, refreshing it from the persisted snapshot when one exists.
+
+        There is deliberately no "latest session" default: sessions belong to
+        different students.
+
+        Args:
+            session_id (Optional[str]): Session ID
+
+        Returns:
+            Optional[AnalysisSession]: Session or None if the ID is missing or unknown
+        """
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+
+        # Another worker may have updated the snapshot; never overwrite a session in use here
+        if self.persistence and (session is None or not session.lock.locked()):
+            restored = self.persistence.load(session_id)
+            if restored:
+                with self._lock:
+                    session = self._sessions.get(restored.session_id)
+                    if session is None:
+                        session = restored
+                        self._sessions[session.session_id] = session
+                    elif not session.lock.locked():
+                        session.analysis_results = restored.analysis_results
+                        session.conversation_history = restored.conversation_history
+                        session.chat_summary = restored.chat_summary
+
+        if session is None:
+            return None
+
+        with self._lock:
+            if session.session_id in self._sessions:
+                self._sessions.move_to_end(session.session_id)
+            session.touch()
+            self._evict_locked()
+        return session
+
+    def save(self, session: AnalysisSession) -> None:
+        """
+        Persist a session snapshot (no-op without persistence).
+
+        Args:
+            session (AnalysisSession): Session to persist
+        """
+        session.touch()
+        if self.persistence:
+            try:
+                self.persistence.save(session)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not persist session {session.session_id}: {e}")
+
+    def _evict_locked(self) -> None:
+        """
+        Drop idle sessions and, if still over capacity, the least recently used ones.
+
+        Busy sessions (lock held) are never dropped, so a running analysis keeps
+        its one in-memory session; the manager may stay over capacity until they finish.
+        """
+        now = time.monotonic()
+        for session_id in list(self._sessions):
+            session = self._sessions[session_id]
+            if now - session.last_access > self.idle_ttl_seconds and not session.lock.locked():
+                del self._sessions[session_id]
+
+        excess = len(self._sessions) - self.max_sessions
+        for session_id in list(self._sessions):
+            if excess <= 0:
+                break
+            if not self._sessions[session_id].lock.locked():
+                del self._sessions[session_id]
+                excess -= 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
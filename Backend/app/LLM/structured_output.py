@@ -0,0 +1,288 @@
+"""
+Structured stage output module.
+This module defines the JSON schemas stages 1 and 2 answer with in structured mode,
+validates the answers, renders them to markdown for the student and condenses them
+into the compact JSON that stage 3 receives.
+"""
+
+import json
+from typing import Any, Dict, List, Tuple
+
+from .analytics import (
+    ANALYSIS_SECTIONS, compute_gpa_by_semester, rank_survey_sections, summarize_subjects
+)
+from .subject_classifier import get_default_classifier
+
+
+# Constants
+MAX_STRENGTH_AREAS = 3
+
+STAGE1_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nhan_xet_yeu_to": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ma": {"type": "string", "enum": ANALYSIS_SECTIONS},
+                    "y_nghia": {"type": "string"}
+                },
+                "required": ["ma", "y_nghia"]
+            }
+        },
+        "tong_ket": {"type": "string"}
+    },
+    "required": ["nhan_xet_yeu_to", "tong_ket"]
+}
+
+STAGE2_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "linh_vuc_the_manh": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": MAX_STRENGTH_AREAS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ten": {"type": "string"},
+                    "mon_hoc": {"type": "array", "items": {"type": "string"}},
+                    "ly_do": {"type": "string"}
+                },
+                "required": ["ten", "mon_hoc", "ly_do"]
+            }
+        },
+        "mon_can_cai_thien": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ten_mon": {"type": "string"},
+                    "nhan_xet": {"type": "string"}
+                },
+                "required": ["ten_mon", "nhan_xet"]
+            }
+        },
+        "nhan_xet_chung": {"type": "string"}
+    },
+    "required": ["linh_vuc_the_manh", "mon_can_cai_thien", "nhan_xet_chung"]
+}
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float)
+}
+
+
+def validate_json(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """
+    Check a value against the subset of JSON Schema used by the stage schemas.
+
+    Supports ``type``, ``properties``, ``required``, ``items``, ``enum``,
+    ``minItems`` and ``maxItems``.
+
+    Args:
+        value (Any): Decoded JSON
+        schema (Dict[str, Any]): Schema
+        path (str): Location of ``value``, used in error messages
+
+    Raises:
+        ValueError: If the value does not match
+    """
+    expected = schema.get("type")
+    if expected:
+        # bool is an int subclass, but not a JSON number
+        if not isinstance(value, _JSON_TYPES[expected]) or (expected in ("integer", "number") and isinstance(value, bool)):
+            raise ValueError(f"{path}: expected {expected}, got {type(value).__name__}")
+
+    if "enum" in schema and value not in schema["enum"]:
+        raise ValueError(f"{path}: {value!r} is not one of the allowed values")
+
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path}: missing required field '{key}'")
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in value:
+                validate_json(value[key], property_schema, f"{path}.{key}")
+
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            raise ValueError(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            raise ValueError(f"{path}: expected at most {schema['maxItems']} items")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                validate_json(item, schema["items"], f"{path}[{index}]")
+
+
+def parse_structured_response(response_text: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decode and validate a structured stage answer.
+
+    Args:
+        response_text (str): Full model response
+        schema (Dict[str, Any]): Expected schema
+
+    Returns:
+        Dict[str, Any]: Validated data
+
+    Raises:
+        ValueError: If the response is not valid JSON or does not match the schema
+    """
+    try:
+        data = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"response is not valid JSON: {e}") from e
+    validate_json(data, schema)
+    return data
+
+
+def _cell(text: Any) -> str:
+    """Make text safe for a markdown table cell."""
+    return str(text).replace("|", "\\|").replace("\n", " ").strip()
+
+
+def _compact_json(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def build_stage1_report(response_text: str, khaosat_info: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Turn a structured stage 1 answer into the student report and the stage 3 input.
+
+    Levels and the ranking come from ``rank_survey_sections``; the model only
+    provides the interpretation of each section and the summary.
+
+    Args:
+        response_text (str): Full model response (JSON)
+        khaosat_info (Dict[str, Any]): Survey information data
+
+    Returns:
+        Tuple[str, str]: (markdown report, compact JSON for stage 3)
+
+    Raises:
+        ValueError: If the response does not match ``STAGE1_SCHEMA``
+    """
+    data = parse_structured_response(response_text, STAGE1_SCHEMA)
+    meanings = {item["ma"]: item["y_nghia"].strip() for item in data["nhan_xet_yeu_to"]}
+    ranking = rank_survey_sections(khaosat_info)
+
+    lines = [
+        "### Đánh giá các yếu tố và kỹ năng học tập",
+        "",
+        "| # | Yếu tố/Kỹ năng | % điểm | Mức độ | Ý nghĩa |",
+        "|---|---|---|---|---|"
+    ]
+    for position, section in enumerate(ranking["sections"], start=1):
+        lines.append(
+            f"| {position} | {_cell(section['ten'])} | {section['phan_tram_diem']:g}% | "
+            f"{section['muc_do']} | {_cell(meanings.get(section['ma'], '—'))} |"
+        )
+    lines.extend([
+        "",
+        "### Tổng kết",
+        f"- **Tốt/Thành thạo:** {', '.join(s['ten'] for s in ranking['sections'] if s['muc_do'] == 'Tốt/Thành thạo') or 'Không có'}",
+        f"- **Cao nhất:** {', '.join(ranking['manh_nhat'])}",
+        f"- **Cần chú trọng cải thiện nhất:** {', '.join(ranking['can_cai_thien_nhat'])}",
+        "",
+        data["tong_ket"].strip()
+    ])
+
+    compact = {
+        "xep_hang": [
+            {
+                "ten": section["ten"],
+                "phan_tram": section["phan_tram_diem"],
+                "muc_do": section["muc_do"],
+                "y_nghia": meanings.get(section["ma"], "")
+            }
+            for section in ranking["sections"]
+        ],
+        "manh_nhat": ranking["manh_nhat"],
+        "can_cai_thien_nhat": ranking["can_cai_thien_nhat"],
+        "tong_ket": data["tong_ket"].strip()
+    }
+    return "\n".join(lines), _compact_json(compact)
+
+
+def build_stage2_report(response_text: str, all_subjects: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """
+    Turn a structured stage 2 answer into the student report and the stage 3 input.
+
+    GPAs and the subject lists come from the analytics module; the model only
+    provides the strength areas, comments on weak subjects and the overall remark.
+
+    Args:
+        response_text (str): Full model response (JSON)
+        all_subjects (List[Dict[str, Any]]): All subjects of the grade sheet
+
+    Returns:
+        Tuple[str, str]: (markdown report, compact JSON for stage 3)
+
+    Raises:
+        ValueError: If the response does not match ``STAGE2_SCHEMA``
+    """
+    data = parse_structured_response(response_text, STAGE2_SCHEMA)
+    semesters = compute_gpa_by_semester(all_subjects)
+    summary = summarize_subjects(get_default_classifier().specialized_subjects(all_subjects))
+    grades_by_name = {
+        entry["ten_mon"]: entry for entry in summary["mon_gioi_tro_len"] + summary["mon_can_cai_thien"]
+    }
+    cumulative_gpa = semesters[-1]["gpa_tich_luy"] if semesters else None
+
+    lines = ["### Môn chuyên ngành đạt Giỏi trở lên (B+ đến A+)", ""]
+    if summary["mon_gioi_tro_len"]:
+        lines.extend(["| Môn học | Điểm chữ | Hệ 4 | Tín chỉ | Đánh giá |", "|---|---|---|---|---|"])
+        lines.extend(
+            f"| {_cell(entry['ten_mon'])} | {entry['diem_chu']} | {entry['diem_he_4']:.1f} | "
+            f"{entry['so_tin_chi']} | {entry['danh_gia']} |"
+            for entry in summary["mon_gioi_tro_len"]
+        )
+    else:
+        lines.append("Chưa có môn chuyên ngành nào đạt từ B+ trở lên.")
+
+    if cumulative_gpa is not None:
+        lines.extend(["", f"GPA tích lũy (hệ 4, theo tín chỉ): **{cumulative_gpa:.2f}**"
+                          + (f" · GPA chuyên ngành: **{summary['gpa']:.2f}**" if summary["gpa"] is not None else "")])
+
+    lines.extend(["", "### Lĩnh vực chuyên ngành thế mạnh", ""])
+    for position, area in enumerate(data["linh_vuc_the_manh"], start=1):
+        subjects = ", ".join(area["mon_hoc"])
+        lines.append(f"{position}. **{area['ten'].strip()}** ({subjects}): {area['ly_do'].strip()}")
+
+    lines.extend(["", "### Môn chuyên ngành cần cải thiện", ""])
+    if data["mon_can_cai_thien"]:
+        lines.extend(["| Môn học | Điểm chữ | Nhận xét |", "|---|---|---|"])
+        for item in data["mon_can_cai_thien"]:
+            entry = grades_by_name.get(item["ten_mon"])
+            lines.append(
+                f"| {_cell(item['ten_mon'])} | {entry['diem_chu'] if entry else '—'} | {_cell(item['nhan_xet'])} |"
+            )
+    else:
+        lines.append("Không có môn chuyên ngành nào cần cải thiện.")
+
+    lines.extend(["", "### Nhận xét chung", "", data["nhan_xet_chung"].strip()])
+
+    compact = {
+        "gpa_tich_luy": cumulative_gpa,
+        "gpa_chuyen_nganh": summary["gpa"],
+        "gpa_theo_hoc_ky": [semester["gpa_hoc_ky"] for semester in semesters],
+        "mon_gioi_tro_len": [f"{entry['ten_mon']} ({entry['diem_chu']})" for entry in summary["mon_gioi_tro_len"]],
+        "linh_vuc_the_manh": data["linh_vuc_the_manh"],
+        "mon_can_cai_thien": [
+            {
+                "ten_mon": item["ten_mon"],
+                "diem_chu": grades_by_name[item["ten_mon"]]["diem_chu"] if item["ten_mon"] in grades_by_name else None,
+                "nhan_xet": item["nhan_xet"]
+            }
+            for item in data["mon_can_cai_thien"]
+        ],
+        "nhan_xet_chung": data["nhan_xet_chung"].strip()
+    }
+    return "\n".join(lines), _compact_json(compact)
@@ -0,0 +1,248 @@
+"""
+Subject classifier module.
+This module decides whether a course is a general-education course, matching all
+keywords in one regex pass and remembering the answer per course code.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+
+# Keywords for general education courses to exclude
+GENERAL_EDUCATION_KEYWORDS = [
+    "thể chất", "quốc phòng", "an ninh", "chính trị", "mác - lênin",
+    "tư tưởng hồ chí minh", "chủ nghĩa xã hội", "pháp luật đại cương",
+    "tiếng anh", "hóa học đại cương", "vật lý đại cương", "đường lối",
+    "quân sự", "kinh tế chính trị", "lịch sử đảng", "nhập môn ngành",
+    "kỹ thuật bắn súng"
+]
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize Vietnamese text for matching (Unicode NFC, casefold, single spaces).
+
+    Args:
+        text (str): Raw text, e.g. a subject name
+
+    Returns:
+        str: Normalized text
+    """
+    text = unicodedata.normalize("NFC", str(text or "")).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class SubjectCatalog:
+    """
+    SQLite index of course codes and their classification.
+
+    Rows are tagged with a fingerprint of the keyword list, so editing the
+    keywords makes the old answers stale instead of wrong.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open (and create if needed) the catalog.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = str(db_path)
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS subject_catalog (
+                    ma_mon TEXT PRIMARY KEY,
+                    ten_mon TEXT NOT NULL,
+                    is_general_education INTEGER NOT NULL,
+                    keywords_fingerprint TEXT NOT NULL
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, keywords_fingerprint: str) -> Dict[str, bool]:
+        """
+        Load every classification made with the given keyword list.
+
+        Args:
+            keywords_fingerprint (str): Fingerprint of the current keyword list
+
+        Returns:
+            Dict[str, bool]: Course code -> is general education
+        """
+        rows = self._connect().execute(
+            "SELECT ma_mon, is_general_education FROM subject_catalog WHERE keywords_fingerprint = ?",
+            (keywords_fingerprint,)
+        ).fetchall()
+        return {ma_mon: bool(flag) for ma_mon, flag in rows}
+
+    def save_many(self, entries: Iterable[Tuple[str, str, bool]], keywords_fingerprint: str) -> None:
+        """
+        Record classifications in one transaction.
+
+        Args:
+            entries (Iterable[Tuple[str, str, bool]]): (course code, subject name, is general education)
+            keywords_fingerprint (str): Fingerprint of the current keyword list
+        """
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO subject_catalog VALUES (?, ?, ?, ?)",
+                [(ma_mon, ten_mon, int(flag), keywords_fingerprint) for ma_mon, ten_mon, flag in entries]
+            )
+
+
+class SubjectClassifier:
+    """
+    General-education classifier with a compiled keyword regex and a per-course memo.
+
+    Subjects with a course code (``ma_mon``) are classified once; later lookups
+    are a dictionary hit, and with a catalog the answers survive restarts.
+    """
+
+    def __init__(self, keywords: List[str] = GENERAL_EDUCATION_KEYWORDS, catalog: Optional[SubjectCatalog] = None):
+        """
+        Compile the keyword matcher and load known classifications.
+
+        Args:
+            keywords (List[str]): General-education keywords (any case or Unicode form)
+            catalog (Optional[SubjectCatalog]): Persistent course-code index
+        """
+        normalized = sorted({normalize_text(keyword) for keyword in keywords if normalize_text(keyword)},
+                            key=len, reverse=True)
+        self._pattern = re.compile("|".join(re.escape(keyword) for keyword in normalized))
+        self.keywords_fingerprint = hashlib.sha256("\n".join(sorted(normalized)).encode("utf-8")).hexdigest()[:16]
+
+        self.catalog = catalog
+        self._by_code: Dict[str, bool] = catalog.load(self.keywords_fingerprint) if catalog else {}
+        self._lock = threading.Lock()
+
+    def matches_keywords(self, ten_mon: str) -> bool:
+        """
+        Check a subject name against the keywords, ignoring the course code memo.
+
+        Args:
+            ten_mon (str): Subject name
+
+        Returns:
+            bool: True if any keyword occurs in the name
+        """
+        return self._pattern.search(normalize_text(ten_mon)) is not None
+
+    def is_general_education(self, ten_mon: str, ma_mon: Optional[str] = None) -> bool:
+        """
+        Classify one subject.
+
+        Args:
+            ten_mon (str): Subject name
+            ma_mon (Optional[str]): Course code used as the memo key
+
+        Returns:
+            bool: True for general-education courses
+        """
+        return self.classify_subjects([{"ten_mon": ten_mon, "ma_mon": ma_mon}])[0]
+
+    def classify_subjects(self, subjects: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Classify many subjects, persisting newly seen course codes in one write.
+
+        Args:
+            subjects (List[Dict[str, Any]]): Subjects with ``ten_mon`` and optional ``ma_mon``
+
+        Returns:
+            List[bool]: General-education flag per subject, in order
+        """
+        flags = []
+        new_entries = {}
+        for subject in subjects:
+            ma_mon = str(subject.get("ma_mon") or "").strip()
+            flag = self._by_code.get(ma_mon) if ma_mon else None
+            if flag is None:
+                flag = self.matches_keywords(subject.get("ten_mon", ""))
+                if ma_mon:
+                    new_entries[ma_mon] = (ma_mon, subject.get("ten_mon", ""), flag)
+            flags.append(flag)
+
+        if new_entries:
+            with self._lock:
+                for ma_mon, _, flag in new_entries.values():
+                    self._by_code[ma_mon] = flag
+            if self.catalog:
+                try:
+                    self.catalog.save_many(new_entries.values(), self.keywords_fingerprint)
+                except sqlite3.Error as e:
+                    print(f"Warning: Could not update subject catalog: {e}")
+
+        return flags
+
+    def specialized_subjects(self, subjects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Keep only the subjects that are not general education.
+
+        Args:
+            subjects (List[Dict[str, Any]]): Subjects with ``ten_mon`` and optional ``ma_mon``
+
+        Returns:
+            List[Dict[str, Any]]: Specialized subjects, in order
+        """
+        flags = self.classify_subjects(subjects)
+        return [subject for subject, is_general_education in zip(subjects, flags) if not is_general_education]
+
+
+_default_classifier: Optional[SubjectClassifier] = None
+_default_classifier_lock = threading.Lock()
+
+
+def configure_default_classifier(catalog_path: Optional[str] = None,
+                                 keywords: List[str] = GENERAL_EDUCATION_KEYWORDS) -> SubjectClassifier:
+    """
+    Replace the shared classifier, optionally backed by a persistent catalog.
+
+    Args:
+        catalog_path (Optional[str]): SQLite file for the course-code index
+        keywords (List[str]): General-education keywords
+
+    Returns:
+        SubjectClassifier: The new shared classifier
+    """
+    global _default_classifier
+    catalog = SubjectCatalog(catalog_path) if catalog_path else None
+    with _default_classifier_lock:
+        _default_classifier = SubjectClassifier(keywords, catalog)
+        return _default_classifier
+
+
+def get_default_classifier() -> SubjectClassifier:
+    """
+    Get the classifier used by prompt building, creating an in-memory one on first use.
+
+    Returns:
+        SubjectClassifier: Shared classifier
+    """
+    global _default_classifier
+    if _default_classifier is None:
+        with _default_classifier_lock:
+            if _default_classifier is None:
+                _default_classifier = SubjectClassifier()
+    return _default_classifier
@@ -0,0 +1,115 @@
+"""
+Token estimation module.
+This module estimates how many model tokens a prompt uses, without loading a tokenizer,
+so prompts and chat histories can be fitted to a context window.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence
+
+
+# Constants
+CHARS_PER_TOKEN = 4            # Long words are split into pieces of about this many characters
+MESSAGE_OVERHEAD_TOKENS = 4    # Role markers and separators added by the chat template
+DEFAULT_NUM_CTX_LADDER = (2048, 3072, 4096, 6144, 8192)  # Context sizes a payload may use
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of a text.
+
+    Every word (a Vietnamese syllable is one word) and every punctuation mark counts
+    as one token, plus one more per ``CHARS_PER_TOKEN`` characters of long words.
+    This slightly overestimates, which is the safe side for context budgets.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    if not text:
+        return 0
+    return sum(1 + len(piece) // (CHARS_PER_TOKEN + 1) for piece in _PIECE_RE.findall(text))
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    """
+    Estimate the tokens of one chat message, including template overhead.
+
+    Args:
+        message (Dict[str, str]): Message with ``role`` and ``content``
+
+    Returns:
+        int: Estimated token count
+    """
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimate the tokens of a list of chat messages.
+
+    Args:
+        messages (List[Dict[str, str]]): Chat messages
+
+    Returns:
+        int: Estimated token count
+    """
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def prompt_token_budget(num_ctx: int, reserved_for_output: int) -> int:
+    """
+    Tokens available for the prompt in a context window.
+
+    Args:
+        num_ctx (int): Context window size sent to Ollama
+        reserved_for_output (int): Tokens kept free for the reply
+
+    Returns:
+        int: Prompt token budget (at least 0)
+    """
+    return max(num_ctx - reserved_for_output, 0)
+
+
+def choose_num_ctx(
+    prompt_tokens: int,
+    reserved_for_output: int,
+    ladder: Sequence[int] = DEFAULT_NUM_CTX_LADDER
+) -> int:
+    """
+    Smallest context size in the ladder that holds the prompt plus the reply reserve.
+
+    Args:
+        prompt_tokens (int): Estimated prompt tokens
+        reserved_for_output (int): Tokens kept free for the reply
+        ladder (Sequence[int]): Allowed context sizes
+
+    Returns:
+        int: Chosen num_ctx (the largest size when none is big enough)
+    """
+    sizes = sorted(ladder)
+    for num_ctx in sizes:
+        if prompt_tokens + reserved_for_output <= num_ctx:
+            return num_ctx
+    return sizes[-1]
+
+
+def describe_payload_tokens(payload: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Estimated prompt size of an Ollama chat payload next to its context window.
+
+    Args:
+        payload (Dict[str, Any]): Ollama /api/chat payload
+
+    Returns:
+        Dict[str, int]: ``prompt_tokens`` and ``num_ctx`` (0 when the payload sets none)
+    """
+    return {
+        "prompt_tokens": estimate_messages_tokens(payload.get("messages", [])),
+        "num_ctx": payload.get("options", {}).get("num_ctx", 0)
+    }
@@ -1,14 +1,129 @@
 """
 Utility functions for data processing in the LLM module.
 This module provides functions to read and process survey and grade data from JSON files.
+Parsed results are cached in memory and re-read only when the file changes on disk.
 """
 
 import json
 import os
-from typing import Dict, List, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+
+# Constants
+PARSED_FILE_CACHE_SIZE = 64  # Least recently used parse results are dropped beyond this
+
+# Parsed file cache: (path, reader name) -> (file signature, parsed value)
+_parsed_file_cache: "OrderedDict[Tuple[str, str], Tuple[Tuple[int, int, int], Any]]" = OrderedDict()
+_parsed_file_cache_lock = threading.Lock()
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Identify a version of a file without reading it.
+    
+    Args:
+        path (str): File path
+        
+    Returns:
+        Optional[Tuple[int, int, int]]: (mtime in ns, size, inode) or None if the file is missing
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _read_through_cache(path: str, reader: Callable[[str], Any]) -> Any:
+    """
+    Return the cached result of ``reader(path)`` while the file is unchanged.
+    
+    The cached value is shared between callers and must be treated as read-only.
+    
+    Args:
+        path (str): File path
+        reader (Callable[[str], Any]): Function that reads and parses the file
+        
+    Returns:
+        Any: Parsed value
+    """
+    key = (os.path.abspath(path), reader.__name__)
+    signature = _file_signature(path)
+    if signature is None:
+        invalidate_file_cache(path)
+        return reader(path)
+
+    with _parsed_file_cache_lock:
+        cached = _parsed_file_cache.get(key)
+        if cached and cached[0] == signature:
+            _parsed_file_cache.move_to_end(key)
+            return cached[1]
+
+    value = reader(path)
+    # Only keep the value if the file did not change while it was being read
+    if _file_signature(path) == signature:
+        with _parsed_file_cache_lock:
+            _parsed_file_cache[key] = (signature, value)
+            _parsed_file_cache.move_to_end(key)
+            while len(_parsed_file_cache) > PARSED_FILE_CACHE_SIZE:
+                _parsed_file_cache.popitem(last=False)
+    return value
+
+
+def invalidate_file_cache(path: Optional[str] = None) -> None:
+    """
+    Drop cached parse results (write hook for routes that replace data files).
+    
+    Args:
+        path (Optional[str]): File whose entries are dropped; everything when omitted
+    """
+    with _parsed_file_cache_lock:
+        if path is None:
+            _parsed_file_cache.clear()
+            return
+        abs_path = os.path.abspath(path)
+        for key in [key for key in _parsed_file_cache if key[0] == abs_path]:
+            del _parsed_file_cache[key]
+
+
+def load_json_file(path: str) -> Any:
+    """
+    Read a JSON file, served from memory while the file is unchanged.
+    
+    Args:
+        path (str): Path to the JSON file
+        
+    Returns:
+        Any: Decoded JSON (shared, do not modify)
+        
+    Raises:
+        OSError: If the file cannot be read
+        json.JSONDecodeError: If the file is not valid JSON
+    """
+    return _read_through_cache(path, _load_json)
+
+
+def _load_json(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 def get_khaosat_data_from_file(path_khaosat: str) -> Optional[Dict[str, Any]]:
+    """
+    Read survey data from JSON file (cached until the file changes).
+    
+    Args:
+        path_khaosat (str): Path to the survey data JSON file
+        
+    Returns:
+        Optional[Dict[str, Any]]: Survey data dictionary or None if error occurs
+    """
+    return _read_through_cache(path_khaosat, _read_khaosat_file)
+
+
+def _read_khaosat_file(path_khaosat: str) -> Optional[Dict[str, Any]]:
     """
     Read survey data from JSON file.
     
@@ -41,6 +156,19 @@ def get_khaosat_data_from_file(path_khaosat: str) -> Optional[Dict[str, Any]]:
 
 
 def get_diem_data_from_file(path_diem: str) -> List[Dict[str, Any]]:
+    """
+    Read and process grade data from JSON file (cached until the file changes).
+    
+    Args:
+        path_diem (str): Path to the grade data JSON file
+        
+    Returns:
+        List[Dict[str, Any]]: List of processed subject data with grades
+    """
+    return _read_through_cache(path_diem, _read_diem_file)
+
+
+def _read_diem_file(path_diem: str) -> List[Dict[str, Any]]:
     """
     Read and process grade data from JSON file.
     
@@ -79,6 +207,8 @@ def get_diem_data_from_file(path_diem: str) -> List[Dict[str, Any]]:
             for mon_hoc in hocky["ds_diem_mon_hoc"]:
                 processed_subject = _process_subject_data(mon_hoc)
                 if processed_subject:
+                    processed_subject["hoc_ky"] = hocky.get("hoc_ky", "")
+                    processed_subject["ten_hoc_ky"] = hocky.get("ten_hoc_ky", "")
                     all_subjects.append(processed_subject)
                     
         return all_subjects
@@ -112,10 +242,12 @@ def _process_subject_data(mon_hoc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
             diem_tk_so_float = 0.0
             
         return {
+            "ma_mon": mon_hoc.get("ma_mon", ""),
             "ten_mon": mon_hoc.get("ten_mon", ""),
             "diem_tk_so": diem_tk_so_float,
             "diem_tk_chu": mon_hoc.get("diem_tk_chu", ""),
-            "so_tin_chi": mon_hoc.get("so_tin_chi", "")
+            "so_tin_chi": mon_hoc.get("so_tin_chi", ""),
+            "khong_tinh_diem_tbtl": bool(mon_hoc.get("khong_tinh_diem_tbtl"))
         }
         
     except Exception as e:
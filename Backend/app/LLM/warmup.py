@@ -0,0 +1,137 @@
+"""
+Model warm-up module.
+This module preloads Ollama models at startup and touches them again periodically, so the
+first analysis after an idle period does not wait for the model to load. Periodic warm-ups
+reuse the context window a model was last requested with, so they never make Ollama reload
+a model that a stage has just loaded with another num_ctx.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import requests
+
+from .ollama_client import OllamaClient, get_default_client
+
+
+# Constants
+DEFAULT_WARMUP_INTERVAL_SECONDS = 600
+WARMUP_TIMEOUT = 300   # Loading a large model from disk can take minutes
+
+
+def build_warmup_payload(
+    ollama_model: str,
+    keep_alive: Union[str, int],
+    num_ctx: Optional[int]
+) -> Dict[str, Any]:
+    """
+    Build a chat request without messages, which makes Ollama load the model and return.
+
+    Args:
+        ollama_model (str): Model to load
+        keep_alive (Union[str, int]): How long Ollama keeps the model loaded afterwards
+        num_ctx (Optional[int]): Context window to load the model with (a different num_ctx
+            later forces a reload); None leaves it to Ollama's default
+
+    Returns:
+        Dict[str, Any]: Ollama /api/chat payload
+    """
+    payload = {
+        "model": ollama_model,
+        "messages": [],
+        "stream": False,
+        "keep_alive": keep_alive
+    }
+    if num_ctx:
+        payload["options"] = {"num_ctx": num_ctx}
+    return payload
+
+
+class ModelWarmer:
+    """
+    Keeps models loaded on Ollama servers.
+
+    ``warm_up`` loads every (URL, model) target once; ``start`` does so in a
+    background thread at startup and then every ``interval_seconds``, which
+    also reloads models after an Ollama restart. A target is warmed with the
+    num_ctx the client last sent it (``num_ctx`` only before its first use),
+    and skipped when real requests touched it within the interval, since
+    they already refreshed its keep_alive.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[Tuple[str, str]],
+        keep_alive: Union[str, int],
+        num_ctx: int,
+        interval_seconds: float = DEFAULT_WARMUP_INTERVAL_SECONDS,
+        client: Optional[OllamaClient] = None
+    ):
+        """
+        Create the warmer.
+
+        Args:
+            targets (Sequence[Tuple[str, str]]): (Ollama /api/chat URL, model) pairs to keep loaded
+            keep_alive (Union[str, int]): keep_alive sent with each warm-up
+            num_ctx (int): Context window to load a model with before it was first used
+            interval_seconds (float): Time between warm-ups (0 warms up once)
+            client (Optional[OllamaClient]): Pooled client to use (shared default if omitted)
+        """
+        self.targets = list(dict.fromkeys(targets))
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.interval_seconds = interval_seconds
+        self.client = client
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_warm_up: Optional[float] = None
+
+    def warm_up(self) -> int:
+        """
+        Load every target model once.
+
+        Returns:
+            int: Number of targets that answered
+        """
+        client = self.client or get_default_client()
+        warmed = 0
+        for api_url, ollama_model in self.targets:
+            num_ctx = self.num_ctx
+            last_context = client.last_context(api_url, ollama_model)
+            if last_context:
+                num_ctx, requested_at = last_context
+                if self._last_warm_up is not None and requested_at > self._last_warm_up:
+                    # Used since the previous warm-up: already loaded and kept alive
+                    warmed += 1
+                    continue
+
+            started_at = time.perf_counter()
+            try:
+                client.post_json(
+                    api_url, build_warmup_payload(ollama_model, self.keep_alive, num_ctx), WARMUP_TIMEOUT
+                )
+                warmed += 1
+                print(f"🔥 Warmed up {ollama_model} at {api_url} in {time.perf_counter() - started_at:.1f}s")
+            except requests.exceptions.RequestException as e:
+                print(f"Warning: Could not warm up {ollama_model} at {api_url}: {e}")
+        self._last_warm_up = time.monotonic()
+        return warmed
+
+    def start(self) -> None:
+        """Warm up now and then periodically in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the periodic warm-ups."""
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.warm_up()
+            if self.interval_seconds <= 0:
+                return
+            self._stop.wait(self.interval_seconds)
@@ -3,17 +3,54 @@ Flask application for student learning analytics system.
 This application handles survey submissions, grade file uploads, and LLM-based analysis.
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
+import hashlib
 import json
 import os
+import tempfile
+import threading
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
 from diem_converter import convert_excel_to_json
-from LLM.utils import get_khaosat_data_from_file, get_diem_data_from_file
-from LLM.prompts import generate_prompt1_payload, generate_prompt2_payload, generate_prompt3_payload
-from LLM.ollama_interactions import call_ollama_stream_logic, ollama_chat_streaming
+from survey_store import SurveyStore
+from storage import atomic_copy_file
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_REQUEST_SECONDS
+from config import (
+    SESSION_MAX_ACTIVE, SESSION_IDLE_TTL,
+    OLLAMA_POOL_CONNECTIONS, OLLAMA_POOL_MAXSIZE, OLLAMA_POOL_BLOCK,
+    OLLAMA_API_URLS, OLLAMA_MODEL, OLLAMA_SMALL_MODEL,
+    LLM_PIPELINE_MODE, LLM_STRUCTURED_OUTPUT, LLM_STAGE2_MAP_REDUCE, SSE_COALESCE_MS, SSE_COALESCE_BYTES, CHAT_NUM_CTX,
+    LLM_NUM_CTX_LADDER, OLLAMA_KEEP_ALIVE, OLLAMA_WARMUP_ENABLED, OLLAMA_WARMUP_INTERVAL,
+    LLM_CACHE_ENABLED, LLM_CACHE_MEMORY_ENTRIES,
+    LLM_PRECOMPUTE_ENABLED, LLM_PRECOMPUTE_MAX_QUEUE,
+    LLM_MODEL_ROUTES, LLM_FALLBACK_QUEUE_DEPTH, LLM_FALLBACK_TTFT_SLO, LLM_FALLBACK_LATENCY_WINDOW,
+    SCHEDULER_MAX_CONCURRENT, SCHEDULER_MAX_QUEUE, SCHEDULER_RETRY_AFTER,
+    JOB_WORKERS, JOB_MAX_PENDING, JOB_MAX_ATTEMPTS, JOB_RETENTION
+)
+from LLM.utils import get_diem_data_from_file, load_json_file, invalidate_file_cache
+from LLM.prompts import (
+    generate_prompt1_payload, generate_prompt2_payload, generate_prompt3_payload,
+    generate_stage2_map_payloads, generate_stage2_reduce_payload, stage2_needs_map_reduce,
+    configure_stage_payloads, share_num_ctx
+)
+from LLM.ollama_interactions import call_ollama_stream_logic, ollama_chat_streaming, STRUCTURED_RESULT_SUFFIX
+from LLM.structured_output import build_stage1_report, build_stage2_report
+from LLM.ollama_client import configure_default_client
+from LLM.subject_classifier import configure_default_classifier
+from LLM.session_state import SessionManager, SessionPersistence
+from LLM.pipeline import merge_streams
+from LLM.response_cache import ResponseCache
+from LLM.scheduler import GenerationScheduler, QueueFullError, PRIORITY_ANALYSIS, PRIORITY_BACKGROUND
+from LLM.warmup import ModelWarmer
+from LLM.model_router import (
+    ModelRouter, default_routes, TASK_STAGE1, TASK_STAGE2, TASK_STAGE3, TASK_CHAT, TASK_SUMMARY
+)
+from LLM.map_reduce import stream_map_phase
+from LLM.precompute import StagePrecomputer
+from LLM.job_queue import JobQueue, JobWorkerPool, parse_event_id
 
 # --- Application Configuration ---
 app = Flask(__name__)
@@ -21,10 +58,18 @@ CORS(app)
 
 # --- Constants ---
 OLLAMA_API_URL = "http://192.168.2.114:11434/api/chat"
-OLLAMA_MODEL = "gemma3:12b"
+OLLAMA_BACKEND_URLS = OLLAMA_API_URLS or [OLLAMA_API_URL]
 DATABASE_DIR = '../Database'
 PATH_KHAOSAT = os.path.join(DATABASE_DIR, 'khaosat.json')
 PATH_DIEM = os.path.join(DATABASE_DIR, 'diem.json')
+PATH_SURVEY_DB = os.path.join(DATABASE_DIR, 'khaosat.db')
+PATH_SESSION_DB = os.path.join(DATABASE_DIR, 'sessions.db')
+PATH_JOB_DB = os.path.join(DATABASE_DIR, 'jobs.db')
+LLM_CACHE_DIR = os.path.join(DATABASE_DIR, 'llm_cache')
+UPLOADS_DIR = os.path.join(DATABASE_DIR, 'uploads')
+PATH_SUBJECT_CATALOG = os.path.join(DATABASE_DIR, 'subjects.db')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+JOB_TYPE_ANALYSIS = "analysis"
 
 # Survey configuration
 SURVEY_SECTIONS = {
@@ -40,16 +85,91 @@ SURVEY_SECTIONS = {
     "X": {"name": "Tiep_thu_xu_ly_kien_thuc", "count": 4}
 }
 
-# Global variables for LLM analysis
-llm_analysis_results = {
-    "stage1_khaosat": "",
-    "stage2_diem": "",
-    "stage3_tonghop": ""
-}
-llm_conversation_history_stage3 = []
-
-# Ensure the Database directory exists
+# Ensure the Database directories exist
 os.makedirs(DATABASE_DIR, exist_ok=True)
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+# Survey submissions, indexed by student ID (imports the old khaosat.json once)
+survey_store = SurveyStore(PATH_SURVEY_DB, legacy_json_path=PATH_KHAOSAT)
+
+# Keep-alive connection pool shared by every analysis stage and chat turn
+configure_default_client(
+    pool_connections=OLLAMA_POOL_CONNECTIONS,
+    pool_maxsize=OLLAMA_POOL_MAXSIZE,
+    pool_block=OLLAMA_POOL_BLOCK
+)
+
+# General-education filter, memoized per course code across restarts
+configure_default_classifier(catalog_path=PATH_SUBJECT_CATALOG)
+
+# Stage payloads size num_ctx to their prompt from these steps and keep the model loaded
+configure_stage_payloads(num_ctx_ladder=LLM_NUM_CTX_LADDER, keep_alive=OLLAMA_KEEP_ALIVE)
+
+# Finished stage outputs keyed by a hash of the full payload
+response_cache = ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MEMORY_ENTRIES) if LLM_CACHE_ENABLED else None
+
+# Limits in-flight Ollama generations; chat turns are served before analysis stages
+generation_scheduler = GenerationScheduler(
+    max_concurrent=SCHEDULER_MAX_CONCURRENT,
+    max_queue=SCHEDULER_MAX_QUEUE,
+    retry_after_seconds=SCHEDULER_RETRY_AFTER
+)
+
+# Per-analysis results and chat history, keyed by session ID
+session_manager = SessionManager(
+    max_sessions=SESSION_MAX_ACTIVE,
+    idle_ttl_seconds=SESSION_IDLE_TTL,
+    persistence=SessionPersistence(PATH_SESSION_DB)
+)
+
+# Persistent queue of analyses started through /api/start-llm-analysis or /api/jobs
+# (workers start at the end of this module)
+job_queue = JobQueue(
+    PATH_JOB_DB,
+    max_pending=JOB_MAX_PENDING,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retention_seconds=JOB_RETENTION,
+    retry_after_seconds=SCHEDULER_RETRY_AFTER
+)
+# Model and options per task; stages 2/3 drop to the small model when the queue or latency is too high
+model_router = ModelRouter(
+    default_routes(OLLAMA_MODEL, OLLAMA_SMALL_MODEL, LLM_FALLBACK_TTFT_SLO, overrides=LLM_MODEL_ROUTES),
+    fallback_queue_depth=LLM_FALLBACK_QUEUE_DEPTH,
+    latency_window_seconds=LLM_FALLBACK_LATENCY_WINDOW
+)
+
+def runs_background_services():
+    """
+    Tell whether this process should start the model warmer and job workers.
+    
+    With the Werkzeug reloader (``python app.py``, ``flask run --debug``) the
+    parent process only watches the code and restarts the serving child
+    (marked by WERKZEUG_RUN_MAIN); started in the parent, the workers would
+    keep claiming jobs with stale code and the parent's own scheduler would
+    double the concurrency limit.
+    
+    Returns:
+        bool: True in the serving process or a process without the reloader
+    """
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        return True
+    return not (app.debug or __name__ == '__main__')
+
+# Loads the routed models on every backend before the first analysis and keeps them loaded
+model_warmer = ModelWarmer(
+    targets=[(url, model) for url in OLLAMA_BACKEND_URLS + [OLLAMA_API_URL] for model in model_router.models()],
+    keep_alive=OLLAMA_KEEP_ALIVE,
+    num_ctx=CHAT_NUM_CTX,
+    interval_seconds=OLLAMA_WARMUP_INTERVAL
+)
+if OLLAMA_WARMUP_ENABLED and runs_background_services():
+    model_warmer.start()
+
+# Generates stages 1 and 2 into the response cache after a survey submission or grade upload
+stage_precomputer = (
+    StagePrecomputer(response_cache, generation_scheduler, max_queue_depth=LLM_PRECOMPUTE_MAX_QUEUE)
+    if response_cache and LLM_PRECOMPUTE_ENABLED else None
+)
 
 # --- Utility Functions ---
 def calculate_percentage(scores, total_questions):
@@ -71,6 +191,20 @@ def calculate_percentage(scores, total_questions):
     percentage = (total_score / max_possible_score) * 100
     return round(percentage, 2)
 
+def queue_full_response(error):
+    """
+    Build the 429 response sent when the generation queue is full.
+    
+    Args:
+        error (QueueFullError): Rejection raised by the scheduler
+        
+    Returns:
+        tuple: (response, status code)
+    """
+    response = jsonify({"error": "Hệ thống đang quá tải, vui lòng thử lại sau.", "retry_after": error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
 def validate_file_upload(file):
     """
     Validate uploaded file.
@@ -92,6 +226,61 @@ def validate_file_upload(file):
     
     return True, None
 
+def save_upload_with_hash(file, directory):
+    """
+    Stream an uploaded file to a temporary file while hashing its content.
+    
+    Args:
+        file: Flask file object
+        directory (str): Directory for the temporary file
+        
+    Returns:
+        tuple: (hex SHA-256 digest, temporary file path)
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), tmp_path
+
+def converted_upload_path(content_hash):
+    """
+    Get the path of the converted JSON for an uploaded grade sheet.
+    
+    Args:
+        content_hash (str): SHA-256 of the uploaded .xlsx file
+        
+    Returns:
+        str: Path of the converted JSON file
+    """
+    return os.path.join(UPLOADS_DIR, f"{content_hash}.json")
+
+def resolve_diem_path(ma_so_sinh_vien=None):
+    """
+    Find the grade data of a student.
+    
+    Args:
+        ma_so_sinh_vien (str, optional): Student ID
+        
+    Returns:
+        str: Converted JSON of the student's latest upload, or PATH_DIEM
+            (the most recent upload) when the student has none on record
+    """
+    if ma_so_sinh_vien:
+        content_hash = survey_store.get_grade_hash(ma_so_sinh_vien)
+        if content_hash and os.path.exists(converted_upload_path(content_hash)):
+            return converted_upload_path(content_hash)
+    return PATH_DIEM
+
 def extract_personal_info(data):
     """
     Extract personal information from survey data.
@@ -144,13 +333,42 @@ def process_survey_sections(data):
     return results
 
 # --- API Routes ---
+# --- Request Metrics ---
+@app.before_request
+def start_request_timer():
+    """Remember when the request started."""
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """
+    Record the route latency (for streaming responses, until the headers are sent).
+    
+    Args:
+        response: Flask response
+        
+    Returns:
+        The unchanged response
+    """
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started_at,
+            method=request.method,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            status=str(response.status_code)
+        )
+    return response
+
 @app.route('/api/submit-survey', methods=['POST'])
 def submit_survey():
     """
     Handle survey submission.
     
     Process personal information and survey scores,
-    calculate percentages, and save to JSON file.
+    calculate percentages, and save to the survey store. If the
+    student's grades are on record, stages 1 and 2 of the analysis are
+    then precomputed in the background.
     
     Returns:
         JSON response with success/error message
@@ -173,9 +391,9 @@ def submit_survey():
             **section_results
         }
         
-        # Save to JSON file
-        with open(PATH_KHAOSAT, 'w', encoding='utf-8') as f:
-            json.dump([results], f, ensure_ascii=False, indent=4)
+        # Save to the survey store
+        survey_store.save_submission(results)
+        start_precompute(personal_info.get("ma_so_sinh_vien"))
         
         return jsonify({"message": "Survey submitted successfully", "data": results}), 200
         
@@ -188,7 +406,15 @@ def upload_file():
     """
     Handle file upload for grade sheets.
     
-    Validate, save Excel file and convert to JSON format.
+    Validate, save Excel file and convert to JSON format. Uploads are
+    stored by content hash, so re-uploading a file that was already
+    converted reuses the existing JSON instead of parsing it again. The
+    analysis stages of the matching survey are then precomputed in the
+    background.
+    
+    Form fields:
+        file: The .xlsx grade sheet
+        ma_so_sinh_vien (optional): Student ID to attach the grades to
     
     Returns:
         JSON response with success/error message
@@ -200,18 +426,36 @@ def upload_file():
         if not is_valid:
             return jsonify({'error': error_message}), 400
         
-        # Save the file
-        filename = secure_filename('diem.xlsx')
-        file_path = os.path.join(DATABASE_DIR, filename)
-        file.save(file_path)
-        
-        # Convert Excel to JSON
-        success, message = convert_excel_to_json(file_path, PATH_DIEM)
+        # Save the file, hashing it on the way to disk
+        content_hash, tmp_path = save_upload_with_hash(file, UPLOADS_DIR)
+        json_path = converted_upload_path(content_hash)
+        deduplicated = os.path.exists(json_path)
         
-        if success:
-            return jsonify({'message': 'File uploaded and processed successfully'}), 200
+        if deduplicated:
+            os.remove(tmp_path)
         else:
-            return jsonify({'error': message}), 500
+            file_path = os.path.join(UPLOADS_DIR, secure_filename(f"{content_hash}.xlsx"))
+            os.replace(tmp_path, file_path)
+            
+            # Convert Excel to JSON (content-addressed: concurrent writers store identical data, no lock needed)
+            success, message = convert_excel_to_json(file_path, json_path, lock=False)
+            if not success:
+                return jsonify({'error': message}), 500
+        
+        # Keep diem.json pointing at the most recent upload
+        atomic_copy_file(json_path, PATH_DIEM)
+        invalidate_file_cache(PATH_DIEM)
+        
+        ma_so_sinh_vien = (request.form.get('ma_so_sinh_vien') or '').strip()
+        if ma_so_sinh_vien:
+            survey_store.set_grade_hash(ma_so_sinh_vien, content_hash)
+        start_precompute(ma_so_sinh_vien or None)
+        
+        return jsonify({
+            'message': 'File uploaded and processed successfully',
+            'content_hash': content_hash,
+            'deduplicated': deduplicated
+        }), 200
             
     except Exception as e:
         print(f"Error in upload_file: {e}")
@@ -222,16 +466,18 @@ def get_data():
     """
     Get grade data.
     
+    Query parameters:
+        ma_so_sinh_vien (optional): Student ID; defaults to the latest upload
+    
     Returns:
         JSON response with grade data or error message
     """
     try:
-        if not os.path.exists(PATH_DIEM):
+        diem_path = resolve_diem_path(request.args.get('ma_so_sinh_vien'))
+        if not os.path.exists(diem_path):
             return jsonify({'error': 'No data file found'}), 404
             
-        with open(PATH_DIEM, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_json_file(diem_path))
         
     except Exception as e:
         print(f"Error in get_data: {e}")
@@ -242,20 +488,19 @@ def get_khaosat_summary():
     """
     Get survey summary data.
     
+    Query parameters:
+        ma_so_sinh_vien (optional): Student ID; defaults to the latest submission
+    
     Returns:
         JSON response with survey data or error message
     """
     try:
-        if not os.path.exists(PATH_KHAOSAT):
-            return jsonify({'error': 'Không tìm thấy file dữ liệu khảo sát.'}), 404
-            
-        with open(PATH_KHAOSAT, 'r', encoding='utf-8') as f:
-            khaosat_data_list = json.load(f)
+        khaosat_data = survey_store.get_latest(request.args.get('ma_so_sinh_vien'))
         
-        if not khaosat_data_list:
-            return jsonify({'error': 'File khảo sát rỗng.'}), 404
+        if not khaosat_data:
+            return jsonify({'error': 'Không tìm thấy dữ liệu khảo sát.'}), 404
             
-        return jsonify(khaosat_data_list[0])
+        return jsonify(khaosat_data)
         
     except Exception as e:
         print(f"Error in get_khaosat_summary: {e}")
@@ -272,112 +517,549 @@ def start_llm_analysis_route():
     2. Academic performance analysis
     3. Comprehensive analysis and recommendations
     
+    With LLM_PIPELINE_MODE=concurrent, stages 1 and 2 run at the same time
+    (spread over OLLAMA_API_URLS when several backends are configured) and
+    stage 3 starts once both have finished. While a stage waits for a free
+    generation slot it emits ``queued`` events with its queue position; a
+    full queue is rejected with 429 and Retry-After. Each stage runs on the
+    model its route names (see LLM/model_router.py) and reports it in a
+    ``model`` event; stages 2 and 3 may fall back to the small model. A
+    transcript too long for one stage 2 prompt is summarized per group of
+    semesters first (``map_reduce``/``map_done`` events), then analysed from
+    the summaries.
+    
+    The first event carries the ``session_id`` that /api/llm-chat needs
+    to continue the conversation about this analysis.
+    
+    The analysis runs as a job on the job workers (see /api/jobs), so a
+    dropped connection does not stop it; while no worker is free the stream
+    reports the job's place in line (``job_queued`` events). Every stored
+    event has an ``id: <job_id>:<sequence>`` field; a reconnect sending that
+    ID as Last-Event-ID (as EventSource does), to this route or to any
+    process sharing the job database, gets the missed events replayed and
+    then follows the live job.
+    
+    Stages 1 and 2 are usually precomputed after the survey submission and
+    grade upload and only replayed from the cache here; a stage whose
+    precomputation is still running is waited for (``precomputing`` event).
+    
+    Query parameters:
+        ma_so_sinh_vien (optional): Student ID; defaults to the latest survey
+        bypass_cache (optional): "1"/"true" to regenerate every stage instead
+            of replaying cached outputs for unchanged inputs
+        last_event_id (optional): Same as the Last-Event-ID header
+    
     Returns:
-        Server-sent events stream with analysis results
+        Server-sent events stream with analysis results, or 429 with
+        Retry-After when too many generations or jobs are queued
     """
-    global llm_analysis_results, llm_conversation_history_stage3
+    resume_from = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if resume_from and job_queue.status(resume_from[0]):
+        return Response(job_queue.stream(resume_from[0], resume_from[1] + 1), mimetype='text/event-stream')
 
-    # Reset results for new analysis
-    llm_analysis_results = {
-        "stage1_khaosat": "",
-        "stage2_diem": "",
-        "stage3_tonghop": ""
-    }
-    llm_conversation_history_stage3 = []
+    try:
+        generation_scheduler.ensure_capacity()
+    except QueueFullError as e:
+        return queue_full_response(e)
 
     # Load data
-    khaosat_data = get_khaosat_data_from_file(PATH_KHAOSAT)
-    if not khaosat_data:
-        error_response = json.dumps({'stage': 'setup', 'error': 'Không thể đọc dữ liệu khảo sát.'})
-        return Response(f"data: {error_response}\n\n", mimetype='text/event-stream')
-
-    diem_data = get_diem_data_from_file(PATH_DIEM)
-    if not diem_data:
-        error_response = json.dumps({'stage': 'setup', 'error': 'Không thể đọc dữ liệu điểm.'})
+    khaosat_data, diem_data, error = load_analysis_inputs(request.args.get('ma_so_sinh_vien'))
+    if error:
+        error_response = json.dumps({'stage': 'setup', 'error': error})
         return Response(f"data: {error_response}\n\n", mimetype='text/event-stream')
 
-    # Generate prompts
-    payload1 = generate_prompt1_payload(khaosat_data, OLLAMA_MODEL)
-    payload2 = generate_prompt2_payload(diem_data, khaosat_data, OLLAMA_MODEL)
+    params = {
+        'ma_so_sinh_vien': khaosat_data.get("thong_tin_ca_nhan", {}).get("ma_so_sinh_vien"),
+        'bypass_cache': request.args.get('bypass_cache', '').lower() in ('1', 'true', 'yes')
+    }
+    try:
+        job_id = job_queue.submit(JOB_TYPE_ANALYSIS, params)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    return Response(job_queue.stream(job_id), mimetype='text/event-stream')
 
-    def combined_stream():
-        """
-        Stream combined analysis results.
-        
-        Yields:
-            Server-sent events with analysis progress and results
-        """
-        global llm_conversation_history_stage3
+def load_analysis_inputs(ma_so_sinh_vien=None):
+    """
+    Load the survey and grade data an analysis runs on.
+    
+    Args:
+        ma_so_sinh_vien (str, optional): Student ID; defaults to the latest survey
         
-        # Stage 1: Survey analysis
-        yield from call_ollama_stream_logic(
-            OLLAMA_API_URL, payload1, "stage1_khaosat", 
-            llm_analysis_results, llm_conversation_history_stage3
+    Returns:
+        tuple: (khaosat_data, diem_data, error message or None)
+    """
+    khaosat_data = survey_store.get_latest(ma_so_sinh_vien)
+    if not khaosat_data:
+        return None, None, 'Không thể đọc dữ liệu khảo sát.'
+
+    student_id = khaosat_data.get("thong_tin_ca_nhan", {}).get("ma_so_sinh_vien")
+    diem_data = get_diem_data_from_file(resolve_diem_path(student_id))
+    if not diem_data:
+        return khaosat_data, None, 'Không thể đọc dữ liệu điểm.'
+    return khaosat_data, diem_data, None
+
+def _session_analysis_stream(session, khaosat_data, diem_data, payload1, payload2, bypass_cache, stage2_map_reduce):
+    """
+    Produce combined analysis results for a session (consumed by an analysis job).
+    
+    Yields:
+        Server-sent events with analysis progress and results
+    """
+    with session.lock:
+        yield f"data: {json.dumps({'session_id': session.session_id})}\n\n"
+        yield from _run_analysis_stages(
+            session, khaosat_data, payload1, payload2, bypass_cache, diem_data, stage2_map_reduce
         )
+        session_manager.save(session)
+
+def build_analysis_payloads(khaosat_data, diem_data):
+    """
+    Build the stage 1 and 2 payloads exactly as an analysis would send them.
+    
+    Shared by /api/start-llm-analysis and the precomputation, so both produce
+    the same response cache keys.
+    
+    Args:
+        khaosat_data (dict): Survey data
+        diem_data (list): Subjects of the grade sheet
         
-        if llm_analysis_results.get("stage1_khaosat", "").startswith("<p style='color:red;'>"):
-            print("Stopped at stage 1 due to error.")
-            yield f"data: {json.dumps({'status': 'error_stage1'})}\n\n"
+    Returns:
+        tuple: (payload1, payload2, whether stage 2 runs as map-reduce)
+    """
+    payload1 = model_router.apply_options(TASK_STAGE1, generate_prompt1_payload(
+        khaosat_data, model_router.model_for(TASK_STAGE1), structured=LLM_STRUCTURED_OUTPUT
+    ))
+    payload2 = model_router.apply_options(TASK_STAGE2, generate_prompt2_payload(
+        diem_data, khaosat_data, model_router.model_for(TASK_STAGE2), structured=LLM_STRUCTURED_OUTPUT
+    ))
+    stage2_map_reduce = LLM_STAGE2_MAP_REDUCE == 'always' or (
+        LLM_STAGE2_MAP_REDUCE == 'auto' and stage2_needs_map_reduce(payload2)
+    )
+    if LLM_PIPELINE_MODE == 'concurrent' and len(OLLAMA_BACKEND_URLS) == 1 and not stage2_map_reduce:
+        # Different windows on one server would make Ollama reload the model between them
+        share_num_ctx([payload1, payload2])
+    return payload1, payload2, stage2_map_reduce
+
+def start_precompute(ma_so_sinh_vien=None):
+    """
+    Precompute stages 1 and 2 in the background for the data an analysis would use.
+    
+    Args:
+        ma_so_sinh_vien (str, optional): Student ID; defaults to the latest survey
+            (the same default as /api/start-llm-analysis)
+    """
+    if stage_precomputer is None:
+        return
+    threading.Thread(target=_precompute_analysis, args=(ma_so_sinh_vien,), daemon=True).start()
+
+def _precompute_analysis(ma_so_sinh_vien):
+    """
+    Load the analysis inputs and submit the stage 1/2 jobs to the precomputer.
+    
+    Jobs use the routes' main models (no fallback under load) and the
+    background priority, so they wait behind chat turns and analyses and do
+    not push those to the fallback model; the precomputer skips them when
+    the queue is busy. Stage 2 is not precomputed when it runs as
+    map-reduce: its cached output is keyed on the reduce prompt, which only
+    exists once the map summaries do.
+    
+    Args:
+        ma_so_sinh_vien (str): Student ID, or None for the latest survey
+    """
+    try:
+        khaosat_data, diem_data, error = load_analysis_inputs(ma_so_sinh_vien)
+        if error:
+            # The analysis could not start either
             return
+        student_id = khaosat_data.get("thong_tin_ca_nhan", {}).get("ma_so_sinh_vien")
+        payload1, payload2, stage2_map_reduce = build_analysis_payloads(khaosat_data, diem_data)
+    except Exception as e:
+        print(f"Warning: Could not prepare precomputation for {ma_so_sinh_vien}: {e}")
+        return
 
-        # Stage 2: Grade analysis
-        yield from call_ollama_stream_logic(
-            OLLAMA_API_URL, payload2, "stage2_diem", 
-            llm_analysis_results, llm_conversation_history_stage3
+    stage_options = {
+        'response_cache': response_cache,
+        'scheduler': generation_scheduler,
+        'priority': PRIORITY_BACKGROUND
+    }
+    stages = [("stage1_khaosat", payload1)]
+    if not stage2_map_reduce:
+        stages.append(("stage2_diem", payload2))
+    for index, (stage_key, payload) in enumerate(stages):
+        stage_precomputer.submit(
+            f"{stage_key} ({student_id})", payload,
+            lambda index=index: _stage_streams(
+                khaosat_data, diem_data, payload1, payload2, stage2_map_reduce, {}, [], stage_options
+            )[index]
         )
+
+def _after_precompute(stage_key, payload, stage_stream):
+    """
+    Wait for a running precomputation of the same stage, then run the stage (normally a cache replay).
+    
+    Args:
+        stage_key (str): Analysis stage key
+        payload (dict): Stage payload
+        stage_stream (Iterator[str]): Event stream of the stage
         
-        if llm_analysis_results.get("stage2_diem", "").startswith("<p style='color:red;'>"):
-            print("Stopped at stage 2 due to error.")
-            yield f"data: {json.dumps({'status': 'error_stage2'})}\n\n"
-            return
+    Yields:
+        Server-sent events of the stage
+    """
+    if stage_precomputer is not None and stage_precomputer.is_running(payload):
+        yield f"data: {json.dumps({'stage': stage_key, 'status': 'precomputing'})}\n\n"
+        stage_precomputer.wait_for(payload)
+    yield from stage_stream
 
-        # Stage 3: Comprehensive analysis
-        stage1_text = llm_analysis_results.get("stage1_khaosat", "Không có dữ liệu phân tích kỹ năng.")
-        stage2_text = llm_analysis_results.get("stage2_diem", "Không có dữ liệu phân tích điểm số.")
-        payload3 = generate_prompt3_payload(stage1_text, stage2_text, khaosat_data, OLLAMA_MODEL)
+def _stage_streams(khaosat_data, diem_data, payload1, payload2, stage2_map_reduce,
+                   analysis_results, conversation_history, stage_options):
+    """
+    Create the event streams of stages 1 and 2 (nothing runs until they are consumed).
+    
+    Args:
+        khaosat_data (dict): Survey data
+        diem_data (list): Subjects of the grade sheet
+        payload1 (dict): Stage 1 payload
+        payload2 (dict): Stage 2 payload (single pass; the fallback with map-reduce)
+        stage2_map_reduce (bool): Run stage 2 as map-reduce over semester chunks
+        analysis_results (dict): Receives the stage results
+        conversation_history (list): Conversation history reference
+        stage_options (dict): Keyword arguments shared by the stage calls
         
-        llm_conversation_history_stage3.clear()
-        yield from call_ollama_stream_logic(
-            OLLAMA_API_URL, payload3, "stage3_tonghop", 
-            llm_analysis_results, llm_conversation_history_stage3
+    Returns:
+        tuple: (stage 1 stream, stage 2 stream)
+    """
+    stage1_renderer = stage2_renderer = None
+    if LLM_STRUCTURED_OUTPUT:
+        stage1_renderer = lambda response: build_stage1_report(response, khaosat_data)
+        stage2_renderer = lambda response: build_stage2_report(response, diem_data)
+
+    stage1_stream = call_ollama_stream_logic(
+        OLLAMA_BACKEND_URLS[0], payload1, "stage1_khaosat", 
+        analysis_results, conversation_history, render_structured=stage1_renderer,
+        route_task=TASK_STAGE1, **stage_options
+    )
+    if stage2_map_reduce:
+        stage2_stream = _map_reduce_stage2(
+            analysis_results, conversation_history, khaosat_data, diem_data, payload2,
+            stage2_renderer, stage_options
+        )
+    else:
+        stage2_stream = call_ollama_stream_logic(
+            OLLAMA_BACKEND_URLS[1 % len(OLLAMA_BACKEND_URLS)], payload2, "stage2_diem", 
+            analysis_results, conversation_history, render_structured=stage2_renderer,
+            route_task=TASK_STAGE2, **stage_options
         )
+    return stage1_stream, stage2_stream
+
+def _run_analysis_stages(session, khaosat_data, payload1, payload2, bypass_cache=False, diem_data=None,
+                         stage2_map_reduce=False):
+    """
+    Run the three analysis stages for one session.
+    
+    With LLM_STRUCTURED_OUTPUT, stages 1 and 2 answer in JSON that is rendered
+    to markdown here, and stage 3 receives their compact JSON instead of prose.
+    
+    Args:
+        session (AnalysisSession): Session receiving results and chat history
+        khaosat_data (dict): Survey data
+        payload1 (dict): Stage 1 payload
+        payload2 (dict): Stage 2 payload
+        bypass_cache (bool): Regenerate stages even when a cached output exists
+        diem_data (list): Subjects of the grade sheet (needed to render structured stage 2
+            and for map-reduce)
+        stage2_map_reduce (bool): Run stage 2 as map-reduce over semester chunks
+            (``payload2`` is then only the fallback if a map call fails)
         
-        yield f"data: {json.dumps({'status': 'all_done'})}\n\n"
+    Yields:
+        Server-sent events with analysis progress and results
+    """
+    analysis_results = session.analysis_results
+    conversation_history = session.conversation_history
+    stage_options = {
+        'response_cache': response_cache,
+        'bypass_cache': bypass_cache,
+        'scheduler': generation_scheduler,
+        'coalesce_ms': SSE_COALESCE_MS,
+        'coalesce_bytes': SSE_COALESCE_BYTES,
+        'model_router': model_router
+    }
+
+    stage1_stream, stage2_stream = _stage_streams(
+        khaosat_data, diem_data or [], payload1, payload2, stage2_map_reduce,
+        analysis_results, conversation_history, stage_options
+    )
+    if not bypass_cache:
+        stage1_stream = _after_precompute("stage1_khaosat", payload1, stage1_stream)
+        stage2_stream = _after_precompute("stage2_diem", payload2, stage2_stream)
+
+    if LLM_PIPELINE_MODE == 'concurrent':
+        # Stages 1 and 2 are independent: run them together, tokens tagged by stage
+        yield from merge_streams([stage1_stream, stage2_stream])
+    else:
+        yield from stage1_stream
+
+    if analysis_results.get("stage1_khaosat", "").startswith("<p style='color:red;'>"):
+        print("Stopped at stage 1 due to error.")
+        stage2_stream.close()
+        yield f"data: {json.dumps({'status': 'error_stage1'})}\n\n"
+        return
+
+    if LLM_PIPELINE_MODE != 'concurrent':
+        yield from stage2_stream
+
+    if analysis_results.get("stage2_diem", "").startswith("<p style='color:red;'>"):
+        print("Stopped at stage 2 due to error.")
+        yield f"data: {json.dumps({'status': 'error_stage2'})}\n\n"
+        return
 
-    return Response(combined_stream(), mimetype='text/event-stream')
+    # Stage 3: Comprehensive analysis
+    # Structured stages hand over their compact JSON rather than the rendered report
+    stage1_text = (analysis_results.get("stage1_khaosat" + STRUCTURED_RESULT_SUFFIX)
+                   or analysis_results.get("stage1_khaosat", "Không có dữ liệu phân tích kỹ năng."))
+    stage2_text = (analysis_results.get("stage2_diem" + STRUCTURED_RESULT_SUFFIX)
+                   or analysis_results.get("stage2_diem", "Không có dữ liệu phân tích điểm số."))
+    payload3 = model_router.apply_options(TASK_STAGE3, generate_prompt3_payload(
+        stage1_text, stage2_text, khaosat_data, model_router.model_for(TASK_STAGE3)
+    ))
+    
+    conversation_history.clear()
+    yield from call_ollama_stream_logic(
+        OLLAMA_API_URL, payload3, "stage3_tonghop", 
+        analysis_results, conversation_history, route_task=TASK_STAGE3, **stage_options
+    )
+    
+    yield f"data: {json.dumps({'status': 'all_done'})}\n\n"
+
+def _map_reduce_stage2(analysis_results, conversation_history, khaosat_data, diem_data, fallback_payload,
+                       stage2_renderer, stage_options):
+    """
+    Run stage 2 as map-reduce: summarize semester chunks in parallel, then analyse the summaries.
+    
+    The map calls use the summary route's model and are spread over every
+    backend. If one fails, stage 2 falls back to ``fallback_payload`` (the
+    single-pass prompt, which Ollama truncates to the largest num_ctx).
+    
+    Args:
+        analysis_results (dict): Receives the stage result
+        conversation_history (list): Conversation history reference
+        khaosat_data (dict): Survey data
+        diem_data (list): Subjects of the grade sheet
+        fallback_payload (dict): Single-pass stage 2 payload
+        stage2_renderer (callable): Structured output renderer, or None
+        stage_options (dict): Keyword arguments shared by the stage calls
+        
+    Yields:
+        Server-sent events with map progress and the stage 2 result
+    """
+    map_payloads = [
+        (label, model_router.apply_options(TASK_SUMMARY, payload))
+        for label, payload in generate_stage2_map_payloads(
+            diem_data, khaosat_data, model_router.model_for(TASK_SUMMARY)
+        )
+    ]
+    summaries = []
+    yield from stream_map_phase(
+        "stage2_diem", map_payloads, OLLAMA_BACKEND_URLS, summaries,
+        scheduler=stage_options.get('scheduler'),
+        priority=stage_options.get('priority', PRIORITY_ANALYSIS),
+        response_cache=stage_options.get('response_cache'),
+        bypass_cache=stage_options.get('bypass_cache', False)
+    )
+    
+    payload2 = fallback_payload
+    if summaries:
+        payload2 = model_router.apply_options(TASK_STAGE2, generate_stage2_reduce_payload(
+            diem_data, khaosat_data, summaries, model_router.model_for(TASK_STAGE2),
+            structured=LLM_STRUCTURED_OUTPUT
+        ))
+    
+    yield from call_ollama_stream_logic(
+        OLLAMA_BACKEND_URLS[1 % len(OLLAMA_BACKEND_URLS)], payload2, "stage2_diem", 
+        analysis_results, conversation_history, render_structured=stage2_renderer,
+        route_task=TASK_STAGE2, **stage_options
+    )
 
 @app.route('/api/llm-chat', methods=['POST'])
 def llm_chat_route():
     """
     Handle chat with LLM.
     
-    Process user messages and stream LLM responses.
+    Process user messages and stream LLM responses. The request body must
+    carry the ``session_id`` returned by /api/start-llm-analysis (or by an
+    analysis job); a missing or unknown ID is rejected with 400. Chat turns are scheduled ahead
+    of analysis stages; a full queue is rejected with 429 and Retry-After.
+    Replies use the chat route's model, reported in a ``model`` event.
     
     Returns:
         Server-sent events stream with chat responses
     """
-    global llm_conversation_history_stage3
-    
     try:
         user_message = request.json.get('message')
         
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
         
-        if not llm_conversation_history_stage3:
+        try:
+            generation_scheduler.ensure_capacity()
+        except QueueFullError as e:
+            return queue_full_response(e)
+        
+        session_id = request.json.get('session_id')
+        if not session_id:
+            return jsonify({"error": "Thiếu session_id của phiên phân tích."}), 400
+        
+        session = session_manager.get(session_id)
+        if not session or not session.conversation_history:
             return jsonify({
                 "error": "Phân tích ban đầu chưa được thực hiện hoặc đã xảy ra lỗi. Vui lòng chạy lại phân tích."
             }), 400
 
-        return Response(
-            ollama_chat_streaming(OLLAMA_API_URL, OLLAMA_MODEL, llm_conversation_history_stage3, user_message),
-            mimetype='text/event-stream'
-        )
+        def chat_stream():
+            if not session.lock.acquire(blocking=False):
+                error_response = json.dumps({'error': 'Phiên phân tích đang bận, vui lòng thử lại sau.'})
+                yield f"data: {error_response}\n\n"
+                return
+            try:
+                yield from ollama_chat_streaming(
+                    OLLAMA_API_URL, model_router.model_for(TASK_CHAT), session.conversation_history, user_message,
+                    scheduler=generation_scheduler,
+                    coalesce_ms=SSE_COALESCE_MS,
+                    coalesce_bytes=SSE_COALESCE_BYTES,
+                    chat_summary=session.chat_summary,
+                    num_ctx=CHAT_NUM_CTX,
+                    keep_alive=OLLAMA_KEEP_ALIVE,
+                    model_router=model_router
+                )
+                session_manager.save(session)
+            finally:
+                session.lock.release()
+
+        return Response(chat_stream(), mimetype='text/event-stream')
         
     except Exception as e:
         print(f"Error in llm_chat_route: {e}")
         return jsonify({"error": str(e)}), 500
 
+# --- Background Job Routes ---
+@app.route('/api/jobs', methods=['POST'])
+def submit_job_route():
+    """
+    Queue an analysis to run on a job worker instead of in this request.
+    
+    The job runs the same stages as /api/start-llm-analysis; its progress
+    is stored with the job, so /api/jobs/<job_id>/events can be read from
+    any process sharing the job database. The ``session_id`` for
+    /api/llm-chat appears in the first event and in the finished job's result.
+    
+    Request body (JSON, optional):
+        type (optional): Job type, currently only "analysis" (default)
+        ma_so_sinh_vien (optional): Student ID; defaults to the latest survey
+        bypass_cache (optional): Regenerate every stage instead of replaying cached outputs
+    
+    Returns:
+        202 with the job ID and its status/events URLs, 400 for an unknown
+        type, or 429 with Retry-After when too many jobs are queued
+    """
+    body = request.get_json(silent=True) or {}
+    job_type = body.get('type', JOB_TYPE_ANALYSIS)
+    if job_type not in job_workers.handlers:
+        return jsonify({"error": f"Loại công việc không hợp lệ: {job_type}"}), 400
+    
+    params = {
+        'ma_so_sinh_vien': body.get('ma_so_sinh_vien'),
+        'bypass_cache': str(body.get('bypass_cache', '')).lower() in ('1', 'true', 'yes')
+    }
+    try:
+        job_id = job_queue.submit(job_type, params)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events"
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    """
+    Get a job's status.
+    
+    Returns:
+        JSON with the status (queued/running/done/failed), queue position
+        while queued, attempts, timestamps, result and error; 404 if unknown
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Không tìm thấy công việc.'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events_route(job_id):
+    """
+    Stream a job's events, from the beginning or after Last-Event-ID, until it finishes.
+    
+    Query parameters:
+        last_event_id (optional): Same as the Last-Event-ID header
+    
+    Returns:
+        Server-sent events stream (ids ``<job_id>:<sequence>``), or 404 if the job is unknown
+    """
+    if not job_queue.get(job_id):
+        return jsonify({'error': 'Không tìm thấy công việc.'}), 404
+    
+    start = 0
+    resume_from = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    if resume_from and resume_from[0] == job_id:
+        start = resume_from[1] + 1
+    return Response(job_queue.stream(job_id, start), mimetype='text/event-stream')
+
+def run_analysis_job(params, result):
+    """
+    Job handler running a full analysis.
+    
+    Args:
+        params (dict): ``ma_so_sinh_vien`` and ``bypass_cache``
+        result (dict): Receives the ``session_id``, or an ``error`` if the analysis failed
+        
+    Yields:
+        Server-sent events with analysis progress and results
+    """
+    khaosat_data, diem_data, error = load_analysis_inputs(params.get('ma_so_sinh_vien'))
+    if error:
+        result['error'] = error
+        yield f"data: {json.dumps({'stage': 'setup', 'error': error})}\n\n"
+        return
+    
+    payload1, payload2, stage2_map_reduce = build_analysis_payloads(khaosat_data, diem_data)
+    session = session_manager.create(khaosat_data.get("thong_tin_ca_nhan", {}).get("ma_so_sinh_vien"))
+    result['session_id'] = session.session_id
+    yield from _session_analysis_stream(
+        session, khaosat_data, diem_data, payload1, payload2, params.get('bypass_cache', False), stage2_map_reduce
+    )
+    
+    final_result = session.analysis_results.get("stage3_tonghop", "")
+    if not final_result or final_result.startswith("<p style='color:red;'>"):
+        result['error'] = 'Phân tích không hoàn tất.'
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Expose metrics in the Prometheus text format.
+    
+    Returns:
+        LLM stage/chat latency and throughput histograms, Ollama error and
+        timeout counters, Excel conversion and per-route request latency
+    """
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+# --- Background Job Workers ---
+# JOB_WORKERS=0 makes this process only queue jobs, for job_worker.py processes to run
+job_workers = JobWorkerPool(job_queue, {JOB_TYPE_ANALYSIS: run_analysis_job}, workers=JOB_WORKERS)
+if runs_background_services():
+    job_workers.start()
+
 # --- Application Entry Point ---
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Batch grade-sheet converter.
+This command-line tool converts a whole cohort of exported transcripts (.xlsx) to
+per-student JSON files in parallel, using a process pool.
+
+Usage:
+    python batch_convert.py <dir-or-glob> [<dir-or-glob> ...] -o <output_dir> [-w WORKERS]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from diem_converter import convert_excel_to_json, DEFAULT_ENGINE
+
+
+def collect_excel_files(inputs: List[str]) -> List[str]:
+    """
+    Expand directories (recursively) and glob patterns into a sorted list of .xlsx files.
+
+    Args:
+        inputs (List[str]): Directories, glob patterns or file paths
+
+    Returns:
+        List[str]: Unique .xlsx file paths
+    """
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '**', '*.xlsx'), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+
+        for path in matches:
+            # Skip Excel lock files such as "~$diem.xlsx"
+            if path.lower().endswith('.xlsx') and not os.path.basename(path).startswith('~$'):
+                files.add(os.path.abspath(path))
+
+    return sorted(files)
+
+
+def _assign_output_paths(excel_files: List[str], output_dir: str) -> Dict[str, str]:
+    """
+    Name each per-student JSON file after its transcript, disambiguating repeated names.
+
+    Args:
+        excel_files (List[str]): Source transcripts
+        output_dir (str): Output directory
+
+    Returns:
+        Dict[str, str]: Source path -> JSON output path
+    """
+    output_paths = {}
+    used_names = set()
+    for path in excel_files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, suffix = stem, 2
+        while name in used_names:
+            name = f"{stem}_{suffix}"
+            suffix += 1
+        used_names.add(name)
+        output_paths[path] = os.path.join(output_dir, f"{name}.json")
+    return output_paths
+
+
+def _convert_one(excel_filepath: str, json_filepath: str, engine: str) -> Tuple[str, bool, str, float]:
+    """
+    Convert one transcript (runs in a worker process).
+
+    Args:
+        excel_filepath (str): Source transcript
+        json_filepath (str): Destination JSON file
+        engine (str): Parser engine passed to convert_excel_to_json
+
+    Returns:
+        Tuple[str, bool, str, float]: (source path, success, message, seconds)
+    """
+    start = time.perf_counter()
+    try:
+        # Output paths are unique within a batch, so no lock file is needed
+        success, message = convert_excel_to_json(excel_filepath, json_filepath, engine=engine, lock=False)
+    except Exception as e:
+        success, message = False, f"Unexpected error: {e}"
+    return excel_filepath, success, message, time.perf_counter() - start
+
+
+def batch_convert(
+    excel_files: List[str],
+    output_dir: str,
+    workers: Optional[int] = None,
+    engine: str = DEFAULT_ENGINE
+) -> List[Tuple[str, str]]:
+    """
+    Convert many transcripts in parallel, reporting per-file errors without aborting.
+
+    Args:
+        excel_files (List[str]): Transcripts to convert
+        output_dir (str): Directory for the per-student JSON files
+        workers (Optional[int]): Number of worker processes (CPU count when None)
+        engine (str): Parser engine passed to convert_excel_to_json
+
+    Returns:
+        List[Tuple[str, str]]: (file, error message) for every failed file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = _assign_output_paths(excel_files, output_dir)
+
+    failures = []
+    total_bytes = sum(os.path.getsize(path) for path in excel_files)
+    busy_seconds = 0.0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_convert_one, path, output_paths[path], engine)
+            for path in excel_files
+        ]
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            path, success, message, seconds = future.result()
+            busy_seconds += seconds
+            if not success:
+                failures.append((path, message))
+                print(f"❌ {path}: {message}", file=sys.stderr)
+            if done_count % 100 == 0 or done_count == len(futures):
+                print(f"... {done_count}/{len(futures)} files")
+
+    elapsed = time.perf_counter() - start
+    converted = len(excel_files) - len(failures)
+    print(f"📊 Converted {converted}/{len(excel_files)} files in {elapsed:.2f}s "
+          f"({len(excel_files) / elapsed if elapsed else 0:.1f} files/s, "
+          f"{total_bytes / (1024 * 1024) / elapsed if elapsed else 0:.2f} MB/s, "
+          f"avg {busy_seconds / len(excel_files) * 1000 if excel_files else 0:.0f} ms per file)")
+    if failures:
+        print(f"⚠️ {len(failures)} file(s) failed", file=sys.stderr)
+
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+        argv (Optional[List[str]]): Arguments (defaults to sys.argv[1:])
+
+    Returns:
+        int: Exit status (1 when any file failed)
+    """
+    parser = argparse.ArgumentParser(description="Convert a directory or glob of .xlsx transcripts to JSON.")
+    parser.add_argument('inputs', nargs='+', help="Directories (searched recursively) or glob patterns")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory for per-student JSON files")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--engine', choices=['streaming', 'pandas'], default=DEFAULT_ENGINE,
+                        help="Excel parser engine")
+    args = parser.parse_args(argv)
+
+    excel_files = collect_excel_files(args.inputs)
+    if not excel_files:
+        print("No .xlsx files found.", file=sys.stderr)
+        return 1
+
+    print(f"🔄 Converting {len(excel_files)} file(s) with {args.workers or os.cpu_count()} worker(s)")
+    failures = batch_convert(excel_files, args.output_dir, args.workers, args.engine)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
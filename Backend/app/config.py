@@ -3,6 +3,7 @@ Configuration module for the student learning analytics system.
 This module contains all configuration constants and settings.
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -14,10 +15,23 @@ UPLOADS_DIR = DATABASE_DIR / 'uploads'
 # --- File Paths ---
 PATH_KHAOSAT = DATABASE_DIR / 'khaosat.json'
 PATH_DIEM = DATABASE_DIR / 'diem.json'
+PATH_SURVEY_DB = DATABASE_DIR / 'khaosat.db'
 
 # --- Ollama Configuration ---
 OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://192.168.2.114:11434/api/chat')
-OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'gemma2:2b')
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'gemma3:12b')  # Large tier (stages 2 and 3)
+OLLAMA_SMALL_MODEL = os.getenv('OLLAMA_SMALL_MODEL', 'gemma2:2b')  # Small tier (stage 1, chat, summaries, fallback)
+# Extra Ollama backends (comma-separated /api/chat URLs) used to spread concurrent stages
+OLLAMA_API_URLS = [url.strip() for url in os.getenv('OLLAMA_API_URLS', '').split(',') if url.strip()]
+OLLAMA_POOL_CONNECTIONS = int(os.getenv('OLLAMA_POOL_CONNECTIONS', 4))  # Ollama hosts kept in the pool
+OLLAMA_POOL_MAXSIZE = int(os.getenv('OLLAMA_POOL_MAXSIZE', 16))  # Keep-alive connections per host
+OLLAMA_POOL_BLOCK = os.getenv('OLLAMA_POOL_BLOCK', 'False').lower() == 'true'
+# How long Ollama keeps a model loaded after a request ("30m", "1h", or seconds; -1 = always)
+_keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m').strip()
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip('-').isdigit() else _keep_alive
+# Preload models at startup and touch them again every N seconds (0 = only at startup)
+OLLAMA_WARMUP_ENABLED = os.getenv('OLLAMA_WARMUP_ENABLED', 'True').lower() == 'true'
+OLLAMA_WARMUP_INTERVAL = int(os.getenv('OLLAMA_WARMUP_INTERVAL', 600))
 
 # --- Flask Configuration ---
 FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
@@ -50,7 +64,52 @@ LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 # --- LLM Configuration ---
 LLM_TIMEOUT = int(os.getenv('LLM_TIMEOUT', 400))
 CHAT_TIMEOUT = int(os.getenv('CHAT_TIMEOUT', 180))
-MAX_CHAT_HISTORY = int(os.getenv('MAX_CHAT_HISTORY', 10))
+CHAT_NUM_CTX = int(os.getenv('CHAT_NUM_CTX', 4096))  # Chat history is fitted to this window by estimated tokens
+# Context sizes (num_ctx) analysis stages may use; each stage takes the smallest that fits its prompt
+LLM_NUM_CTX_LADDER = [int(size) for size in os.getenv('LLM_NUM_CTX_LADDER', '2048,3072,4096,6144,8192').split(',') if size.strip()]
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 128))
+LLM_CACHE_DIR = DATABASE_DIR / 'llm_cache'
+# Generate stages 1 and 2 into the cache right after a survey submission or grade upload,
+# unless this many generations are already waiting
+LLM_PRECOMPUTE_ENABLED = os.getenv('LLM_PRECOMPUTE_ENABLED', 'True').lower() == 'true'
+LLM_PRECOMPUTE_MAX_QUEUE = int(os.getenv('LLM_PRECOMPUTE_MAX_QUEUE', 2))
+# 'sequential' runs stage 1 then stage 2; 'concurrent' runs them at the same time
+LLM_PIPELINE_MODE = os.getenv('LLM_PIPELINE_MODE', 'concurrent').lower()
+# Stages 1 and 2 answer in JSON (Ollama format schema), rendered server-side; stage 3 gets the compact JSON
+LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'False').lower() == 'true'
+# Stage 2 map-reduce over semester chunks: 'auto' when the prompt exceeds the largest num_ctx, 'always', 'never'
+LLM_STAGE2_MAP_REDUCE = os.getenv('LLM_STAGE2_MAP_REDUCE', 'auto').lower()
+# Per-task overrides of the model routes, as JSON keyed by stage1/stage2/stage3/chat/summary, e.g.
+# {"chat": {"model": "gemma3:12b", "fallback_model": "gemma2:2b", "options": {"temperature": 0.6}}}
+LLM_MODEL_ROUTES = json.loads(os.getenv('LLM_MODEL_ROUTES', '') or '{}')
+# Routes with a fallback switch to it at this many waiting generations (0 = never) ...
+LLM_FALLBACK_QUEUE_DEPTH = int(os.getenv('LLM_FALLBACK_QUEUE_DEPTH', 4))
+# ... or while their recent mean time to first token exceeds this many seconds (0 = never)
+LLM_FALLBACK_TTFT_SLO = float(os.getenv('LLM_FALLBACK_TTFT_SLO', 15))
+LLM_FALLBACK_LATENCY_WINDOW = int(os.getenv('LLM_FALLBACK_LATENCY_WINDOW', 300))  # Seconds latency samples count
+# Token coalescing for SSE: flush buffered tokens every N ms or M bytes (both 0 = one frame per token)
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', 50))
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', 512))
+
+# --- Generation Scheduler Configuration ---
+SCHEDULER_MAX_CONCURRENT = int(os.getenv('SCHEDULER_MAX_CONCURRENT', 2))  # Generations running on Ollama at once
+SCHEDULER_MAX_QUEUE = int(os.getenv('SCHEDULER_MAX_QUEUE', 32))  # Waiting generations before rejecting with 429
+SCHEDULER_RETRY_AFTER = int(os.getenv('SCHEDULER_RETRY_AFTER', 30))  # Retry-After seconds sent with 429
+
+# --- Session Configuration ---
+PATH_SESSION_DB = DATABASE_DIR / 'sessions.db'
+SESSION_MAX_ACTIVE = int(os.getenv('SESSION_MAX_ACTIVE', 200))
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', 3600))
+
+# --- Job Queue Configuration ---
+PATH_JOB_DB = DATABASE_DIR / 'jobs.db'
+# Worker threads running analyses (from /api/start-llm-analysis and /api/jobs) in this process;
+# 0 only queues them, for job_worker.py processes sharing jobs.db to run
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', 64))  # Queued jobs before rejecting with 429
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))  # Runs of a job whose worker died before it is failed
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 86400))  # Seconds finished jobs and their events are kept
 
 # Ensure directories exist
 DATABASE_DIR.mkdir(exist_ok=True)
@@ -4,10 +4,15 @@ This module converts Excel grade files to structured JSON format for analysis.
 """
 
 import pandas as pd
-import json
 import re
-import os
-from typing import Tuple, Dict, Any, Optional, List
+import time
+from typing import Tuple, Dict, Any, Optional, List, Iterable, Iterator
+
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+from metrics import EXCEL_CONVERSION_SECONDS
+from storage import atomic_write_json
 
 
 # Constants
@@ -16,6 +21,16 @@ YEAR_PATTERN = r'Năm học\s*(\d{4})\s*-\s*(\d{4})'
 COURSE_HEADER = ["Stt", "Mã MH", "Nhóm/tổ môn học", "Tên môn học", "Số tín chỉ",
                  "Điểm thi", "Điểm TK (10)", "Điểm TK (4)", "Điểm TK (C)", "Kết quả", "Chi tiết"]
 
+# Parser engines: "streaming" reads rows with openpyxl in read-only mode,
+# "pandas" loads the whole sheet into a DataFrame (kept for comparison)
+DEFAULT_ENGINE = "streaming"
+
+# Cell strings pandas turns into NaN when reading with dtype=str (its default na_values)
+PANDAS_NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+}
+
 # Semester code mapping
 SEMESTER_CODE_MAP = {
     "1": "1", "I": "1",
@@ -200,17 +215,80 @@ def _process_excel_rows(df: pd.DataFrame) -> List[Dict[str, Any]]:
     Args:
         df (pd.DataFrame): Excel data as DataFrame
         
+    Returns:
+        List[Dict[str, Any]]: List of semester data
+    """
+    rows = (
+        [str(x).strip() if pd.notna(x) and x is not None else "" for x in row_series]
+        for _, row_series in df.iterrows()
+    )
+    return _process_rows(rows)
+
+
+def _cell_to_str(cell: Any) -> str:
+    """
+    Convert an openpyxl cell to the string pandas would produce with dtype=str.
+    
+    Args:
+        cell: Read-only openpyxl cell
+        
+    Returns:
+        str: Stripped cell text ("" for empty, error and NA-like cells)
+    """
+    value = cell.value
+    if value is None or cell.data_type == TYPE_ERROR:
+        return ""
+
+    if cell.data_type == TYPE_NUMERIC and not isinstance(value, bool):
+        # pandas stores whole numbers as int (3.0 -> "3")
+        int_value = int(value)
+        if int_value == value:
+            value = int_value
+
+    text = str(value)
+    if text in PANDAS_NA_STRINGS:
+        return ""
+    return text.strip()
+
+
+def _iter_sheet_rows(workbook: Any) -> Iterator[List[str]]:
+    """
+    Stream the first worksheet's rows as lists of strings.
+    
+    Only the columns used by the parser are read, and rows are padded to
+    that width so they match the pandas rows for everything downstream.
+    
+    Args:
+        workbook: openpyxl workbook opened in read-only mode
+        
+    Yields:
+        List[str]: Row values
+    """
+    sheet = workbook.worksheets[0]
+    sheet.reset_dimensions()  # Some exporters write stale dimensions; read every row
+    width = len(COURSE_HEADER)
+
+    for row in sheet.iter_rows(max_col=width):
+        row_values = [_cell_to_str(cell) for cell in row]
+        if len(row_values) < width:
+            row_values.extend([""] * (width - len(row_values)))
+        yield row_values
+
+
+def _process_rows(rows: Iterable[List[str]]) -> List[Dict[str, Any]]:
+    """
+    Run the header/course/summary state machine over sheet rows.
+    
+    Args:
+        rows (Iterable[List[str]]): Row values as stripped strings
+        
     Returns:
         List[Dict[str, Any]]: List of semester data
     """
     ds_diem_hocky = []
     current_semester_obj = None
 
-    for idx, row_series in df.iterrows():
-        row_values = [
-            str(x).strip() if pd.notna(x) and x is not None else "" 
-            for x in row_series
-        ]
+    for row_values in rows:
         first_cell = row_values[0]
 
         if not first_cell:
@@ -254,26 +332,59 @@ def _process_excel_rows(df: pd.DataFrame) -> List[Dict[str, Any]]:
     return ds_diem_hocky
 
 
-def convert_excel_to_json(excel_filepath: str, json_filepath: str) -> Tuple[bool, str]:
+def convert_excel_to_json(
+    excel_filepath: str, 
+    json_filepath: str, 
+    engine: str = DEFAULT_ENGINE,
+    lock: bool = True
+) -> Tuple[bool, str]:
     """
     Main function to read Excel file, process data and export to JSON.
     
     Args:
         excel_filepath (str): Path to Excel file
         json_filepath (str): Path to save JSON file
+        engine (str): "streaming" (openpyxl read-only row iterator) or "pandas"
+        lock (bool): Serialize with other writers of the JSON file (set False when
+            no other writer can target the same path, to avoid a ``.lock`` file beside it)
         
     Returns:
         Tuple[bool, str]: (Success status, Message)
     """
+    start = time.perf_counter()
+    success, message = _convert_excel_to_json(excel_filepath, json_filepath, engine, lock)
+    EXCEL_CONVERSION_SECONDS.observe(
+        time.perf_counter() - start, engine=engine, status="success" if success else "error"
+    )
+    return success, message
+
+
+def _convert_excel_to_json(excel_filepath: str, json_filepath: str, engine: str, lock: bool) -> Tuple[bool, str]:
+    """
+    Read, process and export one Excel file (see ``convert_excel_to_json``).
+    
+    Args:
+        excel_filepath (str): Path to Excel file
+        json_filepath (str): Path to save JSON file
+        engine (str): Parser engine
+        lock (bool): Serialize with other writers of the JSON file
+        
+    Returns:
+        Tuple[bool, str]: (Success status, Message)
+    """
+    workbook = None
     try:
         # Read Excel file
-        df = pd.read_excel(
-            excel_filepath, 
-            sheet_name=0, 
-            header=None, 
-            names=range(25), 
-            dtype=str
-        )
+        if engine == "pandas":
+            df = pd.read_excel(
+                excel_filepath, 
+                sheet_name=0, 
+                header=None, 
+                names=range(25), 
+                dtype=str
+            )
+        else:
+            workbook = load_workbook(excel_filepath, read_only=True, data_only=True)
     except FileNotFoundError:
         error_msg = f"Excel file not found: '{excel_filepath}'"
         print(f"Error: {error_msg}")
@@ -285,7 +396,10 @@ def convert_excel_to_json(excel_filepath: str, json_filepath: str) -> Tuple[bool
 
     try:
         # Process Excel data
-        ds_diem_hocky = _process_excel_rows(df)
+        if workbook is not None:
+            ds_diem_hocky = _process_rows(_iter_sheet_rows(workbook))
+        else:
+            ds_diem_hocky = _process_excel_rows(df)
         
         # Sort semesters by year and semester (newest first)
         ds_diem_hocky.sort(key=lambda s: (
@@ -303,18 +417,15 @@ def convert_excel_to_json(excel_filepath: str, json_filepath: str) -> Tuple[bool
             }
         }
 
-        # Ensure output directory exists
-        output_dir = os.path.dirname(json_filepath)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-
-        # Save JSON file
-        with open(json_filepath, 'w', encoding='utf-8') as f:
-            json.dump(final_output_data, f, ensure_ascii=False, indent=4)
+        # Save JSON file (atomically, so readers never see a partial file)
+        atomic_write_json(json_filepath, final_output_data, lock=lock)
             
         return True, "File processed successfully"
         
     except Exception as e:
         error_msg = f"Error saving JSON file: {str(e)}"
         print(f"Error: {error_msg}")
-        return False, error_msg 
\ No newline at end of file
+        return False, error_msg
+    finally:
+        if workbook is not None:
+            workbook.close()
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Analysis job worker.
+This command-line tool runs queued analyses from the shared job database without serving
+HTTP, for deployments whose web processes only queue jobs (JOB_WORKERS=0). A job
+interrupted by stopping the worker is requeued once its heartbeat goes stale.
+
+Usage:
+    python job_worker.py [-w WORKERS]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+        argv (Optional[List[str]]): Arguments (defaults to sys.argv[1:])
+
+    Returns:
+        int: Exit status (1 when no worker can run)
+    """
+    parser = argparse.ArgumentParser(description="Run queued analysis jobs from the job database.")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Worker threads (default: JOB_WORKERS)")
+    args = parser.parse_args(argv)
+
+    if args.workers is not None:
+        os.environ['JOB_WORKERS'] = str(args.workers)
+    # Imported here so the worker count above is what the configuration reads. The
+    # application module holds the analysis handler and the state it shares (scheduler,
+    # model routes, sessions, caches); importing it starts its job workers and model warmer.
+    import app
+
+    if app.job_workers.workers <= 0:
+        print("No job workers to run (JOB_WORKERS=0).", file=sys.stderr)
+        return 1
+    app.job_workers.start()
+
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("👋 Stopping job workers")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
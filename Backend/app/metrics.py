@@ -0,0 +1,279 @@
+"""
+Metrics registry module.
+This module provides thread-safe counters and histograms and renders them in the
+Prometheus text exposition format for the /metrics endpoint.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Iterator, Optional, Tuple
+
+
+# Constants
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+GENERATION_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 180.0, 300.0, 600.0)
+TOKENS_PER_SECOND_BUCKETS = (1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 40.0, 60.0, 80.0, 120.0)
+PROMPT_TOKEN_BUCKETS = (256, 512, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 12288, 16384)
+CONTEXT_FILL_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.25)
+CONVERSION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class holding the name, help text and label names of a metric family."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """
+        Render the metric family.
+
+        Returns:
+            List[str]: Exposition format lines
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount (float): Non-negative increment
+            **labels: Label values
+        """
+        key = self._label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record one observation.
+
+        Args:
+            value (float): Observed value
+            **labels: Label values
+        """
+        key = self._label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observe the duration of a block in seconds.
+
+        Args:
+            **labels: Label values
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+
+        lines = []
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metric families rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """
+        Get or create a counter.
+
+        Args:
+            name (str): Metric name
+            documentation (str): Help text
+            labelnames (Tuple[str, ...]): Label names
+
+        Returns:
+            Counter: Registered counter
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+        """
+        Get or create a histogram.
+
+        Args:
+            name (str): Metric name
+            documentation (str): Help text
+            labelnames (Tuple[str, ...]): Label names
+            buckets (Optional[Tuple[float, ...]]): Upper bounds (request latency buckets by default)
+
+        Returns:
+            Histogram: Registered histogram
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets or LATENCY_BUCKETS))
+
+    def render(self) -> str:
+        """
+        Render every metric family.
+
+        Returns:
+            str: Prometheus text exposition
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# LLM generations (task = analysis stage key or "chat")
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds", "Time from sending the Ollama request to the first token.",
+    ("task",), TTFT_BUCKETS
+)
+LLM_GENERATION_SECONDS = REGISTRY.histogram(
+    "llm_generation_seconds", "Time from sending the Ollama request to the done chunk.",
+    ("task",), GENERATION_BUCKETS
+)
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "llm_tokens_per_second", "Generated tokens per second (Ollama eval rate when reported).",
+    ("task",), TOKENS_PER_SECOND_BUCKETS
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter(
+    "llm_generated_tokens_total", "Tokens generated by Ollama.", ("task",)
+)
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    "llm_prompt_tokens", "Prompt size: our estimate before sending, Ollama's prompt_eval_count after.",
+    ("task", "source"), PROMPT_TOKEN_BUCKETS
+)
+LLM_CONTEXT_FILL_RATIO = REGISTRY.histogram(
+    "llm_context_fill_ratio", "Estimated prompt tokens divided by the request's num_ctx.",
+    ("task",), CONTEXT_FILL_BUCKETS
+)
+LLM_MODEL_GENERATIONS_TOTAL = REGISTRY.counter(
+    "llm_model_generations_total", "Generations started per routed task and serving model.", ("task", "model")
+)
+LLM_MODEL_FALLBACKS_TOTAL = REGISTRY.counter(
+    "llm_model_fallbacks_total", "Generations routed to the fallback model, by reason.", ("task", "reason")
+)
+OLLAMA_ERRORS_TOTAL = REGISTRY.counter(
+    "ollama_errors_total", "Failed Ollama requests by error type.", ("task", "error_type")
+)
+OLLAMA_TIMEOUTS_TOTAL = REGISTRY.counter(
+    "ollama_timeouts_total", "Ollama requests that timed out.", ("task",)
+)
+
+# Background jobs (/api/jobs)
+JOB_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "job_queue_wait_seconds", "Time a job spent queued before a worker claimed it.",
+    ("job_type",), GENERATION_BUCKETS
+)
+JOBS_FINISHED_TOTAL = REGISTRY.counter(
+    "jobs_finished_total", "Jobs finished by this process's workers, by outcome.", ("job_type", "status")
+)
+
+# Grade sheet conversion
+EXCEL_CONVERSION_SECONDS = REGISTRY.histogram(
+    "excel_conversion_seconds", "Duration of convert_excel_to_json.",
+    ("engine", "status"), CONVERSION_BUCKETS
+)
+
+# Flask routes (streaming responses are timed until their headers are sent)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Flask request latency per route.",
+    ("method", "route", "status")
+)
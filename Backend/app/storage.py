@@ -0,0 +1,172 @@
+"""
+Atomic file storage helpers.
+This module writes data files through a temporary file that is fsynced and renamed over
+the target, under an inter-process lock, so readers never see a half-written file.
+"""
+
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+# Constants
+LOCK_SUFFIX = '.lock'
+REPLACE_RETRIES = 5            # Windows refuses to replace a file another process has open
+REPLACE_RETRY_SECONDS = 0.05
+LOCK_POLL_SECONDS = 0.05
+DEFAULT_FILE_MODE = 0o666      # Mode of a new file before the umask, as open() would create it
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive inter-process lock for a file (via ``<path>.lock``).
+
+    Args:
+        path (str): File the lock protects
+    """
+    lock_path = str(path) + LOCK_SUFFIX
+    with open(lock_path, 'a+b') as lock_file:
+        if os.name == 'nt':
+            # msvcrt.LK_LOCK gives up after 10 seconds, so keep retrying
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(LOCK_POLL_SECONDS)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _replace(src: str, dst: str) -> None:
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_SECONDS)
+
+
+def _current_umask() -> int:
+    # os.umask can only be read by setting it, so set it straight back
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once: changing the umask briefly is not safe while other threads create files
+_UMASK = _current_umask()
+
+
+def _target_mode(path: str) -> int:
+    """Permission bits a rewritten file should keep: the existing file's, or the umask default."""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return DEFAULT_FILE_MODE & ~_UMASK
+
+
+def _fsync_directory(directory: str) -> None:
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: str, data: bytes, lock: bool = True) -> None:
+    """
+    Replace a file's content atomically.
+
+    Args:
+        path (str): Target file
+        data (bytes): New content
+        lock (bool): Serialize with other writers of the same file (set False for
+            content-addressed files, where concurrent writers store identical data)
+
+    Raises:
+        OSError: If the file cannot be written
+    """
+    path = str(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    def _write() -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(os, 'fchmod'):
+                    # mkstemp creates the file owner-only (0600); keep the target's permissions instead
+                    os.fchmod(f.fileno(), _target_mode(path))
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            _replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(directory)
+
+    if lock:
+        with file_lock(path):
+            _write()
+    else:
+        _write()
+
+
+def atomic_write_json(path: str, data: Any, lock: bool = True, indent: Optional[int] = None) -> None:
+    """
+    Write JSON atomically (compact by default).
+
+    Args:
+        path (str): Target file
+        data (Any): JSON-serializable data
+        lock (bool): Serialize with other writers of the same file
+        indent (Optional[int]): Pretty-print indentation; compact separators when None
+
+    Raises:
+        OSError: If the file cannot be written
+        TypeError: If the data is not JSON-serializable
+    """
+    separators = (',', ':') if indent is None else None
+    text = json.dumps(data, ensure_ascii=False, indent=indent, separators=separators)
+    atomic_write_bytes(path, text.encode('utf-8'), lock=lock)
+
+
+def atomic_copy_file(src: str, dst: str) -> None:
+    """
+    Copy a file over another atomically.
+
+    Args:
+        src (str): Source file
+        dst (str): Target file
+
+    Raises:
+        OSError: If either file cannot be accessed
+    """
+    with open(src, 'rb') as f:
+        atomic_write_bytes(dst, f.read())
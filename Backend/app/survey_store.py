@@ -0,0 +1,232 @@
+"""
+Survey storage module.
+This module keeps every survey submission in an embedded SQLite database indexed by student ID,
+replacing the single-record khaosat.json file. It also records which converted grade
+file (by content hash) belongs to each student.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+# Constants
+BUSY_TIMEOUT_MS = 5000
+DEFAULT_LATEST_CACHE_SIZE = 128
+
+SCHEMA_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS survey_submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ma_so_sinh_vien TEXT NOT NULL,
+        thoi_gian_nop TEXT,
+        data TEXT NOT NULL
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_survey_submissions_mssv
+        ON survey_submissions (ma_so_sinh_vien, id)""",
+    """CREATE TABLE IF NOT EXISTS student_grades (
+        ma_so_sinh_vien TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )"""
+]
+
+
+class SurveyStore:
+    """
+    Indexed survey submission store backed by SQLite in WAL mode.
+
+    Each thread gets its own connection so readers never block each other;
+    writes are serialized through a lock and SQLite's own writer lock.
+    Decoded ``get_latest`` results are kept in a small LRU keyed by the row
+    they came from; every read first looks up the current row ID (an index
+    lookup), so submissions written by other processes are seen immediately.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        legacy_json_path: Optional[str] = None,
+        latest_cache_size: int = DEFAULT_LATEST_CACHE_SIZE
+    ):
+        """
+        Open (and create if needed) the survey database.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            legacy_json_path (Optional[str]): Old khaosat.json to import when the database is empty
+            latest_cache_size (int): Decoded submissions kept in memory
+        """
+        self.db_path = str(db_path)
+        self.latest_cache_size = latest_cache_size
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        # Student ID (None = overall) -> (row ID, decoded submission)
+        self._latest_cache: "OrderedDict[Optional[str], Tuple[int, Dict[str, Any]]]" = OrderedDict()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            for statement in SCHEMA_STATEMENTS:
+                conn.execute(statement)
+
+        if legacy_json_path and self.count() == 0:
+            self.import_legacy_json(str(legacy_json_path))
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get the connection owned by the current thread.
+
+        Returns:
+            sqlite3.Connection: Thread-local database connection
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save_submission(self, results: Dict[str, Any]) -> int:
+        """
+        Append a survey submission.
+
+        Args:
+            results (Dict[str, Any]): Processed survey results (same shape as a khaosat.json entry)
+
+        Returns:
+            int: Row ID of the stored submission
+        """
+        personal_info = results.get("thong_tin_ca_nhan") or {}
+        ma_so_sinh_vien = str(personal_info.get("ma_so_sinh_vien") or "").strip()
+
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO survey_submissions (ma_so_sinh_vien, thoi_gian_nop, data) VALUES (?, ?, ?)",
+                    (ma_so_sinh_vien, results.get("thoi_gian_nop"), json.dumps(results, ensure_ascii=False))
+                )
+        return cursor.lastrowid
+
+    def get_latest(self, ma_so_sinh_vien: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the most recent submission, optionally for one student.
+
+        Args:
+            ma_so_sinh_vien (Optional[str]): Student ID; when omitted the newest submission overall is returned
+
+        Returns:
+            Optional[Dict[str, Any]]: Survey data (shared, do not modify) or None if nothing matches
+        """
+        cache_key = str(ma_so_sinh_vien).strip() if ma_so_sinh_vien else None
+
+        conn = self._connect()
+        if cache_key:
+            row = conn.execute(
+                "SELECT id FROM survey_submissions WHERE ma_so_sinh_vien = ? ORDER BY id DESC LIMIT 1",
+                (cache_key,)
+            ).fetchone()
+        else:
+            row = conn.execute("SELECT MAX(id) FROM survey_submissions").fetchone()
+        if not row or row[0] is None:
+            return None
+        row_id = row[0]
+
+        with self._cache_lock:
+            cached = self._latest_cache.get(cache_key)
+            if cached and cached[0] == row_id:
+                self._latest_cache.move_to_end(cache_key)
+                return cached[1]
+
+        data_row = conn.execute("SELECT data FROM survey_submissions WHERE id = ?", (row_id,)).fetchone()
+        if not data_row:
+            return None
+        data = json.loads(data_row[0])
+        with self._cache_lock:
+            self._latest_cache[cache_key] = (row_id, data)
+            self._latest_cache.move_to_end(cache_key)
+            while len(self._latest_cache) > self.latest_cache_size:
+                self._latest_cache.popitem(last=False)
+        return data
+
+    def count(self) -> int:
+        """
+        Count stored submissions.
+
+        Returns:
+            int: Number of submissions
+        """
+        return self._connect().execute("SELECT COUNT(*) FROM survey_submissions").fetchone()[0]
+
+    def set_grade_hash(self, ma_so_sinh_vien: str, content_hash: str) -> None:
+        """
+        Point a student's record at an uploaded grade sheet's converted data.
+
+        Args:
+            ma_so_sinh_vien (str): Student ID
+            content_hash (str): SHA-256 of the uploaded .xlsx file
+        """
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO student_grades (ma_so_sinh_vien, content_hash) VALUES (?, ?)",
+                    (str(ma_so_sinh_vien).strip(), content_hash)
+                )
+
+    def get_grade_hash(self, ma_so_sinh_vien: str) -> Optional[str]:
+        """
+        Get the content hash of a student's latest grade upload.
+
+        Args:
+            ma_so_sinh_vien (str): Student ID
+
+        Returns:
+            Optional[str]: Content hash or None if the student has not uploaded grades
+        """
+        row = self._connect().execute(
+            "SELECT content_hash FROM student_grades WHERE ma_so_sinh_vien = ?",
+            (str(ma_so_sinh_vien).strip(),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def import_legacy_json(self, json_path: str) -> int:
+        """
+        Import submissions from an old khaosat.json file.
+
+        Args:
+            json_path (str): Path to the legacy survey JSON file
+
+        Returns:
+            int: Number of imported submissions
+        """
+        if not os.path.exists(json_path):
+            return 0
+
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Could not import legacy survey file {json_path}: {e}")
+            return 0
+
+        if not isinstance(entries, list):
+            return 0
+
+        imported = 0
+        for entry in entries:
+            if isinstance(entry, dict):
+                self.save_submission(entry)
+                imported += 1
+
+        print(f"Imported {imported} survey submission(s) from {json_path}")
+        return imported
@@ -0,0 +1,337 @@
+"""
+End-to-end streaming benchmark.
+This tool drives /api/start-llm-analysis and /api/llm-chat through the real Flask app
+against the stub Ollama server and reports SSE frames per second, added latency per
+token and CPU time per stream, plus micro-benchmarks of the per-token hot path.
+
+Usage:
+    python bench_streaming.py [--sessions 4] [--concurrency 2] [--chats 2]
+                              [--tokens 200] [--rate 0] [--json-output results.json]
+
+The app reads its data from Backend/Database, so a survey must have been submitted
+and a grade sheet uploaded before running the benchmark.
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from stub_ollama import build_arg_parser
+
+
+# Constants
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "app")
+STUB_SCRIPT = os.path.join(BENCHMARKS_DIR, "stub_ollama.py")
+STUB_STARTUP_TIMEOUT = 10.0
+MICRO_ITERATIONS = 100000
+TOKEN_STAMP_RE = re.compile(r"\[t=(\d+\.\d+)\]")
+CHAT_MESSAGE = "Tôi nên cải thiện kỹ năng nào trước?"
+
+
+class StreamStats:
+    """Frame timing of one SSE response."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started_at = time.time()
+        self.finished_at = self.started_at
+        self.frames = 0
+        self.tokens = 0
+        self.token_latencies: List[float] = []
+        self.session_id: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return max(self.finished_at - self.started_at, 1e-9)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_process(args: argparse.Namespace) -> (subprocess.Popen, str):
+    """
+    Run the stub in its own process so its CPU time is not counted as backend overhead.
+
+    Args:
+        args (argparse.Namespace): Parsed benchmark options (stub settings included)
+
+    Returns:
+        Tuple[subprocess.Popen, str]: Stub process and its /api/chat URL
+    """
+    port = _free_port()
+    command = [
+        sys.executable, STUB_SCRIPT, "--port", str(port),
+        "--tokens", str(args.tokens), "--token-size", str(args.token_size),
+        "--rate", str(args.rate), "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate), "--error-mode", args.error_mode
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    deadline = time.time() + STUB_STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}/api/chat"
+        except OSError:
+            time.sleep(0.05)
+
+    process.kill()
+    raise RuntimeError("Stub Ollama server did not start")
+
+
+def load_app(stub_url: str, concurrency: int):
+    """
+    Import the Flask app and point it at the stub.
+
+    Args:
+        stub_url (str): Stub /api/chat URL
+        concurrency (int): Number of concurrent benchmark sessions
+
+    Returns:
+        module: The configured ``app`` module
+    """
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    import app as app_module
+    from LLM.scheduler import GenerationScheduler
+
+    app_module.OLLAMA_API_URL = stub_url
+    app_module.OLLAMA_BACKEND_URLS = [stub_url]
+    # Every run must reach the stub, and the scheduler must not be the bottleneck
+    app_module.response_cache = None
+    app_module.generation_scheduler = GenerationScheduler(
+        max_concurrent=max(2, concurrency * 2), max_queue=concurrency * 4
+    )
+    return app_module
+
+
+def consume_sse(response, stats: StreamStats) -> StreamStats:
+    """
+    Read an SSE response frame by frame, timing every token.
+
+    Args:
+        response: Unbuffered Flask test response
+        stats (StreamStats): Stats object to fill
+
+    Returns:
+        StreamStats: The filled stats
+    """
+    buffer = ""
+    if response.status_code != 200:
+        stats.error = f"HTTP {response.status_code}"
+    try:
+        for chunk in response.response:
+            received_at = time.time()
+            buffer += chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+            while "\n\n" in buffer:
+                frame, buffer = buffer.split("\n\n", 1)
+                stats.frames += 1
+                data_lines = [line[6:] for line in frame.split("\n") if line.startswith("data: ")]
+                if not data_lines:
+                    continue
+                event = json.loads("\n".join(data_lines))
+                if event.get("session_id"):
+                    stats.session_id = event["session_id"]
+                if event.get("error") and not stats.error:
+                    stats.error = event["error"]
+                stamps = TOKEN_STAMP_RE.findall(event.get("token", ""))
+                stats.tokens += len(stamps)
+                stats.token_latencies.extend(received_at - float(stamp) for stamp in stamps)
+    finally:
+        response.close()
+        stats.finished_at = time.time()
+    return stats
+
+
+def run_session(client, chats: int) -> List[StreamStats]:
+    """
+    Run one analysis followed by chat turns about it.
+
+    Args:
+        client: Flask test client
+        chats (int): Chat turns after the analysis
+
+    Returns:
+        List[StreamStats]: One entry per stream
+    """
+    results = []
+    analysis = StreamStats("analysis")
+    consume_sse(client.get("/api/start-llm-analysis", buffered=False), analysis)
+    results.append(analysis)
+
+    for _ in range(chats):
+        chat = StreamStats("chat")
+        response = client.post(
+            "/api/llm-chat",
+            json={"message": CHAT_MESSAGE, "session_id": analysis.session_id},
+            buffered=False
+        )
+        consume_sse(response, chat)
+        results.append(chat)
+    return results
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(streams: List[StreamStats], wall_seconds: float, cpu_seconds: float) -> Dict[str, Any]:
+    """
+    Aggregate stream stats per kind.
+
+    Args:
+        streams (List[StreamStats]): All measured streams
+        wall_seconds (float): Wall time of the whole run
+        cpu_seconds (float): Process CPU time of the whole run
+
+    Returns:
+        Dict[str, Any]: Report
+    """
+    total_frames = sum(stream.frames for stream in streams)
+    report = {
+        "streams": len(streams),
+        "errors": sum(1 for stream in streams if stream.error),
+        "wall_seconds": round(wall_seconds, 3),
+        "frames_per_second": round(total_frames / wall_seconds, 1) if wall_seconds else 0.0,
+        "cpu_ms_per_stream": round(cpu_seconds * 1000 / len(streams), 2) if streams else 0.0,
+        "cpu_us_per_frame": round(cpu_seconds * 1e6 / total_frames, 2) if total_frames else 0.0,
+        "kinds": {}
+    }
+
+    for kind in sorted({stream.kind for stream in streams}):
+        selected = [stream for stream in streams if stream.kind == kind]
+        latencies = [latency for stream in selected for latency in stream.token_latencies]
+        report["kinds"][kind] = {
+            "streams": len(selected),
+            "errors": sum(1 for stream in selected if stream.error),
+            "frames": sum(stream.frames for stream in selected),
+            "tokens": sum(stream.tokens for stream in selected),
+            "frames_per_second_per_stream": round(
+                sum(stream.frames / stream.duration for stream in selected) / len(selected), 1
+            ),
+            "added_latency_ms_p50": round(_percentile(latencies, 0.50) * 1000, 3),
+            "added_latency_ms_p95": round(_percentile(latencies, 0.95) * 1000, 3),
+            "added_latency_ms_max": round(max(latencies, default=0.0) * 1000, 3)
+        }
+    return report
+
+
+def run_micro_benchmarks(iterations: int) -> Dict[str, float]:
+    """
+    Time the per-token hot path: SSE formatting and NDJSON decoding.
+
+    Args:
+        iterations (int): Calls per measurement
+
+    Returns:
+        Dict[str, float]: Nanoseconds per call
+    """
+    from LLM.ollama_interactions import _format_sse_data
+
+    event = {"stage": "stage2_diem", "token": " học"}
+    line = json.dumps({
+        "model": "gemma3:12b", "created_at": "2025-01-01T00:00:00Z",
+        "message": {"role": "assistant", "content": " học"}, "done": False
+    }).encode("utf-8")
+
+    format_seconds = timeit.timeit(lambda: _format_sse_data(event), number=iterations)
+    decode_seconds = timeit.timeit(lambda: json.loads(line.decode("utf-8")), number=iterations)
+    return {
+        "format_sse_data_ns": round(format_seconds * 1e9 / iterations, 1),
+        "ndjson_line_decode_ns": round(decode_seconds * 1e9 / iterations, 1)
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """
+    Print a human-readable report.
+
+    Args:
+        report (Dict[str, Any]): Output of ``summarize`` plus micro-benchmarks
+    """
+    print(f"📊 {report['streams']} stream(s) in {report['wall_seconds']}s, "
+          f"{report['errors']} with errors")
+    print(f"   SSE frames/s (all streams): {report['frames_per_second']}")
+    print(f"   CPU per stream: {report['cpu_ms_per_stream']} ms, per frame: {report['cpu_us_per_frame']} µs")
+    for kind, stats in report["kinds"].items():
+        print(f"   [{kind}] {stats['streams']} stream(s), {stats['frames']} frames, {stats['tokens']} tokens, "
+              f"{stats['frames_per_second_per_stream']} frames/s per stream")
+        print(f"   [{kind}] added latency per token: p50 {stats['added_latency_ms_p50']} ms, "
+              f"p95 {stats['added_latency_ms_p95']} ms, max {stats['added_latency_ms_max']} ms")
+    micro = report.get("micro", {})
+    if micro:
+        print(f"   _format_sse_data: {micro['format_sse_data_ns']} ns/call, "
+              f"NDJSON line json.loads: {micro['ndjson_line_decode_ns']} ns/call")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command-line entry point.
+
+    Args:
+        argv (Optional[List[str]]): Arguments (defaults to sys.argv[1:])
+
+    Returns:
+        int: Exit status (1 when any stream reported an error)
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the backend's SSE streaming overhead.")
+    parser.add_argument("--sessions", type=int, default=4, help="Analyses to run")
+    parser.add_argument("--concurrency", type=int, default=2, help="Sessions running at once")
+    parser.add_argument("--chats", type=int, default=2, help="Chat turns after each analysis")
+    parser.add_argument("--micro-iterations", type=int, default=MICRO_ITERATIONS,
+                        help="Calls per micro-benchmark (0 to skip)")
+    parser.add_argument("--json-output", help="Also write the report to this JSON file")
+    build_arg_parser(parser)
+    args = parser.parse_args(argv)
+    if args.json_output:
+        args.json_output = os.path.abspath(args.json_output)
+
+    stub_process, stub_url = start_stub_process(args)
+    try:
+        app_module = load_app(stub_url, args.concurrency)
+        client = app_module.app.test_client()
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(run_session, client, args.chats) for _ in range(args.sessions)]
+            streams = [stream for future in futures for stream in future.result()]
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+    finally:
+        stub_process.terminate()
+        stub_process.wait()
+
+    report = summarize(streams, wall_seconds, cpu_seconds)
+    if args.micro_iterations:
+        report["micro"] = run_micro_benchmarks(args.micro_iterations)
+    print_report(report)
+
+    if args.json_output:
+        with open(args.json_output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for stream in streams:
+        if stream.error:
+            print(f"❌ {stream.kind}: {stream.error}", file=sys.stderr)
+            break
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Stub Ollama server for benchmarks.
+This module serves a stand-in for Ollama's /api/chat that streams NDJSON tokens at a
+configurable rate, size and latency, with optional error injection, so the backend's
+own overhead can be measured without a GPU. Requests with a JSON schema ``format`` get a
+minimal document matching the schema.
+
+Usage:
+    python stub_ollama.py [--port 11500] [--tokens 200] [--token-size 4] [--rate 50]
+                          [--latency 0.2] [--error-rate 0.0] [--error-mode http|disconnect]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+# Constants
+DEFAULT_PORT = 11500
+DEFAULT_TOKENS = 200
+DEFAULT_TOKEN_SIZE = 4        # Characters per token
+DEFAULT_RATE = 50.0           # Tokens per second (0 = as fast as possible)
+DEFAULT_LATENCY = 0.2         # Seconds before the first token (prompt evaluation)
+ERROR_MODES = ("http", "disconnect")
+
+# Tokens carry their send time so the driver can measure added latency per token
+TOKEN_STAMP_FORMAT = "[t={:.6f}]"
+
+
+def make_token(size: int, stamp: bool) -> str:
+    """
+    Build one token of the requested size.
+
+    Args:
+        size (int): Minimum number of characters
+        stamp (bool): Prefix the token with its send time
+
+    Returns:
+        str: Token text
+    """
+    text = TOKEN_STAMP_FORMAT.format(time.time()) if stamp else ""
+    return text + "x" * max(size - len(text), 0)
+
+
+def example_from_schema(schema: Dict[str, Any]) -> Any:
+    """
+    Build a minimal value that matches a JSON schema (as Ollama's ``format`` would).
+
+    Args:
+        schema (Dict[str, Any]): JSON schema (object, array, string, number, integer, boolean)
+
+    Returns:
+        Any: Matching value
+    """
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {key: example_from_schema(properties.get(key, {})) for key in schema.get("required", properties)}
+    if schema_type == "array":
+        return [example_from_schema(schema.get("items", {})) for _ in range(max(schema.get("minItems", 1), 1))]
+    if schema_type in ("number", "integer"):
+        return 0
+    if schema_type == "boolean":
+        return False
+    return "x"
+
+
+class StubSettings:
+    """Behaviour of the stub server, shared by all request handlers."""
+
+    def __init__(
+        self,
+        tokens: int = DEFAULT_TOKENS,
+        token_size: int = DEFAULT_TOKEN_SIZE,
+        rate: float = DEFAULT_RATE,
+        latency: float = DEFAULT_LATENCY,
+        error_rate: float = 0.0,
+        error_mode: str = "http",
+        stamp: bool = True
+    ):
+        """
+        Args:
+            tokens (int): Tokens per response
+            token_size (int): Characters per token
+            rate (float): Tokens per second (0 streams without pauses)
+            latency (float): Delay before the first token, in seconds
+            error_rate (float): Fraction of requests that fail
+            error_mode (str): "http" answers 500, "disconnect" drops the stream halfway
+            stamp (bool): Embed send times in tokens
+        """
+        self.tokens = tokens
+        self.token_size = token_size
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_mode = error_mode
+        self.stamp = stamp
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Handler for POST /api/chat."""
+
+    protocol_version = "HTTP/1.1"
+    settings = StubSettings()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _write_chunk(self, obj: Dict[str, Any]) -> None:
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _respond_whole(self, request_body: Dict[str, Any]) -> None:
+        """Answer a ``"stream": false`` request (e.g. chat summaries) with one JSON body."""
+        settings = self.settings
+        time.sleep(settings.latency + (settings.tokens / settings.rate if settings.rate > 0 else 0.0))
+        if isinstance(request_body.get("format"), dict):
+            content = json.dumps(example_from_schema(request_body["format"]), ensure_ascii=False)
+        else:
+            content = "".join(make_token(settings.token_size, False) for _ in range(settings.tokens))
+        body = json.dumps({
+            "model": request_body.get("model", ""),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "eval_count": settings.tokens
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        settings = self.settings
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = json.loads(self.rfile.read(length) or b"{}")
+
+        fail = settings.error_rate > 0 and random.random() < settings.error_rate
+        if fail and settings.error_mode == "http":
+            body = json.dumps({"error": "injected failure"}).encode("utf-8")
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if request_body.get("stream") is False:
+            self._respond_whole(request_body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        schema_document = None
+        if isinstance(request_body.get("format"), dict):
+            schema_document = json.dumps(example_from_schema(request_body["format"]), ensure_ascii=False)
+        token_count = settings.tokens
+        if schema_document is not None:
+            token_count = -(-len(schema_document) // max(settings.token_size, 1))
+
+        time.sleep(settings.latency)
+        interval = 1.0 / settings.rate if settings.rate > 0 else 0.0
+        eval_started = time.perf_counter()
+        for index in range(token_count):
+            if fail and index == token_count // 2:
+                # Injected disconnect: stop without the terminating chunk
+                self.close_connection = True
+                return
+            if schema_document is not None:
+                size = max(settings.token_size, 1)
+                token = schema_document[index * size:(index + 1) * size]
+            else:
+                token = make_token(settings.token_size, settings.stamp)
+            self._write_chunk({
+                "model": request_body.get("model", ""),
+                "message": {"role": "assistant", "content": token},
+                "done": False
+            })
+            if interval:
+                time.sleep(interval)
+
+        self._write_chunk({
+            "model": request_body.get("model", ""),
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "eval_count": token_count,
+            "eval_duration": int((time.perf_counter() - eval_started) * 1e9)
+        })
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(
+    settings: StubSettings,
+    host: str = "127.0.0.1",
+    port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the stub in a background thread (port 0 picks a free port).
+
+    Args:
+        settings (StubSettings): Server behaviour
+        host (str): Bind address
+        port (int): Bind port
+
+    Returns:
+        Tuple[ThreadingHTTPServer, str]: Running server and its /api/chat URL
+    """
+    handler = type("ConfiguredStubOllamaHandler", (StubOllamaHandler,), {"settings": settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/chat"
+
+
+def build_arg_parser(parser: Optional[argparse.ArgumentParser] = None) -> argparse.ArgumentParser:
+    """
+    Add the stub options to a parser (shared with the benchmark driver).
+
+    Args:
+        parser (Optional[argparse.ArgumentParser]): Parser to extend; a new one when omitted
+
+    Returns:
+        argparse.ArgumentParser: Parser with the stub options
+    """
+    parser = parser or argparse.ArgumentParser(description="Stub Ollama /api/chat server.")
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS, help="Tokens per response")
+    parser.add_argument("--token-size", type=int, default=DEFAULT_TOKEN_SIZE, help="Characters per token")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Tokens per second (0 = unthrottled)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds before the first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-mode", choices=ERROR_MODES, default="http", help="How injected failures look")
+    return parser
+
+
+def settings_from_args(args: argparse.Namespace) -> StubSettings:
+    """
+    Build stub settings from parsed arguments.
+
+    Args:
+        args (argparse.Namespace): Parsed options from ``build_arg_parser``
+
+    Returns:
+        StubSettings: Server behaviour
+    """
+    return StubSettings(
+        tokens=args.tokens,
+        token_size=args.token_size,
+        rate=args.rate,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_mode=args.error_mode
+    )
+
+
+def main() -> None:
+    """Command-line entry point."""
+    parser = build_arg_parser()
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Bind port")
+    args = parser.parse_args()
+
+    handler = type("ConfiguredStubOllamaHandler", (StubOllamaHandler,), {"settings": settings_from_args(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}/api/chat")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -110,6 +110,7 @@ const AnalysisPage = () => {
   const stage2Ref = useRef(null);
   const stage3Ref = useRef(null);
   const activeStageRef = useRef(null); // To know which stage is currently being updated
+  const sessionIdRef = useRef(null); // Analysis session used by the follow-up chat
 
   const handleLogoClick = () => {
     navigate('/');
@@ -259,7 +260,12 @@ const AnalysisPage = () => {
     setAnalysisStages(initialStages);
     setChatHistory([]);
 
-    const eventSource = new EventSource('http://localhost:5000/api/start-llm-analysis', { method: 'POST' });
+    // Analyse the student who submitted the survey (with their uploaded grades), not the latest one overall
+    const studentId = localStorage.getItem('studentId');
+    const analysisUrl = studentId
+      ? `http://localhost:5000/api/start-llm-analysis?ma_so_sinh_vien=${encodeURIComponent(studentId)}`
+      : 'http://localhost:5000/api/start-llm-analysis';
+    const eventSource = new EventSource(analysisUrl, { method: 'POST' });
     let currentStageKey = null; // Will be 'stage1_khaosat', 'stage2_diem', or 'stage3_tonghop'
     let stageBuffers = { stage1_khaosat: '', stage2_diem: '', stage3_tonghop: '' };
 
@@ -267,6 +273,22 @@ const AnalysisPage = () => {
       try {
         const data = JSON.parse(event.data);
 
+        if (data.session_id) {
+          // A new analysis (also sent when the server could not resume the old one)
+          sessionIdRef.current = data.session_id;
+          stageBuffers = { stage1_khaosat: '', stage2_diem: '', stage3_tonghop: '' };
+          setAnalysisStages(initialStages);
+          return;
+        }
+
+        setError('');
+
+        if (data.status === 'job_queued') {
+          // Every analysis worker is busy; the analysis starts when its turn comes
+          setAnalysisStages(prev => ({ ...prev, stage1_khaosat: `Đang chờ đến lượt phân tích (vị trí ${data.position})...` }));
+          return;
+        }
+
         if (data.error) {
           setError(data.error);
           setAnalysisStages(prev => ({
@@ -284,6 +306,10 @@ const AnalysisPage = () => {
           else if (currentStageKey === 'stage2_diem') activeStageRef.current = stage2Ref.current;
           else if (currentStageKey === 'stage3_tonghop') activeStageRef.current = stage3Ref.current;
           
+          if (data.status === 'queued') {
+            setAnalysisStages(prev => ({ ...prev, [data.stage]: `Đang chờ đến lượt xử lý (vị trí ${data.queue_position})...` }));
+          }
+
           if (data.token) {
             stageBuffers[data.stage] += data.token;
             setAnalysisStages(prev => ({ ...prev, [data.stage]: stageBuffers[data.stage] }));
@@ -306,6 +332,12 @@ const AnalysisPage = () => {
     };
 
     eventSource.onerror = (err) => {
+      if (eventSource.readyState === EventSource.CONNECTING) {
+        // The browser reconnects with Last-Event-ID and the server resumes the stream
+        console.warn("EventSource reconnecting:", err);
+        setError("Mất kết nối, đang kết nối lại...");
+        return;
+      }
       console.error("EventSource failed:", err);
       setError("Lỗi kết nối đến server phân tích.");
       setIsLoading(false);
@@ -327,7 +359,7 @@ const AnalysisPage = () => {
       const response = await fetch('http://localhost:5000/api/llm-chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: userMessage.content })
+        body: JSON.stringify({ message: userMessage.content, session_id: sessionIdRef.current })
       });
 
       if (!response.ok || !response.body) {
@@ -123,6 +123,10 @@ const FileUpload = () => {
 
     const formData = new FormData();
     formData.append('file', selectedFile);
+    const studentId = localStorage.getItem('studentId');
+    if (studentId) {
+      formData.append('ma_so_sinh_vien', studentId);
+    }
 
     try {
       await axios.post('http://localhost:5000/api/upload-file', formData, {
@@ -363,6 +363,8 @@ const Survey = () => {
         
         setSubmitStatus({ type: 'success', message: 'Khảo sát đã được gửi thành công!' });
         clearLocalStorage();
+        // Kept after the survey is cleared so the grade upload is attached to this student
+        localStorage.setItem('studentId', formData.ma_so_sinh_vien);
         
         // Wait for 2 seconds to show the success message before navigating
         setTimeout(() => {